@@ -4,14 +4,19 @@ Módulo de autenticación y seguridad.
 Este módulo maneja toda la lógica relacionada con:
 - Generación y verificación de tokens JWT
 - Hash y verificación de contraseñas
+- Caché de tokens ya verificados y el principal autenticado
 - Configuración de seguridad de la aplicación
 """
 
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import hashlib
 
@@ -38,6 +43,24 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
 # Utiliza bcrypt como algoritmo de hash
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Formato de token por defecto al hacer login:
+# - "legacy": un único access token de larga duración (comportamiento original)
+# - "profile": access token corto con un snapshot del perfil + refresh token
+TOKEN_FORMAT = os.getenv("TOKEN_FORMAT", "legacy").lower()
+
+# Duración del access token en formato "profile" (15 minutos)
+PROFILE_TOKEN_EXPIRE_MINUTES = int(os.getenv("PROFILE_TOKEN_EXPIRE_MINUTES", "15"))
+
+# Duración del refresh token (30 días)
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+# Versión del snapshot de perfil embebido en el token. Si cambia la forma del
+# snapshot, se incrementa y los tokens antiguos vuelven a consultar la BD.
+PROFILE_CLAIMS_VERSION = 1
+
+# Máximo de tokens verificados que se mantienen en memoria (0 desactiva la caché)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -129,6 +152,58 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+def create_profile_tokens(data: dict, profile: dict, token_version: int) -> dict:
+    """
+    Crea el par de tokens del formato "profile".
+
+    - access token: corta duración, incluye un snapshot versionado del perfil
+      (claim `profile`) para responder `/me` sin consultar la BD.
+    - refresh token: larga duración, solo sirve en `/api/auth/refresh`.
+
+    Ambos llevan `tv` (token_version del usuario). Al revocar, el admin
+    incrementa `token_version` y los refresh tokens existentes dejan de servir;
+    los access tokens vigentes expiran solos en pocos minutos.
+
+    Args:
+        data (dict): Claims base (sub, role, user_id, ...)
+        profile (dict): Datos del perfil a embeber en el token
+        token_version (int): Versión actual de tokens del usuario
+
+    Returns:
+        dict: {"access_token", "refresh_token", "expires_in"}
+    """
+    access_expires = timedelta(minutes=PROFILE_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={
+            **data,
+            "typ": "access",
+            "tv": token_version,
+            "profile": {**profile, "v": PROFILE_CLAIMS_VERSION},
+        },
+        expires_delta=access_expires
+    )
+    refresh_token = create_access_token(
+        data={**data, "typ": "refresh", "tv": token_version},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "expires_in": int(access_expires.total_seconds()),
+    }
+
+
+def get_profile_claims(payload: dict) -> Optional[dict]:
+    """
+    Retorna el snapshot de perfil del token si existe y su versión es la
+    actual; None si el token no lo trae (formato "legacy") o está desactualizado.
+    """
+    profile = payload.get("profile")
+    if isinstance(profile, dict) and profile.get("v") == PROFILE_CLAIMS_VERSION:
+        return profile
+    return None
+
+
 def decode_access_token(token: str) -> Optional[dict]:
     """
     Decodifica y verifica un token JWT.
@@ -153,3 +228,117 @@ def decode_access_token(token: str) -> Optional[dict]:
         # Token inválido, expirado o con firma incorrecta
         return None
 
+
+# ============================================================================
+# CACHÉ DE TOKENS VERIFICADOS
+# ============================================================================
+
+class TokenCache:
+    """
+    Caché LRU de payloads JWT ya verificados.
+
+    Cada entrada expira exactamente en el `exp` del token, así que un token
+    vencido nunca se sirve desde la caché. Los clientes que consultan la API
+    muchas veces por minuto evitan repetir la verificación HMAC y el parseo JSON.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        """Retorna el payload cacheado si el token sigue vigente"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return payload
+
+    def set(self, token: str, payload: dict) -> None:
+        """Guarda un payload verificado; los tokens sin `exp` no se cachean"""
+        expires_at = payload.get("exp")
+        if self.max_size <= 0 or not isinstance(expires_at, (int, float)):
+            return
+        with self._lock:
+            self._entries[token] = (payload, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Instancia global de la caché de tokens
+token_cache = TokenCache()
+
+
+def decode_access_token_cached(token: str) -> Optional[dict]:
+    """
+    Igual que `decode_access_token`, pero consulta primero la caché de tokens
+    verificados. Solo los tokens válidos se guardan en la caché.
+    """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    payload = decode_access_token(token)
+    if payload is not None:
+        token_cache.set(token, payload)
+    return payload
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    Usuario autenticado a partir de un token JWT.
+
+    Attributes:
+        user_id: ID interno (students.id o admins.id)
+        subject: Claim `sub` (código estudiantil o username)
+        role: "student" o "admin"
+        is_superuser: Solo aplica a administradores
+        claims: Payload completo del token
+    """
+    user_id: int
+    subject: str
+    role: str
+    is_superuser: bool = False
+    claims: dict = field(default_factory=dict, compare=False, repr=False)
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == "admin"
+
+    @property
+    def is_student(self) -> bool:
+        return self.role == "student"
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> Optional["Principal"]:
+        """Construye el principal desde el payload; None si faltan claims obligatorios"""
+        user_id = payload.get("user_id")
+        subject = payload.get("sub")
+        role = payload.get("role")
+        if user_id is None or not subject or role not in ("student", "admin"):
+            return None
+        # Los refresh tokens no sirven como credencial de acceso
+        if payload.get("typ") == "refresh":
+            return None
+        return cls(
+            user_id=int(user_id),
+            subject=subject,
+            role=role,
+            is_superuser=bool(payload.get("is_superuser", False)),
+            claims=payload
+        )
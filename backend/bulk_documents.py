@@ -0,0 +1,154 @@
+"""
+Operaciones masivas sobre documentos (editar o eliminar muchos a la vez).
+
+Editar o eliminar documento por documento cuesta una petición HTTP, una
+transacción y, al eliminar, un `delete_object` contra el storage por cada
+uno. Aquí los documentos se eligen por lista de IDs o por filtro y:
+
+- Los cambios de metadata se aplican en una sola transacción (los listeners
+  de catalog.py y tagging.py mantienen contadores, tags y versión al día)
+- Las filas se eliminan en una sola transacción y los archivos después, con
+  `StorageService.delete_files` (lotes de hasta 1000 keys por petición);
+  los archivos que otro documento sigue usando se conservan (ver dedup.py)
+
+Si falla el borrado de algún archivo la fila ya no existe: el documento se
+reporta como `storage_error` y el archivo queda huérfano en el bucket.
+
+Configuración (variables de entorno):
+- BULK_DOCUMENTS_MAX: máximo de documentos por operación (por defecto 5000)
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+import dedup
+import models
+import schemas
+from tagging import parse_tags, tag_filter
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+BULK_DOCUMENTS_MAX = int(os.getenv("BULK_DOCUMENTS_MAX", "5000"))
+
+
+class BulkSelectionError(ValueError):
+    """La selección de documentos es inválida o demasiado grande"""
+
+
+def _filter_conditions(document_filter: schemas.DocumentFilter) -> List:
+    conditions = []
+    if document_filter.category:
+        conditions.append(models.Document.category == document_filter.category)
+    if document_filter.status:
+        conditions.append(models.Document.status == models.DocumentStatus(document_filter.status.value))
+    tag_names = parse_tags(",".join(document_filter.tags or []))
+    if tag_names:
+        conditions.append(tag_filter(tag_names))
+    if document_filter.created_after:
+        conditions.append(models.Document.created_at >= document_filter.created_after)
+    if document_filter.created_before:
+        conditions.append(models.Document.created_at < document_filter.created_before)
+    return conditions
+
+
+def select_documents(
+    db: Session,
+    selection: schemas.DocumentBulkSelection
+) -> Tuple[List[models.Document], List[int]]:
+    """
+    Carga en una sola consulta los documentos seleccionados.
+    Retorna (documentos, IDs pedidos que no existen).
+    """
+    if (selection.ids is None) == (selection.filter is None):
+        raise BulkSelectionError("Indica ids o filter (solo uno de los dos)")
+
+    query = db.query(models.Document)
+
+    if selection.ids is not None:
+        ids = list(dict.fromkeys(selection.ids))
+        if not ids:
+            raise BulkSelectionError("La lista de ids está vacía")
+        if len(ids) > BULK_DOCUMENTS_MAX:
+            raise BulkSelectionError(f"Máximo {BULK_DOCUMENTS_MAX} documentos por operación")
+        documents = query.filter(models.Document.id.in_(ids)).order_by(models.Document.id).all()
+        found = {document.id for document in documents}
+        return documents, [document_id for document_id in ids if document_id not in found]
+
+    conditions = _filter_conditions(selection.filter)
+    if not conditions:
+        # Un filtro vacío seleccionaría todo el catálogo
+        raise BulkSelectionError("El filtro debe tener al menos un criterio")
+    documents = query.filter(*conditions).order_by(models.Document.id).limit(BULK_DOCUMENTS_MAX + 1).all()
+    if len(documents) > BULK_DOCUMENTS_MAX:
+        raise BulkSelectionError(
+            f"El filtro selecciona más de {BULK_DOCUMENTS_MAX} documentos; acótalo o usa varios lotes"
+        )
+    return documents, []
+
+
+def _not_found(missing: List[int]) -> List[dict]:
+    return [{"id": document_id, "status": "not_found", "detail": "Documento no encontrado"} for document_id in missing]
+
+
+def update_documents(db: Session, selection: schemas.DocumentBulkSelection, changes: dict) -> List[dict]:
+    """Aplica los mismos cambios a todos los documentos seleccionados en una transacción"""
+    if not changes:
+        raise BulkSelectionError("No hay cambios que aplicar")
+    if changes.get("status") is not None:
+        changes["status"] = models.DocumentStatus(changes["status"].value)
+
+    documents, missing = select_documents(db, selection)
+    for document in documents:
+        for field, value in changes.items():
+            setattr(document, field, value)
+    db.commit()
+
+    return [{"id": document.id, "status": "updated"} for document in documents] + _not_found(missing)
+
+
+def delete_document_rows(
+    db: Session,
+    selection: schemas.DocumentBulkSelection
+) -> Tuple[Dict[int, Optional[str]], List[str], List[int]]:
+    """
+    Elimina las filas seleccionadas en una transacción.
+    Retorna ({id: storage_key} de los eliminados, keys que ya no usa ningún
+    documento, IDs que no existen).
+    """
+    documents, missing = select_documents(db, selection)
+    deleted = {document.id: document.storage_key for document in documents}
+    for document in documents:
+        db.delete(document)
+    db.commit()
+    return deleted, dedup.pop_released_keys(db), missing
+
+
+def delete_results(
+    deleted: Dict[int, Optional[str]],
+    storage_errors: Dict[str, Optional[str]],
+    missing: List[int]
+) -> List[dict]:
+    """Resultado por documento a partir de lo que retornó `StorageService.delete_files`"""
+    results = []
+    for document_id, storage_key in deleted.items():
+        error = storage_errors.get(storage_key) if storage_key else None
+        if error:
+            results.append({"id": document_id, "status": "storage_error", "detail": error})
+        else:
+            results.append({"id": document_id, "status": "deleted"})
+    return results + _not_found(missing)
+
+
+def summarize(results: List[dict], elapsed_seconds: float) -> dict:
+    succeeded = sum(1 for result in results if result["status"] in ("updated", "deleted"))
+    return {
+        "requested": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "results": results,
+    }
@@ -0,0 +1,351 @@
+"""
+Importación masiva de estudiantes y administradores.
+
+Pensado para cargar el listado de matrícula completo (decenas de miles de
+usuarios) desde un CSV o NDJSON:
+- Lee el archivo en streaming y procesa por lotes (BULK_IMPORT_BATCH_SIZE)
+- Detecta usuarios existentes con una sola consulta por lote (IN (...))
+- Hashea las contraseñas en el pool de hashing, de a HASH_BULK_WINDOW a la vez
+  desde la API para que los logins no queden detrás del lote (ver hashing.py);
+  la CLI no compite con logins y usa todos los workers
+- Inserta con executemany y semántica de upsert (ON CONFLICT) en PostgreSQL/SQLite,
+  en una transacción corta que se abre después del hash (no se retienen
+  conexión ni locks mientras bcrypt trabaja)
+- Reporta filas por segundo
+
+Uso:
+    python bulk_import.py students matricula.csv
+    python bulk_import.py admins admins.ndjson --update-existing
+    cat matricula.csv | python bulk_import.py students - --format csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, or_, select
+
+import models
+from hashing import HASH_BULK_WINDOW, hash_passwords
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+# Filas por lote (una consulta de existencia + un executemany por lote)
+BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "1000"))
+
+# Máximo de errores detallados que se incluyen en el reporte
+MAX_REPORTED_ERRORS = 100
+
+# Configuración por tipo de usuario: modelo, clave natural y campos esperados
+USER_KINDS = {
+    "students": {
+        "model": models.Student,
+        "key": "student_id",
+        "fields": ("student_id", "full_name", "email"),
+    },
+    "admins": {
+        "model": models.Admin,
+        "key": "username",
+        "fields": ("username", "full_name", "email", "is_superuser"),
+    },
+}
+
+_TRUE_VALUES = {"1", "true", "t", "yes", "y", "si", "sí", "s"}
+
+
+@dataclass
+class ImportReport:
+    """Resultado de una importación masiva"""
+    kind: str
+    processed: int = 0
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    failed: int = 0
+    elapsed_seconds: float = 0.0
+    errors: List[dict] = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return self.processed / self.elapsed_seconds
+
+    def add_error(self, row_number: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+            "errors": self.errors,
+        }
+
+
+def detect_format(filename: Optional[str]) -> str:
+    """Deduce el formato por la extensión del archivo (csv por defecto)"""
+    if filename and os.path.splitext(filename)[1].lower() in (".ndjson", ".jsonl"):
+        return "ndjson"
+    return "csv"
+
+
+def read_records(stream: IO[bytes], fmt: str = "csv") -> Iterator[dict]:
+    """
+    Itera los registros de un archivo CSV (con encabezado) o NDJSON sin
+    cargarlo completo en memoria.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "ndjson":
+        for line in text:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    elif fmt == "csv":
+        yield from csv.DictReader(text)
+    else:
+        raise ValueError(f"Formato no soportado: {fmt} (usa csv o ndjson)")
+
+
+def _normalize_row(kind: str, raw: dict) -> dict:
+    """Valida y limpia una fila; lanza ValueError si faltan campos"""
+    spec = USER_KINDS[kind]
+    row = {}
+    for name in spec["fields"]:
+        value = raw.get(name)
+        if name == "is_superuser":
+            row[name] = str(value).strip().lower() in _TRUE_VALUES if value is not None else False
+            continue
+        value = str(value).strip() if value is not None else ""
+        if not value:
+            raise ValueError(f"Falta el campo '{name}'")
+        row[name] = value
+    password = str(raw.get("password") or "")
+    if len(password) < 6:
+        raise ValueError("La contraseña debe tener al menos 6 caracteres")
+    row["password"] = password
+    return row
+
+
+def _upsert_statement(dialect_name: str, table, key: str, update_existing: bool):
+    """
+    Construye el INSERT con semántica de upsert para el dialecto actual.
+    Retorna None si el dialecto no soporta ON CONFLICT.
+    """
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+
+    stmt = dialect_insert(table)
+    if not update_existing:
+        return stmt.on_conflict_do_nothing(index_elements=[key])
+    updatable = [c.name for c in table.columns if c.name in ("full_name", "email", "hashed_password", "is_superuser")]
+    return stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={name: stmt.excluded[name] for name in updatable}
+    )
+
+
+def _import_batch(engine, kind: str, batch: List[tuple], report: ImportReport, update_existing: bool,
+                  hash_window: int) -> None:
+    """Procesa un lote: consulta de existencia, hash en paralelo y executemany"""
+    spec = USER_KINDS[kind]
+    model = spec["model"]
+    key = spec["key"]
+    table = model.__table__
+    key_column = table.c[key]
+
+    # Deduplicar dentro del lote (gana la última aparición)
+    by_key: Dict[str, tuple] = {}
+    for row_number, row in batch:
+        if row[key] in by_key:
+            report.add_error(by_key[row[key]][0], f"{key} duplicado en el archivo")
+        by_key[row[key]] = (row_number, row)
+
+    # Una sola consulta para todos los usuarios existentes del lote (sin
+    # transacción abierta: el hash de abajo tarda y no debe retener la conexión)
+    with engine.connect() as conn:
+        existing_rows = conn.execute(
+            select(key_column, table.c.email).where(
+                or_(
+                    key_column.in_(list(by_key)),
+                    table.c.email.in_([row["email"] for _, row in by_key.values()])
+                )
+            )
+        ).all()
+    existing_keys = {r[0] for r in existing_rows}
+    email_owner = {r[1]: r[0] for r in existing_rows}
+
+    to_write = []
+    for row_number, row in by_key.values():
+        owner = email_owner.get(row["email"])
+        if owner is not None and owner != row[key]:
+            report.add_error(row_number, f"El email {row['email']} ya pertenece a otro usuario")
+            continue
+        email_owner[row["email"]] = row[key]
+        if row[key] in existing_keys and not update_existing:
+            report.skipped += 1
+            continue
+        to_write.append(row)
+
+    if not to_write:
+        return
+
+    # Hash en paralelo (solo de las filas que realmente se van a escribir)
+    hashed = hash_passwords((row["password"] for row in to_write), window=hash_window)
+    params = []
+    for row, hashed_password in zip(to_write, hashed):
+        values = {name: row[name] for name in spec["fields"]}
+        values["hashed_password"] = hashed_password
+        params.append(values)
+
+    # Transacción corta solo para escribir; ON CONFLICT resuelve los usuarios
+    # que otra importación creó mientras se hasheaba
+    with engine.begin() as conn:
+        stmt = _upsert_statement(conn.dialect.name, table, key, update_existing)
+        written = None
+        if stmt is None:
+            # Dialecto sin ON CONFLICT: insertar solo los nuevos
+            params = [p for p in params if p[key] not in existing_keys]
+            if params:
+                conn.execute(insert(table), params)
+        elif not update_existing:
+            # ON CONFLICT DO NOTHING + RETURNING trae solo las filas insertadas
+            written = set(conn.execute(stmt.returning(key_column), params).scalars())
+        else:
+            conn.execute(stmt, params)
+
+    if written is not None:
+        report.inserted += len(written)
+        report.skipped += len(to_write) - len(written)
+        return
+    updated = sum(1 for row in to_write if row[key] in existing_keys)
+    report.updated += updated
+    report.inserted += len(to_write) - updated
+
+
+def import_users(
+    kind: str,
+    records: Iterable[dict],
+    engine=None,
+    batch_size: int = BULK_IMPORT_BATCH_SIZE,
+    update_existing: bool = False,
+    progress: Optional[Callable[[ImportReport], None]] = None,
+    hash_window: int = HASH_BULK_WINDOW,
+) -> ImportReport:
+    """
+    Importa estudiantes o administradores por lotes.
+
+    Cada lote se confirma en su propia transacción: si el proceso se
+    interrumpe, los lotes anteriores ya quedan guardados y volver a ejecutar
+    la importación los omite (o los actualiza con `update_existing`).
+
+    Args:
+        kind: "students" o "admins"
+        records: Iterable de diccionarios (ver `read_records`)
+        engine: Engine de SQLAlchemy (por defecto, el de database.py)
+        batch_size: Filas por lote
+        update_existing: Si True, actualiza nombre, email y contraseña de los existentes
+        progress: Callback opcional que recibe el reporte tras cada lote
+        hash_window: Hashes en el pool a la vez (ver `hashing.hash_passwords`)
+
+    Returns:
+        ImportReport: Conteos, errores y filas por segundo
+    """
+    if kind not in USER_KINDS:
+        raise ValueError(f"Tipo inválido: {kind} (usa students o admins)")
+    if engine is None:
+        from database import engine
+
+    report = ImportReport(kind=kind)
+    started = time.perf_counter()
+    batch: List[tuple] = []
+
+    def flush():
+        _import_batch(engine, kind, batch, report, update_existing, hash_window)
+        batch.clear()
+        report.elapsed_seconds = time.perf_counter() - started
+        if progress:
+            progress(report)
+
+    for row_number, raw in enumerate(records, start=1):
+        report.processed += 1
+        try:
+            batch.append((row_number, _normalize_row(kind, raw)))
+        except (ValueError, AttributeError) as e:
+            report.add_error(row_number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    report.elapsed_seconds = time.perf_counter() - started
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Importación masiva de usuarios (CSV o NDJSON)")
+    parser.add_argument("kind", choices=sorted(USER_KINDS), help="Tipo de usuario a importar")
+    parser.add_argument("path", help="Ruta del archivo, o '-' para leer de stdin")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="Formato (por defecto según la extensión)")
+    parser.add_argument("--batch-size", type=int, default=BULK_IMPORT_BATCH_SIZE)
+    parser.add_argument("--update-existing", action="store_true",
+                        help="Actualiza los usuarios que ya existen en lugar de omitirlos")
+    args = parser.parse_args(argv)
+
+    from database import ensure_schema, engine
+    from hashing import hashing_executor
+
+    ensure_schema(engine)
+    fmt = args.format or detect_format(None if args.path == "-" else args.path)
+
+    def print_progress(report: ImportReport):
+        print(f"  {report.processed} filas | {report.inserted} nuevas | {report.updated} actualizadas | "
+              f"{report.skipped} omitidas | {report.failed} con error | {report.rows_per_second:.0f} filas/s")
+
+    stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    try:
+        print(f"Importando {args.kind} desde {args.path} ({fmt})...")
+        report = import_users(
+            args.kind,
+            read_records(stream, fmt),
+            engine=engine,
+            batch_size=args.batch_size,
+            update_existing=args.update_existing,
+            progress=print_progress,
+            # Fuera de la API no hay logins con los que compartir el pool
+            hash_window=hashing_executor.workers,
+        )
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+        hashing_executor.shutdown()
+
+    print(f"\nImportación terminada en {report.elapsed_seconds:.1f} s ({report.rows_per_second:.0f} filas/s)")
+    for error in report.errors:
+        print(f"  Fila {error['row']}: {error['error']}")
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""
+Conteos del catálogo de documentos sin recorrer la tabla completa.
+
+`GET /api/documents` calculaba `query.count()` sobre todo el conjunto filtrado
+antes de traer cada página: un segundo recorrido completo por petición. Este
+módulo ofrece dos alternativas baratas:
+
+- Conteo exacto desde `document_counters`: una fila por (categoría, estado)
+  que se mantiene de forma incremental en la misma transacción que modifica
+  los documentos (alta, baja y cambios de categoría/estado). Sumar unas
+  pocas filas reemplaza al COUNT(*) cuando los filtros son solo categoría y
+  estado.
+- Conteo estimado desde las estadísticas del planificador de PostgreSQL
+  (`EXPLAIN`), para las búsquedas por texto donde no hay contador.
+
+Los mismos contadores (con los bytes por categoría) alimentan las facetas de
+la barra lateral, que se sirven desde una caché en memoria invalidada por
+`catalog_state.documents_version`: la versión aumenta en cada transacción que
+modifica documentos, así que todos los procesos detectan el cambio.
+
+Los contadores y la versión se actualizan desde listeners de la Session, así
+que cualquier código que use el ORM (endpoints, scripts) los mantiene sin
+tener que acordarse de hacerlo. La versión es una sola fila que todas las
+escrituras actualizan: se incrementa al final de la transacción (antes del
+commit, no en el primer flush) para retener su lock lo mínimo, y solo si
+cambió alguna columna visible (no el lease ni los intentos de procesamiento).
+"""
+
+import json
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Query, Session
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+import models
+
+DEFAULT_CATEGORY = "Sin categoría"
+
+# Clave usada en el contador para documentos sin categoría (NULL)
+_NO_CATEGORY = ""
+
+# Claves de `catalog_state`
+DOCUMENTS_VERSION = "documents_version"
+COUNTERS_FORMAT_KEY = "counters_format"
+
+# Formato actual de `document_counters` (2: incluye total_bytes). Si la BD
+# tiene otro, los contadores se reconstruyen al arrancar.
+COUNTERS_FORMAT = 2
+
+# Atributos del documento que afectan a los contadores
+_COUNTED_ATTRIBUTES = ("category", "status", "file_size")
+
+# Atributos internos de la cola de procesamiento: no los muestra ningún
+# listado, faceta ni búsqueda, así que cambiarlos no cambia la versión
+_UNLISTED_ATTRIBUTES = frozenset({"processing_attempts", "processing_lease_until"})
+
+# Clave en `Session.info`: la transacción en curso modificó documentos
+_VERSION_PENDING = "catalog_documents_version_pending"
+
+_counters = models.DocumentCounter.__table__
+_state = models.CatalogState.__table__
+
+
+def _status_value(value) -> str:
+    """Normaliza el estado (Enum o string) al valor guardado en el contador"""
+    if value is None:
+        value = models.DocumentStatus.PROCESSING
+    return models.DocumentStatus(value).value
+
+
+def _counter_key(category, document_status) -> Tuple[str, str]:
+    return (_NO_CATEGORY if category is None else category, _status_value(document_status))
+
+
+def _original_value(document: models.Document, attribute: str):
+    """Valor de un atributo tal como está en la BD (antes de los cambios pendientes)"""
+    history = inspect(document).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(document, attribute)
+
+
+# ============================================================================
+# MANTENIMIENTO INCREMENTAL
+# ============================================================================
+
+def _collect_deltas(session: Session) -> Dict[Tuple[str, str], List[int]]:
+    """
+    Calcula el cambio de cada contador según los documentos pendientes del flush.
+    Retorna {(categoría, estado): [delta_documentos, delta_bytes]}.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+
+    def add(key, count, size):
+        deltas[key][0] += count
+        deltas[key][1] += count * (size or 0)
+
+    for obj in session.new:
+        if isinstance(obj, models.Document):
+            category = DEFAULT_CATEGORY if obj.category is None else obj.category
+            add(_counter_key(category, obj.status), 1, obj.file_size)
+
+    for obj in session.deleted:
+        if isinstance(obj, models.Document):
+            add(
+                _counter_key(_original_value(obj, "category"), _original_value(obj, "status")),
+                -1, _original_value(obj, "file_size")
+            )
+
+    for obj in session.dirty:
+        if not isinstance(obj, models.Document) or obj in session.deleted:
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[name].history.has_changes() for name in _COUNTED_ATTRIBUTES):
+            continue
+        old_key = _counter_key(_original_value(obj, "category"), _original_value(obj, "status"))
+        old_size = _original_value(obj, "file_size")
+        new_key = _counter_key(obj.category, obj.status)
+        if (old_key, old_size) != (new_key, obj.file_size):
+            add(old_key, -1, old_size)
+            add(new_key, 1, obj.file_size)
+
+    return {key: delta for key, delta in deltas.items() if delta != [0, 0]}
+
+
+def _visibly_modified(document: models.Document) -> bool:
+    """True si cambió alguna columna que se ve fuera de la cola de procesamiento"""
+    return any(
+        attr.history.has_changes()
+        for attr in inspect(document).attrs
+        if attr.key not in _UNLISTED_ATTRIBUTES
+    )
+
+
+def _documents_changed(session: Session) -> bool:
+    """True si el flush crea, elimina o modifica (de forma visible) algún documento"""
+    return any(isinstance(obj, models.Document) for obj in session.new) \
+        or any(isinstance(obj, models.Document) for obj in session.deleted) \
+        or any(isinstance(obj, models.Document) and _visibly_modified(obj) for obj in session.dirty)
+
+
+def _dialect_insert(dialect_name: str):
+    """`insert` con soporte de ON CONFLICT para el dialecto, o None"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def apply_counter_deltas(connection, deltas: Dict[Tuple[str, str], List[int]]) -> None:
+    """Aplica los deltas a `document_counters` en la transacción de `connection`"""
+    if not deltas:
+        return
+
+    params = [
+        {"category": category, "status": document_status, "document_count": count, "total_bytes": size}
+        for (category, document_status), (count, size) in sorted(deltas.items())
+    ]
+    dialect_insert = _dialect_insert(connection.dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(_counters)
+        connection.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[_counters.c.category, _counters.c.status],
+                set_={
+                    "document_count": _counters.c.document_count + stmt.excluded.document_count,
+                    "total_bytes": _counters.c.total_bytes + stmt.excluded.total_bytes,
+                }
+            ),
+            params
+        )
+        return
+
+    # Dialecto sin ON CONFLICT: UPDATE y, si no existía la fila, INSERT
+    for row in params:
+        result = connection.execute(
+            update(_counters)
+            .where(_counters.c.category == row["category"], _counters.c.status == row["status"])
+            .values(
+                document_count=_counters.c.document_count + row["document_count"],
+                total_bytes=_counters.c.total_bytes + row["total_bytes"]
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(_counters.insert(), row)
+
+
+def _set_state(connection, name: str, value: int = None, increment: int = None) -> None:
+    """Fija (`value`) o incrementa (`increment`) un valor de `catalog_state`"""
+    new_value = _state.c.value + increment if increment is not None else value
+    dialect_insert = _dialect_insert(connection.dialect.name)
+    if dialect_insert is not None:
+        # Atómico: dos transacciones que crean la fila a la vez no chocan en la PK
+        stmt = dialect_insert(_state).values(name=name, value=value if value is not None else increment)
+        connection.execute(stmt.on_conflict_do_update(index_elements=[_state.c.name], set_={"value": new_value}))
+        return
+
+    # Dialecto sin ON CONFLICT: UPDATE y, si no existía la fila, INSERT
+    result = connection.execute(update(_state).where(_state.c.name == name).values(value=new_value))
+    if result.rowcount == 0:
+        connection.execute(_state.insert(), {"name": name, "value": value if value is not None else increment})
+
+
+def bump_documents_version(connection) -> None:
+    """Marca que el catálogo cambió: invalida las cachés basadas en la versión"""
+    _set_state(connection, DOCUMENTS_VERSION, increment=1)
+
+
+@event.listens_for(Session, "before_flush")
+def _track_document_counters(session: Session, flush_context, instances) -> None:
+    """
+    Actualiza los contadores en la misma transacción del flush (si el flush o
+    el commit fallan, el rollback también los deshace) y deja pendiente el
+    incremento de la versión para el final de la transacción.
+    """
+    if not _documents_changed(session):
+        return
+    apply_counter_deltas(session.connection(), _collect_deltas(session))
+    session.info[_VERSION_PENDING] = True
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_version_on_commit(session: Session) -> None:
+    """Incrementa la versión justo antes del commit de una transacción que modificó documentos"""
+    # Los cambios aún sin enviar se envían ahora (y pueden dejar la versión pendiente)
+    session.flush()
+    if session.info.pop(_VERSION_PENDING, False):
+        bump_documents_version(session.connection())
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_version(session: Session) -> None:
+    session.info.pop(_VERSION_PENDING, None)
+
+
+# Cargar siempre el valor anterior al asignar categoría, estado o tamaño, incluso
+# si el objeto está expirado (tras un commit); sin esto el historial no lo tendría
+@event.listens_for(models.Document.category, "set", active_history=True)
+@event.listens_for(models.Document.status, "set", active_history=True)
+@event.listens_for(models.Document.file_size, "set", active_history=True)
+def _load_previous_value(target, value, oldvalue, initiator):
+    return value
+
+
+def rebuild_document_counters(connection) -> int:
+    """
+    Recalcula `document_counters` desde cero con un GROUP BY sobre documents.
+    Retorna el número de documentos contados.
+    """
+    rows = connection.execute(
+        select(
+            models.Document.category,
+            models.Document.status,
+            func.count(),
+            func.coalesce(func.sum(models.Document.file_size), 0)
+        ).group_by(models.Document.category, models.Document.status)
+    ).all()
+
+    totals = defaultdict(lambda: [0, 0])
+    for category, document_status, count, size in rows:
+        key = _counter_key(category, document_status)
+        totals[key][0] += count
+        totals[key][1] += int(size)
+
+    connection.execute(_counters.delete())
+    if totals:
+        connection.execute(_counters.insert(), [
+            {"category": category, "status": document_status, "document_count": count, "total_bytes": size}
+            for (category, document_status), (count, size) in sorted(totals.items())
+        ])
+    _set_state(connection, COUNTERS_FORMAT_KEY, value=COUNTERS_FORMAT)
+    bump_documents_version(connection)
+    return sum(count for count, _ in totals.values())
+
+
+def ensure_document_counters(bind) -> None:
+    """
+    Inicializa los contadores al arrancar cuando no existen o tienen un formato
+    anterior (p. ej. antes de `total_bytes`).
+    """
+    with bind.begin() as conn:
+        counters_format = conn.execute(
+            select(_state.c.value).where(_state.c.name == COUNTERS_FORMAT_KEY)
+        ).scalar()
+        if counters_format != COUNTERS_FORMAT:
+            rebuild_document_counters(conn)
+
+
+# ============================================================================
+# LECTURA DE CONTEOS
+# ============================================================================
+
+def counted_total(db: Session, category: Optional[str] = None, document_status: Optional[str] = None) -> int:
+    """Total exacto de documentos para los filtros de categoría/estado, desde los contadores"""
+    stmt = select(func.coalesce(func.sum(_counters.c.document_count), 0))
+    if category is not None:
+        stmt = stmt.where(_counters.c.category == category)
+    if document_status is not None:
+        try:
+            stmt = stmt.where(_counters.c.status == _status_value(document_status))
+        except ValueError:
+            # Estado inexistente: ningún documento coincide
+            return 0
+    return int(db.execute(stmt).scalar())
+
+
+def documents_version(db: Session) -> int:
+    """Versión actual del catálogo (cambia con cada escritura de documentos)"""
+    version = db.execute(select(_state.c.value).where(_state.c.name == DOCUMENTS_VERSION)).scalar()
+    return int(version or 0)
+
+
+def _load_facets(db: Session, version: int) -> dict:
+    """Facetas por categoría y estado a partir de `document_counters` (O(categorías))"""
+    rows = db.execute(
+        select(_counters.c.category, _counters.c.status, _counters.c.document_count, _counters.c.total_bytes)
+        .where(_counters.c.document_count > 0)
+        .order_by(_counters.c.category, _counters.c.status)
+    ).all()
+
+    categories = {}
+    statuses = defaultdict(int)
+    for category, document_status, count, size in rows:
+        facet = categories.setdefault(category, {
+            "name": category or None,
+            "document_count": 0,
+            "total_bytes": 0,
+            "statuses": {},
+        })
+        facet["document_count"] += count
+        facet["total_bytes"] += int(size)
+        facet["statuses"][document_status] = count
+        statuses[document_status] += count
+
+    return {
+        "version": version,
+        "total_documents": sum(facet["document_count"] for facet in categories.values()),
+        "total_bytes": sum(facet["total_bytes"] for facet in categories.values()),
+        "statuses": dict(statuses),
+        "categories": list(categories.values()),
+    }
+
+
+class FacetCache:
+    """
+    Caché en memoria de las facetas del catálogo.
+
+    Cada lectura consulta solo `documents_version` (una fila por clave
+    primaria); si coincide con la versión en caché se devuelven las facetas
+    guardadas, y si no, se recalculan desde los contadores.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._facets = None
+
+    def get(self, db: Session) -> dict:
+        version = documents_version(db)
+        with self._lock:
+            if self._version == version:
+                return self._facets
+
+        facets = _load_facets(db, version)
+        with self._lock:
+            self._version, self._facets = version, facets
+        return facets
+
+
+# Instancia global de la caché de facetas
+facet_cache = FacetCache()
+
+
+class _Explain(Executable, ClauseElement):
+    """`EXPLAIN (FORMAT JSON) <consulta>` conservando los parámetros enlazados"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def estimated_total(db: Session, query: Query) -> Optional[int]:
+    """
+    Número de filas estimado por el planificador de PostgreSQL para `query`.
+    Retorna None en otros motores (el llamador decide si contar exacto).
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    plan = db.execute(_Explain(query.statement)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
@@ -5,12 +5,22 @@ Este módulo maneja:
 - Conexión a PostgreSQL (Neon DB)
 - Configuración de SQLAlchemy
 - Gestión de sesiones de base de datos
+- Pool de conexiones configurable y sus métricas
+- Engine asíncrono opcional (asyncpg) para los endpoints
+- Actualización del esquema (tablas y columnas nuevas)
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi.concurrency import run_in_threadpool
+from typing import Callable, TypeVar
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 # Cargar variables de entorno desde el archivo .env
@@ -30,17 +40,244 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL no está configurada en las variables de entorno")
 
+# ============================================================================
+# CONFIGURACIÓN DEL POOL DE CONEXIONES
+# ============================================================================
+
+# Modo del pool:
+# - "queue": pool persistente (servidor uvicorn de larga duración)
+# - "null": sin pool, una conexión por sesión (funciones serverless de Vercel,
+#   donde el proceso puede congelarse con conexiones abiertas)
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").lower()
+
+# Conexiones persistentes y conexiones extra permitidas en picos
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Segundos que una petición espera una conexión libre antes de fallar
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Segundos tras los cuales se recicla una conexión (Neon cierra las inactivas)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))
+
+# Verificar la conexión (SELECT 1) antes de entregarla; evita errores tras inactividad
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Tiempo máximo por sentencia SQL en milisegundos (0 = sin límite)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+# Tiempo máximo para establecer la conexión TCP/TLS, en segundos
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+
+# Usar el engine asíncrono (asyncpg / aiosqlite) en los endpoints.
+# Con "true", cada petición espera a PostgreSQL en el event loop sin ocupar
+# un hilo del threadpool.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+# Extensiones de PostgreSQL requeridas por los índices (pg_trgm: búsqueda aproximada)
+POSTGRES_EXTENSIONS = ("pg_trgm",)
+
+
+class PoolMetrics:
+    """
+    Métricas del pool de conexiones: checkouts, conexiones nuevas, tiempo de
+    espera por una conexión libre y edad de las conexiones entregadas.
+    Sirven para dimensionar DB_POOL_SIZE / DB_MAX_OVERFLOW con datos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_count = 0
+        self.wait_total_seconds = 0.0
+        self.wait_max_seconds = 0.0
+        self.age_total_seconds = 0.0
+        self.age_max_seconds = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total_seconds += seconds
+            self.wait_max_seconds = max(self.wait_max_seconds, seconds)
+
+    def record_connect(self, connection_record) -> None:
+        connection_record.info["connected_at"] = time.monotonic()
+        with self._lock:
+            self.connects += 1
+
+    def record_checkout(self, connection_record) -> None:
+        age = time.monotonic() - connection_record.info.get("connected_at", time.monotonic())
+        with self._lock:
+            self.checkouts += 1
+            self.age_total_seconds += age
+            self.age_max_seconds = max(self.age_max_seconds, age)
+
+    def record_invalidation(self) -> None:
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self, pool) -> dict:
+        """Métricas acumuladas más el estado actual del pool"""
+        with self._lock:
+            data = {
+                "pool_mode": DB_POOL_MODE,
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "wait_avg_ms": round(1000 * self.wait_total_seconds / self.wait_count, 3) if self.wait_count else 0.0,
+                "wait_max_ms": round(1000 * self.wait_max_seconds, 3),
+                "connection_age_avg_s": round(self.age_total_seconds / self.checkouts, 3) if self.checkouts else 0.0,
+                "connection_age_max_s": round(self.age_max_seconds, 3),
+            }
+        if isinstance(pool, QueuePool):
+            data.update({
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+            })
+        return data
+
+
+# Métricas del pool de cada engine (no se mezclan: el asíncrono tiene las suyas)
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class _TimedPoolMixin:
+    """
+    Mide cuánto espera cada petición por una conexión.
+    Incluye el tiempo de abrir una conexión nueva (TCP + TLS) cuando el pool
+    no tiene conexiones libres. `metrics` lo asigna `_install_pool_listeners`.
+    """
+
+    metrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.perf_counter() - started)
+
+    def recreate(self):
+        # `engine.dispose()` reemplaza el pool: el nuevo conserva las métricas
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    """QueuePool con medición del tiempo de espera"""
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    """Pool del engine asíncrono con medición del tiempo de espera"""
+
+
+def _engine_options(url, is_async: bool = False) -> dict:
+    """Argumentos de create_engine según DB_POOL_MODE y el tipo de base de datos"""
+    if DB_POOL_MODE == "null":
+        return {"poolclass": NullPool}
+    if url.get_backend_name() == "sqlite":
+        # SQLite (pruebas locales) conserva el pool por defecto de SQLAlchemy
+        return {}
+    return {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _install_pool_listeners(target_engine, metrics: PoolMetrics) -> None:
+    """Registra los eventos del pool que alimentan `metrics` y el statement timeout"""
+    is_postgres = target_engine.dialect.name == "postgresql"
+    if isinstance(target_engine.pool, _TimedPoolMixin):
+        target_engine.pool.metrics = metrics
+
+    @event.listens_for(target_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.record_connect(connection_record)
+        if is_postgres and DB_STATEMENT_TIMEOUT_MS > 0:
+            # Con el pooler de Neon (PgBouncer) el parámetro de arranque `options`
+            # no está disponible, así que el límite se fija con SET al conectar
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+            cursor.close()
+            dbapi_connection.commit()
+
+    @event.listens_for(target_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.record_checkout(connection_record)
+
+    @event.listens_for(target_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.record_invalidation()
+
+
+_database_url = make_url(DATABASE_URL)
+_connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT} if _database_url.get_backend_name() == "postgresql" else {}
+
 # Motor de SQLAlchemy - gestiona las conexiones a la base de datos
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, connect_args=_connect_args, **_engine_options(_database_url))
+_install_pool_listeners(engine, pool_metrics)
 
 # Fábrica de sesiones - crea nuevas sesiones de base de datos
 # - autocommit=False: Las transacciones deben confirmarse explícitamente
 # - autoflush=False: Los cambios no se envían automáticamente a la BD
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_database_url(url):
+    """
+    Convierte la URL síncrona en su equivalente asíncrono.
+    asyncpg no entiende `sslmode`/`channel_binding` (habituales en Neon), así
+    que se retiran de la URL y el SSL se pasa como argumento de conexión.
+
+    Returns:
+        Tuple[URL, dict]: (url asíncrona, connect_args)
+    """
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite"), {}
+
+    query = dict(url.query)
+    sslmode = query.pop("sslmode", None)
+    query.pop("channel_binding", None)
+    connect_args = {"timeout": DB_CONNECT_TIMEOUT}
+    if sslmode and sslmode != "disable":
+        connect_args["ssl"] = "require" if sslmode in ("require", "prefer", "allow") else sslmode
+    return url.set(drivername="postgresql+asyncpg", query=query), connect_args
+
+
+# Motor asíncrono y su fábrica de sesiones (solo con DB_ASYNC=true)
+# - expire_on_commit=False: los objetos siguen siendo legibles tras el commit
+#   sin volver a consultar la BD fuera del contexto asíncrono
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    # Import diferido: el modo síncrono no necesita greenlet ni asyncpg
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    _async_url, _async_connect_args = _async_database_url(_database_url)
+    async_engine = create_async_engine(
+        _async_url,
+        connect_args=_async_connect_args,
+        **_engine_options(_database_url, is_async=True)
+    )
+    _install_pool_listeners(async_engine.sync_engine, async_pool_metrics)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Clase base para los modelos ORM de SQLAlchemy
 Base = declarative_base()
 
+T = TypeVar("T")
+
 
 def get_db():
     """
@@ -67,3 +304,103 @@ def get_db():
     finally:
         db.close()
 
+
+class DatabaseSession:
+    """
+    Sesión de BD para endpoints `async def`, independiente del modo configurado.
+
+    Las consultas se escriben como funciones ORM síncronas que reciben una
+    `Session`; `run` decide cómo ejecutarlas:
+    - DB_ASYNC=false: en el threadpool, sobre una sesión síncrona
+    - DB_ASYNC=true: con `AsyncSession.run_sync`, que ejecuta la función en un
+      greenlet y espera la red en el event loop (asyncpg) sin ocupar hilos
+
+    Ejemplo:
+        student = await db.run(lambda session: session.get(models.Student, 1))
+    """
+
+    def __init__(self, session, is_async: bool):
+        self.session = session
+        self.is_async = is_async
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Ejecuta `fn(session, *args, **kwargs)` sin bloquear el event loop"""
+        if self.is_async:
+            return await self.session.run_sync(fn, *args, **kwargs)
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+
+async def get_database_session():
+    """
+    Dependencia de FastAPI que entrega un `DatabaseSession` y lo cierra al
+    terminar la petición. Usa el engine asíncrono si DB_ASYNC=true.
+    """
+    if DB_ASYNC:
+        async with AsyncSessionLocal() as session:
+            yield DatabaseSession(session, is_async=True)
+        return
+
+    session = SessionLocal()
+    try:
+        yield DatabaseSession(session, is_async=False)
+    finally:
+        await run_in_threadpool(session.close)
+
+
+def get_pool_stats() -> dict:
+    """
+    Métricas del pool de conexiones del engine que usan los endpoints. Con
+    DB_ASYNC se agregan aparte las del engine síncrono (workers, tareas de fondo).
+    """
+    if async_engine is not None:
+        return {
+            **async_pool_metrics.snapshot(async_engine.sync_engine.pool),
+            "async": True,
+            "sync_engine": pool_metrics.snapshot(engine.pool),
+        }
+    return {**pool_metrics.snapshot(engine.pool), "async": False}
+
+
+def ensure_schema(bind=None):
+    """
+    Crea las tablas que falten y agrega las columnas e índices nuevos a tablas existentes.
+
+    `create_all` solo crea tablas completas; cuando un modelo gana una columna
+    (p. ej. `token_version`) las bases de datos ya desplegadas no la tendrían.
+    Aquí se emite un `ALTER TABLE ... ADD COLUMN` por cada columna faltante.
+    Solo se agregan columnas que admiten NULL o tienen `server_default`, así que
+    la operación es segura sobre tablas con datos.
+    En PostgreSQL, antes se habilitan las extensiones de POSTGRES_EXTENSIONS.
+
+    Args:
+        bind: Engine a usar (por defecto, el engine de la aplicación)
+    """
+    bind = bind or engine
+    if bind.dialect.name == "postgresql":
+        # Extensiones que usan los índices de los modelos (p. ej. trigramas en documents.name)
+        with bind.begin() as conn:
+            for extension in POSTGRES_EXTENSIONS:
+                conn.exec_driver_sql(f"CREATE EXTENSION IF NOT EXISTS {extension}")
+    Base.metadata.create_all(bind=bind)
+
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(
+                        f"No se puede agregar automáticamente la columna {table.name}.{column.name}: "
+                        "es NOT NULL y no tiene server_default"
+                    )
+                column_ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                table_name = conn.dialect.identifier_preparer.format_table(table)
+                conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}")
+
+            # Índices nuevos sobre tablas existentes
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(bind=conn)
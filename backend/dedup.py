@@ -0,0 +1,253 @@
+"""
+Deduplicación de archivos por contenido (SHA-256).
+
+Cada subida recibía una key nueva (`documents/{uuid}`), así que el mismo
+sílabo subido por cinco administradores se guardaba y procesaba cinco veces.
+Ahora cada subida calcula el SHA-256 del archivo y lo guarda en
+`Document.content_hash`:
+
+- `stored_objects` tiene un registro por contenido con su key en el storage
+  y `ref_count` (documentos que lo usan)
+- Si el contenido ya existe, la subida no escribe en el storage: el
+  documento reutiliza la key del objeto existente
+- Al eliminar un documento se descuenta la referencia; el objeto solo se
+  borra del storage cuando ya no lo usa ningún documento
+
+`ref_count` se mantiene desde listeners de la Session en la misma
+transacción que crea o elimina el documento (como los contadores de
+catalog.py). Las keys que quedan sin referencias se entregan al código que
+hizo el commit con `pop_released_keys`, que es quien borra los objetos.
+
+Los documentos sin `content_hash` (anteriores a este cambio o subidos
+directamente al bucket) conservan un objeto propio: un índice UNIQUE parcial
+(`storage_key` con `content_hash IS NULL`) impide que dos documentos lo
+compartan y se borre al eliminar uno de ellos.
+
+Configuración (variables de entorno):
+- UPLOAD_DEDUP: "true" (por defecto) o "false" para desactivar la deduplicación
+"""
+
+import hashlib
+import os
+from typing import BinaryIO, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, event, inspect, insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+UPLOAD_DEDUP = os.getenv("UPLOAD_DEDUP", "true").lower() == "true"
+
+# Tamaño de bloque al hashear archivos ya recibidos
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+# Claves en `Session.info`: keys liberadas en la transacción en curso / ya confirmadas
+_PENDING_KEYS = "dedup_pending_storage_keys"
+_RELEASED_KEYS = "dedup_released_storage_keys"
+
+_stored_objects = models.StoredObject.__table__
+
+# Índices UNIQUE del modelo (parciales): no son la restricción antigua a quitar
+_MODEL_UNIQUE_INDEXES = {index.name for index in models.Document.__table__.indexes if index.unique}
+
+# Se desactiva en `ensure_content_dedup` si `documents.storage_key` sigue siendo UNIQUE
+_dedup_enabled = UPLOAD_DEDUP
+
+
+class StoredObjectMissing(Exception):
+    """El objeto que se iba a reutilizar ya no existe (se eliminó su última referencia)"""
+
+
+def dedup_enabled() -> bool:
+    return _dedup_enabled
+
+
+def ensure_content_dedup(bind) -> None:
+    """
+    Quita la restricción UNIQUE de `documents.storage_key` en bases de datos
+    creadas antes de la deduplicación (se llama al arrancar). En SQLite no se
+    puede quitar sin reconstruir la tabla: la deduplicación queda desactivada
+    hasta recrear la base de datos local.
+    """
+    global _dedup_enabled
+    if not UPLOAD_DEDUP:
+        return
+
+    inspector = inspect(bind)
+    constraints = [
+        uc["name"] for uc in inspector.get_unique_constraints("documents")
+        if uc["column_names"] == ["storage_key"]
+    ]
+    indexes = [
+        ix["name"] for ix in inspector.get_indexes("documents")
+        if ix.get("unique") and ix["column_names"] == ["storage_key"] and ix["name"] not in _MODEL_UNIQUE_INDEXES
+    ]
+    if not constraints and not indexes:
+        return
+
+    if bind.dialect.name == "postgresql":
+        with bind.begin() as conn:
+            for name in constraints:
+                conn.exec_driver_sql(f'ALTER TABLE documents DROP CONSTRAINT IF EXISTS "{name}"')
+            for name in indexes:
+                conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{name}"')
+        return
+
+    print("documents.storage_key es UNIQUE en esta base de datos: la deduplicación de archivos queda desactivada")
+    _dedup_enabled = False
+
+
+def hash_file(fileobj: BinaryIO) -> Tuple[str, int]:
+    """SHA-256 (hex) y tamaño de un archivo ya recibido; deja el cursor al inicio"""
+    hasher = hashlib.sha256()
+    file_size = 0
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(_HASH_BLOCK_SIZE), b""):
+        hasher.update(block)
+        file_size += len(block)
+    fileobj.seek(0)
+    return hasher.hexdigest(), file_size
+
+
+# ============================================================================
+# CONSULTAS DESDE LAS SUBIDAS
+# ============================================================================
+
+def find_stored_object(db: Session, content_hash: str) -> Optional[models.StoredObject]:
+    """Objeto ya guardado con este contenido, o None (sin bloquear la fila)"""
+    return db.get(models.StoredObject, content_hash)
+
+
+def attach_stored_object(db: Session, document: models.Document, content_hash: str) -> None:
+    """
+    Asigna el contenido al documento antes de guardarlo. Si el objeto ya
+    existe, el documento usa su key (y el objeto que haya subido se libera);
+    la fila queda bloqueada hasta el commit para que una eliminación
+    concurrente no borre el objeto.
+
+    Raises:
+        StoredObjectMissing: el documento no subió su propio objeto (se
+            esperaba reutilizar uno) y el objeto ya no existe
+    """
+    stored = db.execute(
+        select(models.StoredObject)
+        .where(models.StoredObject.content_hash == content_hash)
+        .with_for_update()
+    ).scalar_one_or_none()
+    if stored is not None:
+        if document.storage_key and document.storage_key != stored.storage_key:
+            # El documento ya subió su propio objeto: sobra y se borra tras el commit
+            db.info.setdefault(_PENDING_KEYS, []).append(document.storage_key)
+        document.storage_key = stored.storage_key
+        document.storage_url = stored.storage_url
+    elif not document.storage_key:
+        db.rollback()
+        raise StoredObjectMissing(content_hash)
+    document.content_hash = content_hash
+
+
+def pop_released_keys(db: Session) -> List[str]:
+    """Keys que quedaron sin referencias en las transacciones ya confirmadas (hay que borrarlas del storage)"""
+    return db.info.pop(_RELEASED_KEYS, [])
+
+
+# ============================================================================
+# MANTENIMIENTO DE REFERENCIAS
+# ============================================================================
+
+def _reference(connection, document: models.Document) -> Tuple[str, str]:
+    """Suma una referencia al contenido del documento; retorna (storage_key, storage_url) del objeto"""
+    values = {
+        "content_hash": document.content_hash,
+        "storage_key": document.storage_key,
+        "storage_url": document.storage_url,
+        "file_size": document.file_size,
+        "ref_count": 1,
+    }
+    dialect_name = connection.dialect.name
+    if dialect_name in ("postgresql", "sqlite"):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(_stored_objects).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[_stored_objects.c.content_hash],
+            set_={"ref_count": _stored_objects.c.ref_count + 1}
+        ).returning(_stored_objects.c.storage_key, _stored_objects.c.storage_url)
+        return tuple(connection.execute(stmt).one())
+
+    # Dialecto sin ON CONFLICT
+    result = connection.execute(
+        update(_stored_objects)
+        .where(_stored_objects.c.content_hash == document.content_hash)
+        .values(ref_count=_stored_objects.c.ref_count + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(_stored_objects).values(**values))
+    return tuple(connection.execute(
+        select(_stored_objects.c.storage_key, _stored_objects.c.storage_url)
+        .where(_stored_objects.c.content_hash == document.content_hash)
+    ).one())
+
+
+def _release(connection, document: models.Document) -> Optional[str]:
+    """Descuenta una referencia; retorna la key si el objeto quedó sin documentos"""
+    content_hash = document.content_hash
+    connection.execute(
+        update(_stored_objects)
+        .where(_stored_objects.c.content_hash == content_hash)
+        .values(ref_count=_stored_objects.c.ref_count - 1)
+    )
+    row = connection.execute(
+        select(_stored_objects.c.storage_key, _stored_objects.c.ref_count)
+        .where(_stored_objects.c.content_hash == content_hash)
+    ).first()
+    if row is None:
+        # Sin registro en stored_objects el objeto era solo de este documento
+        return document.storage_key
+    storage_key, ref_count = row
+    if ref_count > 0:
+        return None
+    connection.execute(delete(_stored_objects).where(_stored_objects.c.content_hash == content_hash))
+    return storage_key
+
+
+@event.listens_for(Session, "before_flush")
+def _track_stored_objects(session: Session, flush_context, instances) -> None:
+    """Mantiene `ref_count` y junta las keys que dejan de usarse"""
+    pending = []
+    for obj in session.new:
+        if isinstance(obj, models.Document) and obj.content_hash:
+            storage_key, storage_url = _reference(session.connection(), obj)
+            if storage_key != obj.storage_key:
+                # Otra subida del mismo contenido se guardó primero: usar su objeto
+                pending.append(obj.storage_key)
+                obj.storage_key, obj.storage_url = storage_key, storage_url
+
+    for obj in session.deleted:
+        if not isinstance(obj, models.Document):
+            continue
+        released = _release(session.connection(), obj) if obj.content_hash else obj.storage_key
+        if released:
+            pending.append(released)
+
+    if pending:
+        session.info.setdefault(_PENDING_KEYS, []).extend(pending)
+
+
+@event.listens_for(Session, "after_commit")
+def _confirm_released_keys(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEYS, None)
+    if pending:
+        session.info.setdefault(_RELEASED_KEYS, []).extend(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_released_keys(session: Session) -> None:
+    # Los documentos siguen existiendo: sus objetos no se deben borrar
+    session.info.pop(_PENDING_KEYS, None)
@@ -0,0 +1,83 @@
+"""
+Dependencias compartidas de FastAPI para autenticación.
+
+Leen el token del header `Authorization: Bearer <token>`, lo verifican
+(usando la caché de tokens de auth.py) y entregan un `Principal` tipado
+a los endpoints.
+
+Ejemplo de uso:
+    @app.get("/api/algo")
+    async def algo(principal: Principal = Depends(require_admin)):
+        ...
+"""
+
+from typing import Optional
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from auth import Principal, decode_access_token_cached
+
+# auto_error=False para poder devolver nuestros propios mensajes (y soportar
+# endpoints donde la autenticación es opcional)
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+def _unauthorized(detail: str = "Token inválido o expirado") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+
+def _principal_from_token(credentials: HTTPAuthorizationCredentials) -> Optional[Principal]:
+    """Principal del token, o None si es inválido, expiró o fue revocado"""
+    payload = decode_access_token_cached(credentials.credentials)
+    return Principal.from_payload(payload) if payload else None
+
+
+async def get_optional_principal(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> Optional[Principal]:
+    """
+    Retorna el principal si la petición trae un token válido, o None si no
+    trae token o el token no es válido. Los endpoints que admiten uso anónimo
+    no fallan cuando el frontend envía un token guardado que ya expiró.
+    """
+    if credentials is None:
+        return None
+    return _principal_from_token(credentials)
+
+
+async def get_current_principal(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> Principal:
+    """Exige un token válido y retorna el principal autenticado"""
+    if credentials is None:
+        raise _unauthorized("No autenticado")
+    principal = _principal_from_token(credentials)
+    if principal is None:
+        raise _unauthorized()
+    return principal
+
+
+async def require_student(
+    principal: Principal = Depends(get_current_principal)
+) -> Principal:
+    """Exige que el principal sea un estudiante"""
+    if not principal.is_student:
+        raise _unauthorized()
+    return principal
+
+
+async def require_admin(
+    principal: Principal = Depends(get_current_principal)
+) -> Principal:
+    """Exige que el principal sea un administrador"""
+    if not principal.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Se requieren permisos de administrador"
+        )
+    return principal
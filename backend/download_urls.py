@@ -0,0 +1,88 @@
+"""
+Caché de URLs firmadas de descarga.
+
+`GET /api/documents/{id}/download-url` firmaba una URL nueva en cada clic y
+un listado con enlaces de descarga necesitaba una petición por documento.
+Aquí las URLs firmadas se guardan por `storage_key` hasta que les queda
+menos de DOWNLOAD_URL_REISSUE_FRACTION de su vida; entonces se firma una
+nueva, así el cliente nunca recibe una URL a punto de vencer. Las entradas
+se descartan al eliminar el objeto del storage.
+
+Configuración (variables de entorno):
+- DOWNLOAD_URL_EXPIRE_SECONDS: validez de las URLs firmadas (por defecto 3600)
+- DOWNLOAD_URL_REISSUE_FRACTION: fracción de vida restante por debajo de la
+  cual se firma una URL nueva (por defecto 0.25)
+- DOWNLOAD_URL_CACHE_SIZE: máximo de URLs en caché (LRU, por defecto 10000;
+  0 desactiva la caché)
+- DOWNLOAD_URL_BATCH_MAX: documentos por petición en `POST /api/documents/download-urls`
+  (por defecto 200)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Tuple
+
+from dotenv import load_dotenv
+
+from storage import storage_service
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+DOWNLOAD_URL_EXPIRE_SECONDS = int(os.getenv("DOWNLOAD_URL_EXPIRE_SECONDS", "3600"))
+DOWNLOAD_URL_REISSUE_FRACTION = float(os.getenv("DOWNLOAD_URL_REISSUE_FRACTION", "0.25"))
+DOWNLOAD_URL_CACHE_SIZE = int(os.getenv("DOWNLOAD_URL_CACHE_SIZE", "10000"))
+DOWNLOAD_URL_BATCH_MAX = int(os.getenv("DOWNLOAD_URL_BATCH_MAX", "200"))
+
+
+class PresignedUrlCache:
+    """
+    Caché LRU de URLs firmadas por `storage_key`.
+
+    Una entrada se sirve mientras le quede al menos `reissue_fraction` de su
+    vida; por debajo se firma otra URL con la vida completa.
+    """
+
+    def __init__(self, expiration: int = DOWNLOAD_URL_EXPIRE_SECONDS,
+                 reissue_fraction: float = DOWNLOAD_URL_REISSUE_FRACTION,
+                 max_size: int = DOWNLOAD_URL_CACHE_SIZE):
+        self.expiration = expiration
+        self.reissue_fraction = min(max(reissue_fraction, 0.0), 1.0)
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_url(self, storage_key: str) -> Tuple[str, int]:
+        """Retorna (URL firmada, segundos de validez restantes)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(storage_key)
+            if entry is not None and entry[1] - now >= self.expiration * self.reissue_fraction:
+                self._entries.move_to_end(storage_key)
+                return entry[0], int(entry[1] - now)
+
+        url = storage_service.generate_presigned_url(storage_key, self.expiration)
+        expires_at = now + self.expiration
+        if self.max_size > 0:
+            with self._lock:
+                self._entries[storage_key] = (url, expires_at)
+                self._entries.move_to_end(storage_key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return url, self.expiration
+
+    def evict(self, storage_keys: Iterable[str]) -> None:
+        """Descarta las URLs de objetos eliminados del storage"""
+        with self._lock:
+            for storage_key in storage_keys:
+                self._entries.pop(storage_key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Instancia global de la caché de URLs de descarga
+download_url_cache = PresignedUrlCache()
@@ -0,0 +1,219 @@
+"""
+Ejecutor dedicado para el hash y la verificación de contraseñas.
+
+bcrypt consume ~200-300 ms de CPU por operación. Si se ejecuta directamente
+en los handlers, un inicio de sesión masivo (p. ej. todo un curso al comenzar
+un examen) agota el threadpool de FastAPI y hasta `/health` deja de responder.
+
+Este módulo concentra todo el trabajo de bcrypt en un pool acotado:
+- HASH_EXECUTOR: "process" (por defecto) o "thread"
+- HASH_WORKERS: número de workers (por defecto, número de CPUs)
+- HASH_MAX_PENDING: operaciones en cola + en ejecución antes de responder 503
+- HASH_BULK_WINDOW: hashes de una importación masiva desde la API en el pool
+  a la vez (por defecto, la mitad de los workers; `python bulk_import.py` usa
+  todos)
+
+Las funciones que se ejecutan en el pool son `auth.verify_password` y
+`auth.get_password_hash`, de modo que la lógica SHA256 + bcrypt sigue
+viviendo en un solo lugar.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, List
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+import auth
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+# ============================================================================
+# CONFIGURACIÓN DEL EJECUTOR
+# ============================================================================
+
+# Tipo de pool: "process" escala con los núcleos; "thread" sirve para entornos
+# sin soporte de multiprocessing (p. ej. funciones serverless de Vercel)
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "process").lower()
+
+# Número de workers del pool
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+
+# Máximo de operaciones pendientes (en cola + en ejecución)
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(HASH_WORKERS * 8)))
+
+# Hashes de una importación masiva en el pool a la vez: el pool es FIFO, así que
+# un login espera como mucho a este número de hashes de la importación
+HASH_BULK_WINDOW = max(1, int(os.getenv("HASH_BULK_WINDOW", str(max(1, HASH_WORKERS // 2)))))
+
+# Segundos sugeridos al cliente en el header Retry-After cuando el pool está lleno
+HASH_RETRY_AFTER_SECONDS = int(os.getenv("HASH_RETRY_AFTER_SECONDS", "2"))
+
+
+def _service_unavailable(detail: str) -> HTTPException:
+    """Construye el error 503 que se devuelve cuando el pool no acepta más trabajo"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={"Retry-After": str(HASH_RETRY_AFTER_SECONDS)}
+    )
+
+
+class HashingExecutor:
+    """
+    Pool acotado para operaciones de bcrypt.
+
+    El pool se crea en el primer uso (no al importar el módulo) y limita el
+    número de operaciones pendientes: cuando se alcanza `max_pending` la
+    operación se rechaza con un 503 en lugar de encolarse indefinidamente.
+    """
+
+    def __init__(self, kind: str = HASH_EXECUTOR, workers: int = HASH_WORKERS,
+                 max_pending: int = HASH_MAX_PENDING):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"HASH_EXECUTOR inválido: {kind} (usa 'process' o 'thread')")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> Executor:
+        """Crea el pool de forma perezosa"""
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix="hashing"
+                    )
+            return self._executor
+
+    def _reserve_slot(self) -> None:
+        """Reserva un cupo en la cola o rechaza con 503 si está llena"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise _service_unavailable(
+                    "El servidor está procesando demasiados inicios de sesión. Intenta de nuevo en unos segundos."
+                )
+            self._pending += 1
+
+    def _release_slot(self, _future: Future = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args) -> Future:
+        """
+        Envía una operación al pool respetando el límite de cola.
+
+        Raises:
+            HTTPException: 503 si la cola está llena o el pool de procesos se rompió
+        """
+        self._reserve_slot()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self._release_slot()
+            self._reset()
+            raise _service_unavailable("El servicio de autenticación se está reiniciando. Intenta de nuevo.")
+        except Exception:
+            self._release_slot()
+            raise
+        future.add_done_callback(self._release_slot)
+        return future
+
+    async def run(self, fn, *args):
+        """Ejecuta una operación en el pool sin bloquear el event loop"""
+        future = self.submit(fn, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            # Un worker murió (p. ej. OOM); se recrea el pool para las siguientes peticiones
+            self._reset()
+            raise _service_unavailable("El servicio de autenticación se está reiniciando. Intenta de nuevo.")
+
+    def _reset(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """Estado actual del pool (útil para monitoreo)"""
+        with self._lock:
+            return {
+                "executor": self.kind,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self) -> None:
+        """Libera los workers del pool"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# Instancia global del ejecutor
+hashing_executor = HashingExecutor()
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Versión asíncrona de `auth.verify_password` ejecutada en el pool de hashing"""
+    return await hashing_executor.run(auth.verify_password, plain_password, hashed_password)
+
+
+async def hash_password(password: str) -> str:
+    """Versión asíncrona de `auth.get_password_hash` ejecutada en el pool de hashing"""
+    return await hashing_executor.run(auth.get_password_hash, password)
+
+
+def hash_passwords(passwords: Iterable[str], window: int = HASH_BULK_WINDOW) -> List[str]:
+    """
+    Hashea muchas contraseñas (importaciones masivas) compartiendo el pool con
+    los logins: nunca hay más de `window` hashes de la importación en el pool,
+    así los logins se intercalan en lugar de esperar a todo el lote. Si el
+    pool está lleno (503), espera a que se libere un cupo.
+    """
+    passwords = list(passwords)
+    hashed: List[str] = [None] * len(passwords)
+    in_flight = {}
+
+    def collect_one() -> None:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            hashed[in_flight.pop(future)] = future.result()
+
+    for index, password in enumerate(passwords):
+        while True:
+            if len(in_flight) >= window:
+                collect_one()
+            try:
+                future = hashing_executor.submit(auth.get_password_hash, password)
+                break
+            except HTTPException as e:
+                if e.status_code != status.HTTP_503_SERVICE_UNAVAILABLE:
+                    raise
+                if in_flight:
+                    collect_one()
+                else:
+                    time.sleep(HASH_RETRY_AFTER_SECONDS)
+        in_flight[future] = index
+
+    for future, index in in_flight.items():
+        hashed[index] = future.result()
+    return hashed
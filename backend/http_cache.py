@@ -0,0 +1,112 @@
+"""
+GET condicional (ETag / If-None-Match) y Cache-Control para la metadata de documentos.
+
+El frontend vuelve a pedir los listados, las categorías y el detalle de los
+documentos constantemente. Con un ETag el cliente reenvía `If-None-Match` y,
+si nada cambió, recibe un 304 vacío: sin serializar ni transferir la
+respuesta.
+
+- Colecciones (listado, categorías, facetas, tags): el ETag se deriva de
+  `catalog_state.documents_version` (ver catalog.py) y de los parámetros de
+  la consulta. Verificarlo cuesta una lectura por clave primaria.
+- Un documento: el ETag combina la marca de tiempo del documento
+  (`updated_at` / `processed_at`) con la versión del catálogo. Si la versión
+  no cambió se responde 304 sin leer la fila; si cambió (por otro documento),
+  se compara la marca de tiempo del documento.
+
+Configuración (variables de entorno):
+- HTTP_CACHE_MAX_AGE: segundos que el cliente puede reutilizar la respuesta
+  sin revalidar (por defecto 0: siempre revalida con el ETag)
+"""
+
+import hashlib
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from fastapi import Request, Response, status
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "0"))
+
+# La metadata no es secreta pero puede cambiar en cualquier momento: solo la
+# cachea el navegador (no proxies compartidos) y la revalida al vencer
+CACHE_CONTROL = f"private, max-age={HTTP_CACHE_MAX_AGE}, must-revalidate"
+
+
+def _client_etags(request: Request) -> List[str]:
+    """ETags enviados en If-None-Match, sin comillas ni prefijo W/"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return []
+    etags = []
+    for value in header.split(","):
+        value = value.strip()
+        if value.startswith("W/"):
+            value = value[2:]
+        etags.append(value.strip('"'))
+    return etags
+
+
+def _quote(tag: str) -> str:
+    return f'"{tag}"'
+
+
+def collection_etag(name: str, version: int, request: Request) -> str:
+    """ETag de una colección: nombre + versión del catálogo + parámetros de la consulta"""
+    params = "&".join(sorted(f"{key}={value}" for key, value in request.query_params.multi_items()))
+    digest = hashlib.sha1(params.encode("utf-8")).hexdigest()[:16]
+    return _quote(f"{name}-v{version}-{digest}")
+
+
+def document_stamp(*timestamps: Optional[datetime]) -> str:
+    """
+    Marca de un documento a partir de sus fechas (en microsegundos). Se usan
+    todas y no solo la mayor: `processed_at` viene del reloj del servidor y
+    `updated_at` del de la BD, así que no son comparables entre sí.
+    """
+    return ".".join(str(int(ts.timestamp() * 1_000_000)) if ts is not None else "0" for ts in timestamps)
+
+
+def document_etag(document_id: int, stamp: str, version: int) -> str:
+    return _quote(f"doc-{document_id}-{stamp}-v{version}")
+
+
+def matches(request: Request, etag: str) -> bool:
+    """True si el cliente ya tiene la representación con este ETag"""
+    client = _client_etags(request)
+    return "*" in client or etag.strip('"') in client
+
+
+def current_document_etag(request: Request, document_id: int, version: int) -> Optional[str]:
+    """
+    ETag del cliente para este documento emitido con la versión actual del
+    catálogo (nada cambió desde entonces: no hace falta leer la fila), o None.
+    """
+    prefix, suffix = f"doc-{document_id}-", f"-v{version}"
+    for tag in _client_etags(request):
+        if tag.startswith(prefix) and tag.endswith(suffix):
+            return _quote(tag)
+    return None
+
+
+def document_stamp_matches(request: Request, document_id: int, stamp: str) -> bool:
+    """True si el cliente tiene un ETag de este documento con la misma marca de tiempo"""
+    prefix = f"doc-{document_id}-{stamp}-v"
+    return any(tag.startswith(prefix) for tag in _client_etags(request))
+
+
+def not_modified(etag: str) -> Response:
+    """Respuesta 304 con los mismos headers de caché que la respuesta completa"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    )
+
+
+def set_cache_headers(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
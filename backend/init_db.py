@@ -7,19 +7,24 @@ Uso: python init_db.py
 Nota sobre seguridad:
 Las contraseñas se hashean usando SHA256 + bcrypt, lo que permite
 contraseñas de cualquier longitud (sin el límite de 72 bytes de bcrypt).
+Los usuarios se cargan con el importador masivo (ver bulk_import.py), que
+hashea en paralelo e inserta por lotes.
 """
 
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
+from database import SessionLocal, engine, ensure_schema
 import models
-from auth import get_password_hash
+from bulk_import import import_users
+from catalog import ensure_document_counters
+from hashing import hashing_executor
 
 def init_database():
     """
     Crea las tablas y agrega usuarios de prueba.
     """
     print("Creando tablas en la base de datos...")
-    models.Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
+    ensure_document_counters(engine)
     print("Tablas creadas exitosamente")
     
     db: Session = SessionLocal()
@@ -59,23 +64,10 @@ def init_database():
             }
         ]
         
-        for student_data in students_data:
-            # Verificar si ya existe
-            existing = db.query(models.Student).filter(
-                models.Student.student_id == student_data["student_id"]
-            ).first()
-            
-            if not existing:
-                student = models.Student(
-                    student_id=student_data["student_id"],
-                    full_name=student_data["full_name"],
-                    email=student_data["email"],
-                    hashed_password=get_password_hash(student_data["password"])
-                )
-                db.add(student)
-                print(f"Estudiante creado: {student_data['student_id']} - {student_data['full_name']}")
-            else:
-                print(f"Estudiante ya existe: {student_data['student_id']}")
+        report = import_users("students", students_data, engine=engine)
+        print(f"Estudiantes creados: {report.inserted} | ya existentes: {report.skipped}")
+        for error in report.errors:
+            print(f"  Error en estudiante #{error['row']}: {error['error']}")
         
         # Creacion de administradores de prueba
         print("\nCreando administradores de prueba...")
@@ -96,27 +88,10 @@ def init_database():
             }
         ]
         
-        for admin_data in admins_data:
-            # Verificar si ya existe
-            existing = db.query(models.Admin).filter(
-                models.Admin.username == admin_data["username"]
-            ).first()
-            
-            if not existing:
-                admin = models.Admin(
-                    username=admin_data["username"],
-                    full_name=admin_data["full_name"],
-                    email=admin_data["email"],
-                    hashed_password=get_password_hash(admin_data["password"]),
-                    is_superuser=admin_data["is_superuser"]
-                )
-                db.add(admin)
-                print(f"Admin creado: {admin_data['username']} - {admin_data['full_name']}")
-            else:
-                print(f"Admin ya existe: {admin_data['username']}")
-        
-        # Guardar cambios
-        db.commit()
+        report = import_users("admins", admins_data, engine=engine)
+        print(f"Admins creados: {report.inserted} | ya existentes: {report.skipped}")
+        for error in report.errors:
+            print(f"  Error en admin #{error['row']}: {error['error']}")
         
         print("\nBase de datos inicializada correctamente!")
         print("\n" + "="*60)
@@ -136,6 +111,7 @@ def init_database():
         db.rollback()
     finally:
         db.close()
+        hashing_executor.shutdown()
 
 
 if __name__ == "__main__":
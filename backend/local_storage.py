@@ -0,0 +1,474 @@
+"""
+Storage local en disco (STORAGE_PROVIDER=local).
+
+Para instalaciones on-prem y para desarrollo sin un bucket: los objetos se
+guardan bajo LOCAL_STORAGE_DIR y la API los sirve directamente, sin pasar
+por S3/R2.
+
+- `LocalObjectStore` implementa las llamadas del cliente de boto3 que usa
+  `StorageService` (put/head/delete, multipart, URLs firmadas) y lanza
+  `ClientError` con los mismos códigos que S3, así que el servicio funciona
+  igual con cualquier proveedor
+- Cada objeto vive en `{dir}/{ab}/{cd}/{key codificada}`, donde `ab/cd` son
+  los primeros bytes del SHA-256 de la key: ningún directorio acumula todos
+  los archivos. Las escrituras van a un temporal y se publican con
+  `os.replace` (nunca se lee un archivo a medio escribir)
+- Las URLs "firmadas" apuntan a `/api/storage/local/{key}` con `expires` y
+  una firma HMAC-SHA256; sirven para descargar (GET, con soporte de `Range`)
+  y para las subidas directas (PUT del archivo o de una parte)
+- Las descargas usan `sendfile` cuando el servidor ASGI ofrece la extensión
+  `http.response.zerocopysend`; si no, leen el archivo mapeado en memoria
+
+Configuración (variables de entorno):
+- LOCAL_STORAGE_DIR: directorio de los objetos (por defecto ./storage_data)
+- LOCAL_STORAGE_BASE_URL: URL pública de la API con la que se arman las URLs
+  firmadas (por defecto http://localhost:8000)
+- LOCAL_STORAGE_SIGNING_KEY: clave HMAC de las URLs (por defecto SECRET_KEY)
+"""
+
+import hashlib
+import hmac
+import json
+import mimetypes
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
+from urllib.parse import quote, unquote, urlencode
+
+import anyio
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "./storage_data")
+LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL", "http://localhost:8000").rstrip("/")
+LOCAL_STORAGE_SIGNING_KEY = os.getenv("LOCAL_STORAGE_SIGNING_KEY") or os.getenv("SECRET_KEY", "default_secret_key")
+
+# Ruta de la API que sirve los objetos (ver main.py)
+LOCAL_STORAGE_ROUTE = "/api/storage/local"
+
+# Tamaño de bloque al copiar, leer y enviar archivos
+CHUNK_SIZE = 1024 * 1024
+
+# Los nombres de archivo no pueden pasar de 255 bytes en la mayoría de sistemas de archivos
+_MAX_ENCODED_KEY = 240
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+_TMP_DIR = ".tmp"
+_MULTIPART_DIR = ".multipart"
+
+
+def _client_error(code: str, message: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+def _etag(stat: os.stat_result) -> str:
+    """ETag a partir de tamaño y fecha de modificación (sin releer el archivo)"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _sign(method: str, storage_key: str, expires: int, upload_id: str = "", part_number: str = "") -> str:
+    message = "\n".join([method, storage_key, str(expires), upload_id, part_number])
+    return hmac.new(LOCAL_STORAGE_SIGNING_KEY.encode("utf-8"), message.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def verify_signature(method: str, storage_key: str, expires: Optional[int], signature: Optional[str],
+                     upload_id: Optional[str] = None, part_number: Optional[int] = None) -> bool:
+    """True si la firma corresponde a la operación y la URL no ha vencido"""
+    if expires is None or not signature or expires < time.time():
+        return False
+    expected = _sign(method, storage_key, expires, upload_id or "", str(part_number) if part_number else "")
+    return hmac.compare_digest(expected, signature)
+
+
+class LocalObjectStore:
+    """
+    Objetos en disco con la interfaz del cliente S3 de boto3 (solo las
+    llamadas que usa `StorageService`). `Bucket` se acepta y se ignora.
+    """
+
+    def __init__(self, root: str = LOCAL_STORAGE_DIR, base_url: str = LOCAL_STORAGE_BASE_URL):
+        self.root = Path(root).resolve()
+        self.base_url = base_url
+        (self.root / _TMP_DIR).mkdir(parents=True, exist_ok=True)
+        (self.root / _MULTIPART_DIR).mkdir(parents=True, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Rutas
+    # ------------------------------------------------------------------
+
+    def path_for(self, storage_key: str) -> Path:
+        """Ruta del objeto: {dir}/{ab}/{cd}/{key codificada}"""
+        encoded = quote(storage_key, safe="")
+        if not storage_key or len(encoded) > _MAX_ENCODED_KEY or "\x00" in storage_key:
+            raise _client_error("KeyTooLongError" if storage_key else "InvalidArgument",
+                                "Key inválida para el storage local", "PutObject")
+        digest = hashlib.sha256(storage_key.encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / digest[2:4] / encoded
+
+    def _upload_dir(self, upload_id: str, storage_key: str, operation: str) -> Path:
+        upload_dir = self.root / _MULTIPART_DIR / upload_id if _UPLOAD_ID.match(upload_id or "") else None
+        try:
+            meta = json.loads((upload_dir / "meta.json").read_text()) if upload_dir else None
+        except (FileNotFoundError, ValueError):
+            meta = None
+        if meta is None or meta.get("key") != storage_key:
+            raise _client_error("NoSuchUpload", "La subida no existe", operation)
+        return upload_dir
+
+    @staticmethod
+    def _part_path(upload_dir: Path, part_number: int) -> Path:
+        return upload_dir / f"{part_number:05d}.part"
+
+    def temp_file(self, directory: Optional[Path] = None) -> Tuple[BinaryIO, Path]:
+        """Archivo temporal en el mismo sistema de archivos que el destino (para `os.replace`)"""
+        fd, name = tempfile.mkstemp(dir=directory or self.root / _TMP_DIR)
+        return os.fdopen(fd, "wb"), Path(name)
+
+    def _publish(self, temp_path: Path, target: Path) -> str:
+        """Mueve el temporal a su ruta final de forma atómica; retorna el ETag"""
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp_path, target)
+        return _etag(target.stat())
+
+    def _write(self, source, target: Path, directory: Optional[Path] = None) -> str:
+        temp, temp_path = self.temp_file(directory)
+        try:
+            with temp:
+                if isinstance(source, (bytes, bytearray, memoryview)):
+                    temp.write(source)
+                else:
+                    shutil.copyfileobj(source, temp, CHUNK_SIZE)
+            return self._publish(temp_path, target)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+    def commit_object(self, temp_path: Path, storage_key: str) -> str:
+        """Publica como objeto un temporal ya escrito (subidas recibidas por HTTP)"""
+        return self._publish(temp_path, self.path_for(storage_key))
+
+    def commit_part(self, temp_path: Path, storage_key: str, upload_id: str, part_number: int) -> str:
+        """Publica como parte de una subida multipart un temporal ya escrito"""
+        try:
+            upload_dir = self._upload_dir(upload_id, storage_key, "UploadPart")
+        except ClientError:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return self._publish(temp_path, self._part_path(upload_dir, part_number))
+
+    # ------------------------------------------------------------------
+    # Interfaz del cliente S3
+    # ------------------------------------------------------------------
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        self._write(Fileobj, self.path_for(Key))
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs) -> dict:
+        return {"ETag": self._write(Body, self.path_for(Key))}
+
+    def download_fileobj(self, Bucket, Key, Fileobj, ExtraArgs=None, Callback=None, Config=None, **kwargs):
+        try:
+            with open(self.path_for(Key), "rb") as source:
+                shutil.copyfileobj(source, Fileobj, CHUNK_SIZE)
+        except FileNotFoundError:
+            raise _client_error("404", "Not Found", "HeadObject")
+
+    def head_object(self, Bucket, Key, **kwargs) -> dict:
+        try:
+            stat = self.path_for(Key).stat()
+        except FileNotFoundError:
+            raise _client_error("404", "Not Found", "HeadObject")
+        return {
+            "ContentLength": stat.st_size,
+            "ContentType": mimetypes.guess_type(Key)[0] or "application/octet-stream",
+            "ETag": _etag(stat),
+            "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        }
+
+    def delete_object(self, Bucket, Key, **kwargs) -> dict:
+        # Igual que en S3, eliminar un objeto que no existe no es un error
+        self.path_for(Key).unlink(missing_ok=True)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs) -> dict:
+        errors = []
+        for item in Delete["Objects"]:
+            try:
+                self.path_for(item["Key"]).unlink(missing_ok=True)
+            except (ClientError, OSError) as e:
+                errors.append({"Key": item["Key"], "Code": "InternalError", "Message": str(e)})
+        return {"Errors": errors} if errors else {}
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None, **kwargs) -> dict:
+        """
+        Lista los objetos en el orden de los shards (no alfabético). El token
+        de continuación es la ruta relativa del último archivo listado, así
+        cada página retoma desde su shard sin recorrer los anteriores.
+        """
+        after_shard, after_name = "", ""
+        if ContinuationToken:
+            after_shard, _, after_name = ContinuationToken.rpartition("/")
+
+        contents, last_token = [], None
+        for shard in sorted(self.root.glob("[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]")):
+            shard_name = shard.relative_to(self.root).as_posix()
+            if shard_name < after_shard:
+                continue
+            for path in sorted(shard.iterdir()):
+                if shard_name == after_shard and path.name <= after_name:
+                    continue
+                storage_key = unquote(path.name)
+                if not storage_key.startswith(Prefix) or not path.is_file():
+                    continue
+                if len(contents) == MaxKeys:
+                    return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": True,
+                            "NextContinuationToken": last_token}
+                stat = path.stat()
+                contents.append({
+                    "Key": storage_key,
+                    "Size": stat.st_size,
+                    "ETag": _etag(stat),
+                    "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                })
+                last_token = f"{shard_name}/{path.name}"
+        return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs) -> dict:
+        self.path_for(Key)  # valida la key antes de crear la subida
+        upload_id = uuid.uuid4().hex
+        upload_dir = self.root / _MULTIPART_DIR / upload_id
+        upload_dir.mkdir()
+        (upload_dir / "meta.json").write_text(json.dumps({"key": Key}))
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs) -> dict:
+        upload_dir = self._upload_dir(UploadId, Key, "UploadPart")
+        return {"ETag": self._write(Body, self._part_path(upload_dir, PartNumber), upload_dir)}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0, MaxParts=1000, **kwargs) -> dict:
+        upload_dir = self._upload_dir(UploadId, Key, "ListParts")
+        parts = []
+        for path in sorted(upload_dir.glob("*.part")):
+            part_number = int(path.stem)
+            if part_number <= PartNumberMarker:
+                continue
+            stat = path.stat()
+            parts.append({"PartNumber": part_number, "ETag": _etag(stat), "Size": stat.st_size})
+        truncated = len(parts) > MaxParts
+        parts = parts[:MaxParts]
+        response = {"Parts": parts, "IsTruncated": truncated}
+        if truncated:
+            response["NextPartNumberMarker"] = parts[-1]["PartNumber"]
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs) -> dict:
+        upload_dir = self._upload_dir(UploadId, Key, "CompleteMultipartUpload")
+        part_paths = []
+        for part in MultipartUpload["Parts"]:
+            path = self._part_path(upload_dir, part["PartNumber"])
+            try:
+                etag = _etag(path.stat())
+            except FileNotFoundError:
+                etag = None
+            if etag != part["ETag"]:
+                raise _client_error("InvalidPart", f"La parte {part['PartNumber']} no existe o cambió",
+                                    "CompleteMultipartUpload")
+            part_paths.append(path)
+
+        temp, temp_path = self.temp_file()
+        try:
+            with temp:
+                for path in part_paths:
+                    with open(path, "rb") as part_file:
+                        shutil.copyfileobj(part_file, temp, CHUNK_SIZE)
+            etag = self._publish(temp_path, self.path_for(Key))
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return {"Key": Key, "ETag": etag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs) -> dict:
+        upload_dir = self._upload_dir(UploadId, Key, "AbortMultipartUpload")
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return {}
+
+    def object_url(self, storage_key: str) -> str:
+        """URL del objeto sin firma (requiere una firma para descargarlo)"""
+        return f"{self.base_url}{LOCAL_STORAGE_ROUTE}/{quote(storage_key)}"
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600, **kwargs) -> str:
+        methods = {"get_object": "GET", "put_object": "PUT", "upload_part": "PUT"}
+        if ClientMethod not in methods:
+            raise _client_error("InvalidArgument", f"Operación no soportada: {ClientMethod}", "GeneratePresignedUrl")
+        storage_key = Params["Key"]
+        expires = int(time.time()) + int(ExpiresIn)
+        upload_id = Params.get("UploadId", "")
+        part_number = str(Params["PartNumber"]) if "PartNumber" in Params else ""
+        query = {"expires": expires}
+        if upload_id:
+            query.update(upload_id=upload_id, part_number=part_number)
+        query["signature"] = _sign(methods[ClientMethod], storage_key, expires, upload_id, part_number)
+        return f"{self.object_url(storage_key)}?{urlencode(query)}"
+
+
+# ============================================================================
+# DESCARGAS Y SUBIDAS POR HTTP
+# ============================================================================
+
+def _parse_range(header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    (inicio, fin inclusivo) de un header `Range: bytes=...` con un solo rango,
+    o None para responder el archivo completo. Los rangos múltiples o mal
+    formados se ignoran (RFC 9110 lo permite).
+
+    Raises:
+        ValueError: el rango no se puede satisfacer (respuesta 416)
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else file_size - 1
+        elif end_text:
+            # bytes=-N: los últimos N bytes
+            start, end = max(file_size - int(end_text), 0), file_size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= file_size:
+        raise ValueError(header)
+    if end < start:
+        return None
+    return start, min(end, file_size - 1)
+
+
+class LocalFileResponse(Response):
+    """
+    Envía un archivo (o un rango) desde disco: con `sendfile` si el servidor
+    soporta `http.response.zerocopysend`, si no desde el archivo mapeado en
+    memoria (sin copiar a buffers de lectura intermedios).
+    """
+
+    def __init__(self, path: Path, stat: os.stat_result, media_type: str, byte_range: Optional[Tuple[int, int]],
+                 send_body: bool = True):
+        self.path = path
+        self.send_body = send_body
+        if byte_range is None:
+            self.offset, self.count = 0, stat.st_size
+            status_code = 200
+        else:
+            self.offset, self.count = byte_range[0], byte_range[1] - byte_range[0] + 1
+            status_code = 206
+        super().__init__(status_code=status_code, media_type=media_type, headers={
+            "Accept-Ranges": "bytes",
+            "ETag": _etag(stat),
+            "Last-Modified": format_datetime(datetime.fromtimestamp(stat.st_mtime, timezone.utc), usegmt=True),
+        })
+        self.headers["Content-Length"] = str(self.count)
+        if byte_range is not None:
+            self.headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{stat.st_size}"
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        with open(self.path, "rb") as file:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.offset,
+                    "count": self.count,
+                })
+                return
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                position, end = self.offset, self.offset + self.count
+                while position < end:
+                    chunk_end = min(position + CHUNK_SIZE, end)
+                    # El corte puede leer de disco (fallo de página): fuera del event loop
+                    chunk = await anyio.to_thread.run_sync(mapped.__getitem__, slice(position, chunk_end))
+                    position = chunk_end
+                    await send({"type": "http.response.body", "body": chunk, "more_body": position < end})
+
+
+def file_response(request: Request, store: LocalObjectStore, storage_key: str) -> Response:
+    """Respuesta de descarga de un objeto, completa o del rango pedido (GET/HEAD)"""
+    path = store.path_for(storage_key)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado en el storage")
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    # Con If-Range el rango solo vale si el cliente tiene la misma versión del archivo
+    if not if_range or if_range == _etag(stat):
+        try:
+            byte_range = _parse_range(request.headers.get("range"), stat.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{stat.st_size}"})
+
+    media_type = mimetypes.guess_type(storage_key)[0] or "application/octet-stream"
+    return LocalFileResponse(path, stat, media_type, byte_range, send_body=request.method != "HEAD")
+
+
+async def receive_upload(request: Request, store: LocalObjectStore, storage_key: str, max_size: int,
+                         upload_id: Optional[str] = None, part_number: Optional[int] = None) -> str:
+    """
+    Guarda el cuerpo de un PUT firmado como objeto o como parte de una subida
+    multipart. Se escribe a un temporal en bloques de CHUNK_SIZE fuera del
+    event loop y se publica al terminar. Retorna el ETag.
+    """
+    content_length = request.headers.get("content-length")
+    too_large = HTTPException(
+        status_code=400,
+        detail=f"El archivo es demasiado grande. Tamaño máximo: {max_size / 1024 / 1024} MB"
+    )
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        raise too_large
+
+    target_dir = store._upload_dir(upload_id, storage_key, "UploadPart") if upload_id else None
+    temp, temp_path = store.temp_file(target_dir)
+    try:
+        received = 0
+        buffer = bytearray()
+        with temp:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > max_size:
+                    raise too_large
+                buffer += chunk
+                if len(buffer) >= CHUNK_SIZE:
+                    await run_in_threadpool(temp.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await run_in_threadpool(temp.write, bytes(buffer))
+        if upload_id:
+            return await run_in_threadpool(store.commit_part, temp_path, storage_key, upload_id, part_number)
+        return await run_in_threadpool(store.commit_object, temp_path, storage_key)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
@@ -1,22 +1,84 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+import time
+
+# Inicio de la carga de la aplicación (métrica de arranque en frío, ver /health/storage)
+_IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import datetime
+from botocore.exceptions import ClientError
+import math
 
 import models
 import schemas
-from database import engine, get_db
-from auth import verify_password, get_password_hash, create_access_token
-from storage import storage_service
+from database import DatabaseSession, async_engine, engine, ensure_schema, get_database_session, get_pool_stats
+import auth
+import bulk_documents
+import dedup
+from download_urls import DOWNLOAD_URL_BATCH_MAX, download_url_cache
+from auth import Principal, create_access_token
+from catalog import counted_total, documents_version, ensure_document_counters, estimated_total, facet_cache
+from bulk_import import USER_KINDS, detect_format, import_users, read_records
+from dependencies import get_optional_principal, require_admin, require_student
+from hashing import hashing_executor, verify_password, hash_password
+import http_cache
+from pagination import decode_cursor, encode_cursor
+from rate_limit import login_rate_limiter
+from search import ensure_search_index, search_filter, search_order
+from tagging import ensure_document_tags, parse_tags, tag_counts, tag_filter
+from storage import MAX_FILE_SIZE, MAX_UPLOAD_PARTS, UPLOAD_PART_SIZE, storage_service
+import local_storage
+import processing
+import reconcile
+import semantic
+import uploads
+from uploads import upload_executor
+
+# Crear las tablas (y columnas nuevas) en la base de datos
+ensure_schema(engine)
+ensure_document_counters(engine)
+ensure_search_index(engine)
+ensure_document_tags(engine)
+dedup.ensure_content_dedup(engine)
+
+# Tiempo de importación y preparación del esquema (el cliente del storage se crea aparte, en el primer uso)
+STARTUP_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Ciclo de vida de la aplicación: inicia la reconciliación periódica del
+    storage (si RECONCILE_INTERVAL_HOURS > 0) y los workers de procesamiento
+    de documentos (si PROCESSING_MODE=workers) y carga el índice semántico
+    (si SEMANTIC_WARMUP=true); al apagar el servidor detiene los workers,
+    libera los pools de hashing y de subidas y las conexiones del engine
+    asíncrono.
+    """
+    reconcile_task = reconcile.start_background_task()
+    processing.start_workers()
+    semantic.start_warmup()
+    yield
+    if reconcile_task is not None:
+        reconcile_task.cancel()
+    await run_in_threadpool(processing.stop_workers)
+    hashing_executor.shutdown()
+    upload_executor.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
 
-# Crear las tablas en la base de datos
-models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="Bolivariano API",
     description="API de autenticación para el Asistente Académico Bolivariano",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS para permitir requests desde Vercel
@@ -30,6 +92,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Content-Range", "Accept-Ranges"],
 )
 
 
@@ -53,21 +116,142 @@ def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/health/db")
+def database_health(principal: Principal = Depends(require_admin)):
+    """
+    Métricas del pool de conexiones a la BD (solo admins): checkouts,
+    overflow, tiempo de espera por conexión y edad de las conexiones.
+    """
+    return get_pool_stats()
+
+
+@app.get("/health/rate-limit")
+def rate_limit_health(principal: Principal = Depends(require_admin)):
+    """
+    Contadores del rate limiter de login y del pool de hashing (solo admins).
+    Permite ver cuántas verificaciones bcrypt se evitaron.
+    """
+    return {
+        "rate_limit": login_rate_limiter.stats(),
+        "hashing": hashing_executor.stats()
+    }
+
+
+@app.get("/health/uploads")
+def uploads_health(principal: Principal = Depends(require_admin)):
+    """
+    Estado del pool de subidas al storage (solo admins): subidas en curso,
+    en cola y rechazadas con 503 por exceso de carga.
+    """
+    return upload_executor.stats()
+
+
+@app.get("/health/storage")
+def storage_health(principal: Principal = Depends(require_admin)):
+    """
+    Arranque en frío y cliente del storage (solo admins): tiempo de carga de
+    la aplicación, tiempo de creación del cliente (en su primer uso), espera
+    por una conexión del pool de S3/R2 y el resultado de la última
+    reconciliación periódica (ver reconcile.py).
+    """
+    return {
+        "startup_ms": round(1000 * STARTUP_SECONDS, 3),
+        **storage_service.stats(),
+        "reconcile": reconcile.last_report
+    }
+
+
+@app.get("/health/processing")
+async def processing_health(
+    principal: Principal = Depends(require_admin),
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Estado del procesamiento de documentos (solo admins): modo, workers
+    vivos, documentos procesados y con error desde el arranque, documentos
+    pendientes en la cola (ver processing.py) y el índice semántico de este
+    proceso (ver semantic.py).
+    """
+    return {
+        **processing.stats(),
+        "queue_length": await db.run(processing.queue_length),
+        "semantic_index": semantic.semantic_index.stats()
+    }
+
+
+def _commit_and_refresh(db: Session, instance):
+    """Guarda una entidad nueva y la recarga desde la BD (se ejecuta con `DatabaseSession.run`)"""
+    db.add(instance)
+    db.commit()
+    db.refresh(instance)
+    return instance
+
+
+def _student_profile(student: models.Student) -> dict:
+    """Snapshot del perfil del estudiante que se embebe en los tokens "profile" """
+    return {
+        "id": student.id,
+        "student_id": student.student_id,
+        "full_name": student.full_name,
+        "email": student.email,
+        "is_active": student.is_active,
+        "created_at": student.created_at.isoformat() if student.created_at else None,
+    }
+
+
+def _admin_profile(admin: models.Admin) -> dict:
+    """Snapshot del perfil del admin que se embebe en los tokens "profile" """
+    return {
+        "id": admin.id,
+        "username": admin.username,
+        "full_name": admin.full_name,
+        "email": admin.email,
+        "is_active": admin.is_active,
+        "is_superuser": admin.is_superuser,
+        "created_at": admin.created_at.isoformat() if admin.created_at else None,
+    }
+
+
+def _issue_tokens(token_data: dict, profile: dict, token_version: int, token_format: Optional[str]) -> dict:
+    """
+    Emite los tokens del login según el formato solicitado.
+    "legacy" conserva el token único de larga duración; "profile" emite un
+    access token corto con el perfil embebido más un refresh token.
+    """
+    token_format = (token_format or auth.TOKEN_FORMAT).lower()
+    if token_format == "profile":
+        return auth.create_profile_tokens(token_data, profile, token_version)
+    if token_format != "legacy":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="token_format inválido. Valores permitidos: legacy, profile"
+        )
+    return {"access_token": create_access_token(data=token_data)}
+
+
 # ===== ENDPOINTS DE AUTENTICACIÓN =====
 
 @app.post("/api/auth/login/student", response_model=schemas.TokenResponse)
-def login_student(
+async def login_student(
+    request: Request,
     credentials: schemas.StudentLoginRequest,
-    db: Session = Depends(get_db)
+    token_format: Optional[str] = Query(None, description="legacy o profile (por defecto TOKEN_FORMAT)"),
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Endpoint de login para estudiantes.
     Valida el código estudiantil y contraseña.
+    La verificación bcrypt se ejecuta en el pool de hashing, no en el threadpool.
     """
+    # Rate limiting antes de tocar la BD o hashear
+    login_rate_limiter.check(request, f"student:{credentials.student_id}")
+    
     # Buscar estudiante por student_id
-    student = db.query(models.Student).filter(
-        models.Student.student_id == credentials.student_id
-    ).first()
+    student = await db.run(
+        lambda session: session.query(models.Student).filter(
+            models.Student.student_id == credentials.student_id
+        ).first()
+    )
     
     if not student:
         raise HTTPException(
@@ -76,12 +260,15 @@ def login_student(
         )
     
     # Verificar contraseña
-    if not verify_password(credentials.password, student.hashed_password):
+    if not await verify_password(credentials.password, student.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Código estudiantil o contraseña incorrectos"
         )
     
+    # Contraseña correcta: el intento no cuenta contra el rate limit
+    login_rate_limiter.succeeded(request, f"student:{credentials.student_id}")
+    
     # Verificar que el usuario esté activo
     if not student.is_active:
         raise HTTPException(
@@ -89,17 +276,20 @@ def login_student(
             detail="Usuario inactivo. Contacta al administrador."
         )
     
-    # Crear token JWT
-    access_token = create_access_token(
-        data={
+    # Crear token(s) JWT
+    tokens = _issue_tokens(
+        {
             "sub": student.student_id,
             "role": "student",
             "user_id": student.id
-        }
+        },
+        _student_profile(student),
+        student.token_version,
+        token_format
     )
     
     return {
-        "access_token": access_token,
+        **tokens,
         "token_type": "bearer",
         "role": "student",
         "user": {
@@ -112,18 +302,26 @@ def login_student(
 
 
 @app.post("/api/auth/login/admin", response_model=schemas.TokenResponse)
-def login_admin(
+async def login_admin(
+    request: Request,
     credentials: schemas.AdminLoginRequest,
-    db: Session = Depends(get_db)
+    token_format: Optional[str] = Query(None, description="legacy o profile (por defecto TOKEN_FORMAT)"),
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Endpoint de login para administradores.
     Valida el username y contraseña.
+    La verificación bcrypt se ejecuta en el pool de hashing, no en el threadpool.
     """
+    # Rate limiting antes de tocar la BD o hashear
+    login_rate_limiter.check(request, f"admin:{credentials.username}")
+    
     # Buscar admin por username
-    admin = db.query(models.Admin).filter(
-        models.Admin.username == credentials.username
-    ).first()
+    admin = await db.run(
+        lambda session: session.query(models.Admin).filter(
+            models.Admin.username == credentials.username
+        ).first()
+    )
     
     if not admin:
         raise HTTPException(
@@ -132,12 +330,15 @@ def login_admin(
         )
     
     # Verificar contraseña
-    if not verify_password(credentials.password, admin.hashed_password):
+    if not await verify_password(credentials.password, admin.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario o contraseña incorrectos"
         )
     
+    # Contraseña correcta: el intento no cuenta contra el rate limit
+    login_rate_limiter.succeeded(request, f"admin:{credentials.username}")
+    
     # Verificar que el usuario esté activo
     if not admin.is_active:
         raise HTTPException(
@@ -145,18 +346,21 @@ def login_admin(
             detail="Usuario inactivo. Contacta al superadministrador."
         )
     
-    # Crear token JWT
-    access_token = create_access_token(
-        data={
+    # Crear token(s) JWT
+    tokens = _issue_tokens(
+        {
             "sub": admin.username,
             "role": "admin",
             "user_id": admin.id,
             "is_superuser": admin.is_superuser
-        }
+        },
+        _admin_profile(admin),
+        admin.token_version,
+        token_format
     )
     
     return {
-        "access_token": access_token,
+        **tokens,
         "token_type": "bearer",
         "role": "admin",
         "user": {
@@ -169,22 +373,73 @@ def login_admin(
     }
 
 
+@app.post("/api/auth/refresh", response_model=schemas.TokenResponse)
+async def refresh_tokens(
+    request: schemas.RefreshTokenRequest,
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Emite un nuevo par de tokens "profile" a partir de un refresh token.
+    Aquí sí se consulta la BD: se valida que el usuario siga activo y que su
+    token_version no haya cambiado (revocación). El refresh token se rota.
+    """
+    payload = auth.decode_access_token(request.refresh_token)
+    if not payload or payload.get("typ") != "refresh":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token inválido o expirado"
+        )
+    
+    role = payload.get("role")
+    model = models.Student if role == "student" else models.Admin if role == "admin" else None
+    user = await db.run(lambda session: session.get(model, payload.get("user_id"))) if model else None
+    
+    if not user or not user.is_active or user.token_version != payload.get("tv"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token revocado. Inicia sesión nuevamente."
+        )
+    
+    if role == "student":
+        token_data = {"sub": user.student_id, "role": "student", "user_id": user.id}
+        profile = _student_profile(user)
+    else:
+        token_data = {
+            "sub": user.username,
+            "role": "admin",
+            "user_id": user.id,
+            "is_superuser": user.is_superuser
+        }
+        profile = _admin_profile(user)
+    
+    tokens = auth.create_profile_tokens(token_data, profile, user.token_version)
+    
+    return {
+        **tokens,
+        "token_type": "bearer",
+        "role": role,
+        "user": {key: value for key, value in profile.items() if key not in ("is_active", "created_at")}
+    }
+
+
 # ===== ENDPOINTS DE REGISTRO (OPCIONAL - PARA TESTING) =====
 
 @app.post("/api/students/register", response_model=schemas.StudentResponse)
-def register_student(
+async def register_student(
     student: schemas.StudentCreate,
-    db: Session = Depends(get_db)
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Registra un nuevo estudiante.
     (En producción, esto debería estar protegido o deshabilitado)
     """
     # Verificar si ya existe
-    existing = db.query(models.Student).filter(
-        (models.Student.student_id == student.student_id) |
-        (models.Student.email == student.email)
-    ).first()
+    existing = await db.run(
+        lambda session: session.query(models.Student).filter(
+            (models.Student.student_id == student.student_id) |
+            (models.Student.email == student.email)
+        ).first()
+    )
     
     if existing:
         raise HTTPException(
@@ -197,30 +452,28 @@ def register_student(
         student_id=student.student_id,
         full_name=student.full_name,
         email=student.email,
-        hashed_password=get_password_hash(student.password)
+        hashed_password=await hash_password(student.password)
     )
     
-    db.add(db_student)
-    db.commit()
-    db.refresh(db_student)
-    
-    return db_student
+    return await db.run(_commit_and_refresh, db_student)
 
 
 @app.post("/api/admins/register", response_model=schemas.AdminResponse)
-def register_admin(
+async def register_admin(
     admin: schemas.AdminCreate,
-    db: Session = Depends(get_db)
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Registra un nuevo administrador.
     (En producción, esto debería estar muy protegido)
     """
     # Verificar si ya existe
-    existing = db.query(models.Admin).filter(
-        (models.Admin.username == admin.username) |
-        (models.Admin.email == admin.email)
-    ).first()
+    existing = await db.run(
+        lambda session: session.query(models.Admin).filter(
+            (models.Admin.username == admin.username) |
+            (models.Admin.email == admin.email)
+        ).first()
+    )
     
     if existing:
         raise HTTPException(
@@ -233,66 +486,293 @@ def register_admin(
         username=admin.username,
         full_name=admin.full_name,
         email=admin.email,
-        hashed_password=get_password_hash(admin.password),
+        hashed_password=await hash_password(admin.password),
         is_superuser=admin.is_superuser
     )
     
-    db.add(db_admin)
-    db.commit()
-    db.refresh(db_admin)
-    
-    return db_admin
+    return await db.run(_commit_and_refresh, db_admin)
 
 
 # ===== ENDPOINTS DE INFORMACIÓN =====
 
 @app.get("/api/students/me", response_model=schemas.StudentResponse)
-def get_current_student(
-    token: str,
-    db: Session = Depends(get_db)
+async def get_current_student(
+    principal: Principal = Depends(require_student),
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
-    Obtiene información del estudiante actual basado en el token.
+    Obtiene información del estudiante actual basado en el token
+    (header `Authorization: Bearer <token>`).
+    Con tokens en formato "profile" se responde desde los claims, sin consultar la BD.
     """
-    from auth import decode_access_token
+    profile = auth.get_profile_claims(principal.claims)
+    if profile is not None:
+        return profile
     
-    payload = decode_access_token(token)
-    if not payload or payload.get("role") != "student":
+    student = await db.run(lambda session: session.get(models.Student, principal.user_id))
+    
+    if not student:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token inválido o expirado"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Estudiante no encontrado"
         )
     
-    student = db.query(models.Student).filter(
-        models.Student.student_id == payload.get("sub")
-    ).first()
+    return student
+
+
+@app.get("/api/admins/me", response_model=schemas.AdminResponse)
+async def get_current_admin(
+    principal: Principal = Depends(require_admin),
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Obtiene información del administrador actual basado en el token.
+    Con tokens en formato "profile" se responde desde los claims, sin consultar la BD.
+    """
+    profile = auth.get_profile_claims(principal.claims)
+    if profile is not None:
+        return profile
     
-    if not student:
+    admin = await db.run(lambda session: session.get(models.Admin, principal.user_id))
+    
+    if not admin:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Administrador no encontrado"
+        )
+    
+    return admin
+
+
+# ===== ENDPOINTS DE REVOCACIÓN DE TOKENS =====
+
+def _bump_token_version(db: Session, model, key_column, key_value) -> bool:
+    """Incrementa token_version del usuario; retorna False si no existe"""
+    user = db.query(model).filter(key_column == key_value).first()
+    if not user:
+        return False
+    user.token_version = model.token_version + 1
+    db.commit()
+    return True
+
+
+@app.post("/api/admins/students/{student_id}/revoke-tokens", response_model=schemas.MessageResponse)
+async def revoke_student_tokens(
+    student_id: str,
+    principal: Principal = Depends(require_admin),
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Revoca los refresh tokens de un estudiante incrementando su token_version.
+    Los access tokens ya emitidos dejan de renovarse y expiran en minutos.
+    """
+    revoked = await db.run(_bump_token_version, models.Student, models.Student.student_id, student_id)
+    
+    if not revoked:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Estudiante no encontrado"
         )
     
-    return student
+    return {"message": "Tokens revocados exitosamente", "detail": student_id}
+
+
+@app.post("/api/admins/{username}/revoke-tokens", response_model=schemas.MessageResponse)
+async def revoke_admin_tokens(
+    username: str,
+    principal: Principal = Depends(require_admin),
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Revoca los refresh tokens de un administrador.
+    Solo un superusuario puede revocar tokens de otro administrador.
+    """
+    if not principal.is_superuser and principal.subject != username:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Se requieren permisos de superusuario"
+        )
+    
+    revoked = await db.run(_bump_token_version, models.Admin, models.Admin.username, username)
+    
+    if not revoked:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Administrador no encontrado"
+        )
+    
+    return {"message": "Tokens revocados exitosamente", "detail": username}
+
+
+# ===== ENDPOINTS DE IMPORTACIÓN MASIVA =====
+
+@app.post("/api/admins/import/{kind}", response_model=schemas.ImportReportResponse)
+def import_users_endpoint(
+    kind: str,
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Form(None),
+    update_existing: bool = Form(False),
+    principal: Principal = Depends(require_admin)
+):
+    """
+    Importa estudiantes o administradores desde un archivo CSV o NDJSON.
+    El archivo se procesa en streaming y por lotes (ver bulk_import.py).
+    Importar administradores requiere ser superusuario.
+    """
+    if kind not in USER_KINDS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Tipo de importación no válido. Usa students o admins"
+        )
+    
+    if kind == "admins" and not principal.is_superuser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Se requieren permisos de superusuario"
+        )
+    
+    fmt = file_format or detect_format(file.filename)
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Formato no soportado. Usa csv o ndjson"
+        )
+    
+    try:
+        report = import_users(
+            kind,
+            read_records(file.file, fmt),
+            update_existing=update_existing
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Archivo inválido: {str(e)}"
+        )
+    
+    return report.to_dict()
 
 
 # ===== ENDPOINTS DE GESTIÓN DE DOCUMENTOS =====
 
+def _get_document_or_404(db: Session, document_id: int) -> models.Document:
+    """Busca un documento por ID o responde 404"""
+    document = db.query(models.Document).filter(
+        models.Document.id == document_id
+    ).first()
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Documento no encontrado"
+        )
+    
+    return document
+
+
+def _save_uploaded_document(db: Session, db_document: models.Document) -> models.Document:
+    """
+    Crea el registro del documento subido en estado PROCESSING; los workers
+    de processing.py extraen el texto y lo marcan READY o ERROR (con
+    PROCESSING_MODE=inline lo procesa `_process_inline` después del commit)
+    """
+    db.add(db_document)
+    db.commit()
+    
+    if processing.PROCESSING_MODE != "inline":
+        processing.notify_workers()
+    
+    db.refresh(db_document)
+    return db_document
+
+
+def _refresh(db: Session, instance):
+    db.refresh(instance)
+    return instance
+
+
+async def _process_inline(db: DatabaseSession, document: models.Document) -> models.Document:
+    """
+    Sin procesos en segundo plano (serverless): procesa el documento antes de
+    responder. Corre en el threadpool y no dentro de `db.run`, que con
+    DB_ASYNC ejecuta en el event loop.
+    """
+    if processing.PROCESSING_MODE != "inline":
+        return document
+    await run_in_threadpool(processing.process_document, document.id)
+    return await db.run(_refresh, document)
+
+
+def _save_deduplicated_document(db: Session, db_document: models.Document, content_hash: str):
+    """
+    Guarda un documento con su contenido deduplicado (ver dedup.py).
+    Retorna (documento, keys del storage que quedaron sin uso).
+    """
+    dedup.attach_stored_object(db, db_document, content_hash)
+    document = _save_uploaded_document(db, db_document)
+    return document, dedup.pop_released_keys(db)
+
+
+async def _delete_storage_objects(storage_keys: List[str]) -> None:
+    """Borra objetos que ya no usa ningún documento (los errores solo se registran)"""
+    if not storage_keys:
+        return
+    download_url_cache.evict(storage_keys)
+    errors = await run_in_threadpool(storage_service.delete_files, storage_keys)
+    for storage_key, error in errors.items():
+        if error:
+            print(f"Error al eliminar archivo del storage {storage_key}: {error}")
+
+
+async def _store_uploaded_document(db: DatabaseSession, db_document: models.Document,
+                                   content_hash: Optional[str], upload) -> models.Document:
+    """
+    Guarda el documento subido. Con `content_hash` reutiliza el objeto del
+    mismo contenido si existe; `upload` sube el archivo si el documento no
+    tiene objeto propio y el que se iba a reutilizar ya se eliminó.
+    """
+    if content_hash is None:
+        return await _process_inline(db, await db.run(_save_uploaded_document, db_document))
+    
+    try:
+        document, unused_keys = await db.run(_save_deduplicated_document, db_document, content_hash)
+    except dedup.StoredObjectMissing:
+        db_document.storage_url, db_document.storage_key = (await upload())[:2]
+        document, unused_keys = await db.run(_save_deduplicated_document, db_document, content_hash)
+    
+    # Otra subida del mismo contenido se guardó primero: su objeto propio sobra
+    await _delete_storage_objects(unused_keys)
+    return await _process_inline(db, document)
+
+
 @app.post("/api/documents/upload", response_model=schemas.DocumentResponse)
 async def upload_document(
     file: UploadFile = File(...),
     category: str = Form("Sin categoría"),
     description: Optional[str] = Form(None),
     tags: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    principal: Optional[Principal] = Depends(get_optional_principal),
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Endpoint para subir un nuevo documento a la base de conocimiento.
     El archivo se sube al storage en la nube (S3/R2) y se guarda la metadata en la BD.
+    Si la petición trae un token, se registra quién subió el documento.
+    Si ya existe un archivo con el mismo contenido (SHA-256) no se vuelve a
+    subir: el documento reutiliza el objeto existente.
     """
     try:
-        # Subir archivo al storage
-        storage_url, storage_key, file_size = storage_service.upload_file(file)
+        content_hash, stored = None, None
+        if dedup.dedup_enabled():
+            content_hash, file_size = await uploads.hash_upload(file)
+            stored = await db.run(dedup.find_stored_object, content_hash)
+        
+        if stored is not None:
+            # Mismo contenido ya guardado: no se escribe en el storage
+            storage_url, storage_key = None, None
+        else:
+            # Subir archivo al storage (boto3 es bloqueante: se ejecuta en el pool de subidas)
+            storage_url, storage_key, file_size = await uploads.upload_file(file)
         
         # Determinar el tipo de archivo
         file_type = file.filename.split('.')[-1].upper()
@@ -307,21 +787,14 @@ async def upload_document(
             tags=tags,
             storage_url=storage_url,
             storage_key=storage_key,
+            uploaded_by=principal.user_id if principal else None,
+            uploaded_by_type=principal.role if principal else None,
             status=models.DocumentStatus.PROCESSING
         )
         
-        db.add(db_document)
-        db.commit()
-        db.refresh(db_document)
-        
-        # Simular procesamiento automático (en producción, esto sería async)
-        # Por ahora lo marcamos como ready inmediatamente
-        db_document.status = models.DocumentStatus.READY
-        db_document.processed_at = datetime.now()
-        db.commit()
-        db.refresh(db_document)
-        
-        return db_document
+        return await _store_uploaded_document(
+            db, db_document, content_hash, lambda: uploads.upload_file(file)
+        )
         
     except HTTPException:
         raise
@@ -332,125 +805,663 @@ async def upload_document(
         )
 
 
+@app.post("/api/documents/uploads/initiate", response_model=schemas.DirectUploadInitiateResponse)
+async def initiate_direct_upload(
+    upload: schemas.DirectUploadInitiateRequest,
+    principal: Optional[Principal] = Depends(get_optional_principal)
+):
+    """
+    Primera fase de la subida directa al bucket: valida extensión y tamaño y
+    entrega una URL PUT firmada. Los bytes no pasan por la API.
+    """
+    storage_service.validate_upload(upload.filename, upload.file_size)
+    storage_key, presigned = await run_in_threadpool(
+        storage_service.prepare_direct_upload,
+        upload.filename,
+        upload.content_type,
+        uploads.UPLOAD_URL_EXPIRE_SECONDS
+    )
+    return {
+        "upload_url": presigned["url"],
+        "method": presigned["method"],
+        "headers": presigned["headers"],
+        "storage_key": storage_key,
+        "upload_token": uploads.create_upload_ticket(storage_key, upload.filename, principal),
+        "expires_in": uploads.UPLOAD_URL_EXPIRE_SECONDS
+    }
+
+
+def _find_stored_content(db: Session, content_hash: str):
+    """Objeto ya guardado con este contenido y el tipo de archivo de un documento que lo usa"""
+    stored = dedup.find_stored_object(db, content_hash)
+    if stored is None:
+        return None, None
+    file_type = db.query(models.Document.file_type).filter(
+        models.Document.content_hash == content_hash
+    ).limit(1).scalar()
+    return stored, file_type
+
+
+@app.put("/api/documents/uploads/stream", response_model=schemas.DocumentResponse)
+async def stream_upload_document(
+    request: Request,
+    filename: str = Query(..., min_length=1),
+    category: str = Query("Sin categoría"),
+    description: Optional[str] = None,
+    tags: Optional[str] = None,
+    principal: Optional[Principal] = Depends(get_optional_principal),
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Sube un archivo grande enviado como cuerpo crudo de la petición (no
+    multipart/form-data). Se valida y se hashea mientras llega y se sube al
+    storage por partes, sin guardar el archivo completo en memoria ni en disco.
+    El header opcional `X-Content-SHA256` permite verificar la integridad y,
+    si un administrador sube un contenido ya guardado, omitir la transferencia
+    del archivo. Para el resto el hash declarado no prueba que se tenga el
+    archivo: el cuerpo se lee y se hashea siempre.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        # Rechazar antes de leer el cuerpo si el tamaño declarado ya excede el máximo
+        storage_service.validate_upload(filename, int(content_length))
+    
+    expected_sha256 = request.headers.get("x-content-sha256")
+    
+    def upload():
+        return uploads.stream_upload(
+            request.stream(),
+            filename,
+            request.headers.get("content-type"),
+            expected_sha256
+        )
+    
+    stored, file_type = None, filename.split('.')[-1].upper()
+    if expected_sha256 and dedup.dedup_enabled() and principal is not None and principal.is_admin:
+        stored, stored_file_type = await db.run(_find_stored_content, expected_sha256.lower())
+    
+    if stored is not None:
+        # Mismo contenido ya guardado: no se lee ni se sube el cuerpo
+        storage_service.validate_upload(filename, stored.file_size)
+        storage_url, storage_key, file_size, content_hash = None, None, stored.file_size, stored.content_hash
+        # El tipo lo define el contenido guardado, no la extensión declarada
+        file_type = stored_file_type or file_type
+    else:
+        storage_url, storage_key, file_size, content_hash = await upload()
+    
+    db_document = models.Document(
+        name=filename,
+        file_type=file_type,
+        file_size=file_size,
+        category=category,
+        description=description,
+        tags=tags,
+        storage_url=storage_url,
+        storage_key=storage_key,
+        uploaded_by=principal.user_id if principal else None,
+        uploaded_by_type=principal.role if principal else None,
+        status=models.DocumentStatus.PROCESSING
+    )
+    return await _store_uploaded_document(
+        db, db_document, content_hash if dedup.dedup_enabled() else None, upload
+    )
+
+
+@app.post("/api/documents/uploads/multipart/initiate", response_model=schemas.MultipartUploadInitiateResponse)
+async def initiate_multipart_upload(
+    upload: schemas.DirectUploadInitiateRequest,
+    principal: Optional[Principal] = Depends(get_optional_principal)
+):
+    """
+    Inicia una subida multipart directa al bucket para archivos grandes. El
+    ticket devuelto sirve para pedir las URLs de las partes (y retomar la
+    subida si se interrumpe) y para finalizarla en `/api/documents/uploads/finalize`.
+    """
+    storage_service.validate_upload(upload.filename, upload.file_size)
+    part_size = max(UPLOAD_PART_SIZE, math.ceil(upload.file_size / MAX_UPLOAD_PARTS))
+    part_count = max(1, math.ceil(upload.file_size / part_size))
+    
+    storage_key = storage_service.generate_storage_key(upload.filename)
+    upload_id = await run_in_threadpool(
+        storage_service.start_multipart_upload, storage_key, upload.filename, upload.content_type
+    )
+    return {
+        "storage_key": storage_key,
+        "upload_id": upload_id,
+        "part_size": part_size,
+        "part_count": part_count,
+        "upload_token": uploads.create_upload_ticket(
+            storage_key, upload.filename, principal, upload_id=upload_id, part_count=part_count
+        ),
+        "expires_in": uploads.UPLOAD_RESUME_HOURS * 3600
+    }
+
+
+def _read_multipart_ticket(upload_token: str) -> dict:
+    ticket = uploads.read_upload_ticket(upload_token)
+    if not ticket.get("upload_id"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El ticket no corresponde a una subida multipart"
+        )
+    return ticket
+
+
+def _part_urls(ticket: dict, part_numbers: Optional[List[int]]) -> dict:
+    """Partes ya subidas y URLs firmadas para las pedidas (o todas las que falten)"""
+    storage_key, upload_id = ticket["key"], ticket["upload_id"]
+    uploaded = storage_service.list_uploaded_parts(storage_key, upload_id)
+    if part_numbers is None:
+        done = {part["PartNumber"] for part in uploaded}
+        part_numbers = [number for number in range(1, ticket["parts"] + 1) if number not in done]
+    return {
+        "upload_id": upload_id,
+        "uploaded_parts": [{"part_number": part["PartNumber"], "size": part["Size"]} for part in uploaded],
+        "urls": [
+            {
+                "part_number": number,
+                "url": storage_service.generate_presigned_part_url(
+                    storage_key, upload_id, number, uploads.UPLOAD_URL_EXPIRE_SECONDS
+                )
+            }
+            for number in part_numbers
+        ],
+        "expires_in": uploads.UPLOAD_URL_EXPIRE_SECONDS
+    }
+
+
+@app.post("/api/documents/uploads/multipart/parts", response_model=schemas.MultipartPartsResponse)
+async def get_multipart_part_urls(parts_request: schemas.MultipartPartsRequest):
+    """
+    URLs firmadas (PUT) para subir partes directamente al bucket. Sin
+    `part_numbers` devuelve las de todas las partes que falten, así que tras
+    una interrupción basta con volver a llamarlo para retomar la subida.
+    """
+    ticket = _read_multipart_ticket(parts_request.upload_token)
+    if parts_request.part_numbers and not all(1 <= n <= ticket["parts"] for n in parts_request.part_numbers):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Los números de parte deben estar entre 1 y {ticket['parts']}"
+        )
+    return await run_in_threadpool(_part_urls, ticket, parts_request.part_numbers)
+
+
+@app.post("/api/documents/uploads/multipart/abort", response_model=schemas.MessageResponse)
+async def abort_multipart_upload(abort_request: schemas.UploadTokenRequest):
+    """Cancela una subida multipart directa y libera las partes ya subidas"""
+    ticket = _read_multipart_ticket(abort_request.upload_token)
+    await run_in_threadpool(storage_service.abort_multipart_upload, ticket["key"], ticket["upload_id"])
+    return {"message": "Subida cancelada", "detail": ticket["key"]}
+
+
+def _find_document_by_storage_key(db: Session, storage_key: str) -> Optional[models.Document]:
+    return db.query(models.Document).filter(models.Document.storage_key == storage_key).first()
+
+
+def _save_direct_upload(db: Session, db_document: models.Document) -> models.Document:
+    """Como `_save_uploaded_document`, pero si otra petición ya finalizó la misma subida retorna ese documento"""
+    try:
+        return _save_uploaded_document(db, db_document)
+    except IntegrityError:
+        db.rollback()
+        return _find_document_by_storage_key(db, db_document.storage_key)
+
+
+@app.post("/api/documents/uploads/finalize", response_model=schemas.DocumentResponse)
+async def finalize_direct_upload(
+    finalize: schemas.DirectUploadFinalizeRequest,
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Segunda fase de la subida directa: confirma con HEAD que el archivo está
+    en el bucket (y su tamaño real) y crea el documento. En subidas multipart
+    primero une las partes subidas. Repetir la llamada con el mismo ticket
+    retorna el documento ya creado.
+    """
+    ticket = uploads.read_upload_ticket(finalize.upload_token)
+    storage_key = ticket["key"]
+    
+    existing = await db.run(_find_document_by_storage_key, storage_key)
+    if existing:
+        return existing
+    
+    if ticket.get("upload_id"):
+        # Subida multipart: unir las partes que el cliente subió al bucket
+        try:
+            await run_in_threadpool(storage_service.complete_multipart_upload, storage_key, ticket["upload_id"])
+        except HTTPException as e:
+            # 404: la subida ya se completó (p. ej. un finalize anterior que falló después)
+            if e.status_code != status.HTTP_404_NOT_FOUND:
+                raise
+    storage_url, file_size = await run_in_threadpool(storage_service.confirm_direct_upload, storage_key)
+    
+    db_document = models.Document(
+        name=ticket["name"],
+        file_type=ticket["name"].split('.')[-1].upper(),
+        file_size=file_size,
+        category=finalize.category,
+        description=finalize.description,
+        tags=finalize.tags,
+        storage_url=storage_url,
+        storage_key=storage_key,
+        uploaded_by=ticket.get("uploaded_by"),
+        uploaded_by_type=ticket.get("uploaded_by_type"),
+        status=models.DocumentStatus.PROCESSING
+    )
+    return await _process_inline(db, await db.run(_save_direct_upload, db_document))
+
+
+def _count_documents(
+    db: Session,
+    query,
+    category: Optional[str],
+    document_status: Optional[str],
+    needs_scan: bool,
+    total_mode: str
+) -> tuple:
+    """
+    Total del listado según `total_mode`. Retorna (total, es_estimado).
+    `needs_scan` indica filtros que los contadores no cubren (búsqueda, tags).
+
+    - none: no se cuenta (scroll infinito)
+    - exact: solo con categoría/estado sale de `document_counters`; si no, COUNT(*)
+    - estimated: contadores si alcanzan; si no, estimación del planificador
+      (PostgreSQL) y COUNT(*) solo en otros motores
+    """
+    if total_mode == "none":
+        return None, False
+    
+    if not needs_scan:
+        return counted_total(db, category, document_status), False
+    
+    if total_mode == "estimated":
+        estimate = estimated_total(db, query)
+        if estimate is not None:
+            return estimate, True
+    
+    return query.count(), False
+
+
+# Campos que se pueden pedir en `fields=` (todas las columnas de DocumentResponse)
+DOCUMENT_FIELDS = tuple(schemas.DocumentProjection.model_fields)
+
+
+def _projection_columns(fields: str, use_cursor: bool) -> List[str]:
+    """
+    Valida `fields=` y retorna las columnas a seleccionar. Siempre incluye
+    `id` y, con paginación por cursor, `created_at` (necesario para el cursor).
+    """
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in DOCUMENT_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Campos inválidos: {', '.join(unknown)}. Permitidos: {', '.join(DOCUMENT_FIELDS)}"
+        )
+    columns = ["id"] + [name for name in requested if name != "id"]
+    if use_cursor and "created_at" not in columns:
+        columns.append("created_at")
+    return list(dict.fromkeys(columns))
+
+
+def _projection_response(result: dict, fields: List[str]) -> dict:
+    """
+    Serializa un listado proyectado con el modelo liviano `DocumentProjection`,
+    sin validar fila por fila: cada documento incluye solo `fields`.
+    """
+    documents = []
+    for row in result["documents"]:
+        values = {name: row._mapping[name] for name in fields}
+        if values.get("status") is not None:
+            values["status"] = schemas.DocumentStatusEnum(values["status"].value)
+        documents.append(schemas.DocumentProjection.model_construct(**values))
+    response = schemas.DocumentProjectionListResponse.model_construct(**{**result, "documents": documents})
+    return response.model_dump(mode="json", exclude_unset=True)
+
+
+def _query_documents(
+    db: Session,
+    skip: int,
+    limit: int,
+    category: Optional[str],
+    document_status: Optional[str],
+    search: Optional[str],
+    cursor: Optional[str] = None,
+    use_cursor: bool = False,
+    total_mode: str = "exact",
+    search_mode: str = "fulltext",
+    tag_names: Optional[List[str]] = None,
+    match_all_tags: bool = False,
+    columns: Optional[List[str]] = None
+) -> dict:
+    """
+    Consulta paginada de documentos con filtros.
+    Con `use_cursor` pagina por keyset sobre (created_at, id) en lugar de OFFSET.
+    El total se calcula según `total_mode` (ver `_count_documents`).
+    Con `search_mode="fulltext"` busca en nombre, descripción y tags (ver search.py)
+    y, en paginación por offset, ordena por relevancia.
+    `tag_names` filtra por tags normalizados: alguno (OR) o todos con `match_all_tags` (AND).
+    Con `columns` solo se seleccionan esas columnas y los documentos son filas, no objetos ORM.
+    """
+    if columns:
+        query = db.query(*[getattr(models.Document, name) for name in columns])
+    else:
+        query = db.query(models.Document)
+    dialect_name = db.get_bind().dialect.name
+    
+    if category == "all":
+        category = None
+    
+    # Aplicar filtros
+    if category:
+        query = query.filter(models.Document.category == category)
+    
+    if document_status:
+        query = query.filter(models.Document.status == document_status)
+    
+    if search and search_mode == "fulltext":
+        query = query.filter(search_filter(dialect_name, search))
+    elif search:
+        query = query.filter(models.Document.name.ilike(f"%{search}%"))
+    
+    if tag_names:
+        query = query.filter(tag_filter(tag_names, match_all_tags))
+    
+    # Contar total (sin recorrer la tabla salvo en búsquedas o filtros por tag exactos)
+    total, total_is_estimate = _count_documents(
+        db, query, category or None, document_status or None,
+        bool(search or tag_names), total_mode
+    )
+    
+    # Ordenar por fecha de creación (más recientes primero); el id desempata
+    # para que el orden sea total y el cursor no salte ni repita filas
+    query = query.order_by(models.Document.created_at.desc(), models.Document.id.desc())
+    
+    if not use_cursor:
+        # Paginación por offset (compatibilidad); las búsquedas salen por relevancia
+        if search and search_mode == "fulltext":
+            query = query.order_by(None).order_by(
+                *search_order(dialect_name, search),
+                models.Document.created_at.desc(),
+                models.Document.id.desc()
+            )
+        documents = query.offset(skip).limit(limit).all()
+        return {
+            "total": total,
+            "total_is_estimate": total_is_estimate,
+            "documents": documents
+        }
+    
+    # Paginación por keyset: continuar después de la última fila de la página anterior
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        created_at_column = models.Document.created_at
+        if dialect_name == "sqlite":
+            # SQLite guarda las fechas como texto: las del server_default sin fracción
+            # ('HH:MM:SS') y los parámetros con ella ('HH:MM:SS.000000'). Comparadas
+            # como texto, las fechas iguales no cumplirían el empate y se repetirían páginas
+            created_at_column = func.julianday(created_at_column)
+            created_at = func.julianday(created_at)
+        query = query.filter(
+            tuple_(created_at_column, models.Document.id) < tuple_(created_at, last_id)
+        )
+    
+    # Se pide una fila extra para saber si hay una página siguiente
+    documents = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1].created_at, documents[-1].id)
+    
+    return {
+        "total": total,
+        "total_is_estimate": total_is_estimate,
+        "documents": documents,
+        "next_cursor": next_cursor
+    }
+
+
 @app.get("/api/documents", response_model=schemas.DocumentListResponse)
-def list_documents(
+async def list_documents(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     category: Optional[str] = None,
     status: Optional[str] = None,
     search: Optional[str] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Cursor devuelto en next_cursor por la página anterior"),
+    pagination: str = Query("offset", pattern="^(offset|cursor)$", description="offset (skip/limit) o cursor (keyset)"),
+    include_total: bool = Query(True, description="false omite el total (scroll infinito)"),
+    total_mode: str = Query("exact", alias="total", pattern="^(exact|estimated)$", description="exact o estimated"),
+    search_mode: str = Query("fulltext", pattern="^(fulltext|name)$", description="fulltext (nombre, descripción y tags) o name (solo nombre)"),
+    tags: Optional[str] = Query(None, description="Tags separados por comas"),
+    tags_match: str = Query("any", pattern="^(any|all)$", description="any (alguno de los tags) o all (todos)"),
+    fields: Optional[str] = Query(None, description="Columnas a devolver, separadas por comas (p. ej. id,name,file_size)"),
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Lista todos los documentos con filtros opcionales.
-    """
-    query = db.query(models.Document)
     
-    # Aplicar filtros
-    if category and category != "all":
-        query = query.filter(models.Document.category == category)
+    Paginación:
+    - offset (por defecto): `skip` + `limit`
+    - cursor: `pagination=cursor` para la primera página y luego `cursor=<next_cursor>`.
+      Cada página cuesta lo mismo sin importar la profundidad.
     
-    if status:
-        query = query.filter(models.Document.status == status)
+    Total:
+    - `include_total=false`: `total` es null y no se cuenta nada
+    - `total=exact` (por defecto): exacto; sin `search` se lee de la tabla de contadores
+    - `total=estimated`: con `search` usa la estimación del planificador
+      (`total_is_estimate=true`)
     
-    if search:
-        query = query.filter(models.Document.name.ilike(f"%{search}%"))
+    Búsqueda (`search`):
+    - `search_mode=fulltext` (por defecto): texto completo en nombre, descripción y
+      tags con índice, más coincidencia aproximada del nombre. Con paginación por
+      offset los resultados vienen ordenados por relevancia; con cursor, por fecha.
+    - `search_mode=name`: subcadena del nombre (comportamiento anterior)
+    
+    Tags: `tags=a,b` con `tags_match=any` (OR, por defecto) o `tags_match=all` (AND).
     
-    # Ordenar por fecha de creación (más recientes primero)
-    query = query.order_by(models.Document.created_at.desc())
+    Proyección: `fields=id,name,file_type,file_size,category,status` selecciona
+    solo esas columnas (sin cargar `description` ni objetos ORM) y cada documento
+    de la respuesta trae solo esos campos (más `id`).
     
-    # Contar total
-    total = query.count()
+    Responde con ETag (versión del catálogo + parámetros); con `If-None-Match`
+    vigente retorna 304 sin ejecutar la consulta.
+    """
+    etag = http_cache.collection_etag("documents", await db.run(documents_version), request)
+    if http_cache.matches(request, etag):
+        return http_cache.not_modified(etag)
+    
+    use_cursor = pagination == "cursor" or cursor is not None
+    if not include_total:
+        total_mode = "none"
+    columns = _projection_columns(fields, use_cursor) if fields else None
+    result = await db.run(
+        _query_documents, skip, limit, category, status, search, cursor, use_cursor,
+        total_mode, search_mode, parse_tags(tags), tags_match == "all", columns
+    )
     
-    # Aplicar paginación
-    documents = query.offset(skip).limit(limit).all()
+    if columns:
+        # Respuesta liviana: se omite la validación de DocumentListResponse
+        projected = JSONResponse(_projection_response(result, columns))
+        http_cache.set_cache_headers(projected, etag)
+        return projected
     
+    http_cache.set_cache_headers(response, etag)
+    return result
+
+
+@app.get("/api/documents/tags")
+async def list_tags(
+    request: Request,
+    response: Response,
+    prefix: Optional[str] = Query(None, description="Solo tags que empiezan por este texto"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Retorna los tags con su número de documentos, de más a menos usados.
+    Los conteos se mantienen al escribir los documentos: no se recorre la tabla.
+    """
+    etag = http_cache.collection_etag("tags", await db.run(documents_version), request)
+    if http_cache.matches(request, etag):
+        return http_cache.not_modified(etag)
+    
+    tags = await db.run(tag_counts, prefix, limit)
+    http_cache.set_cache_headers(response, etag)
     return {
-        "total": total,
-        "documents": documents
+        "tags": tags
     }
 
 
+@app.get("/api/documents/facets", response_model=schemas.DocumentFacetsResponse)
+async def get_document_facets(
+    request: Request,
+    response: Response,
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Resumen del catálogo por categoría y estado: número de documentos y bytes.
+    Se mantiene en la misma transacción que cada alta, edición o baja y se
+    sirve desde una caché en memoria invalidada por versión.
+    """
+    facets = await db.run(facet_cache.get)
+    etag = http_cache.collection_etag("facets", facets["version"], request)
+    if http_cache.matches(request, etag):
+        return http_cache.not_modified(etag)
+    http_cache.set_cache_headers(response, etag)
+    return facets
+
+
+@app.post("/api/documents/bulk/update", response_model=schemas.BulkOperationResponse)
+async def bulk_update_documents(
+    bulk_update: schemas.DocumentBulkUpdateRequest,
+    principal: Principal = Depends(require_admin),
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Aplica los mismos cambios de metadata a varios documentos (por IDs o por filtro)
+    en una sola transacción. Reporta el resultado de cada documento.
+    """
+    started = time.perf_counter()
+    changes = bulk_update.changes.model_dump(exclude_unset=True)
+    try:
+        results = await db.run(bulk_documents.update_documents, bulk_update, changes)
+    except bulk_documents.BulkSelectionError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return bulk_documents.summarize(results, time.perf_counter() - started)
+
+
+@app.post("/api/documents/bulk/delete", response_model=schemas.BulkOperationResponse)
+async def bulk_delete_documents(
+    bulk_delete: schemas.DocumentBulkDeleteRequest,
+    principal: Principal = Depends(require_admin),
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    Elimina varios documentos (por IDs o por filtro): las filas en una sola
+    transacción y los archivos con `delete_objects` en lotes de hasta 1000 keys.
+    Reporta el resultado de cada documento (`storage_error` si el archivo no se pudo borrar).
+    """
+    started = time.perf_counter()
+    try:
+        deleted, released_keys, missing = await db.run(bulk_documents.delete_document_rows, bulk_delete)
+    except bulk_documents.BulkSelectionError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    # Solo se borran los objetos que ya no usa ningún documento (ver dedup.py);
+    # boto3 es bloqueante: se ejecuta en el threadpool
+    download_url_cache.evict(released_keys)
+    storage_errors = await run_in_threadpool(storage_service.delete_files, released_keys) if released_keys else {}
+    
+    results = bulk_documents.delete_results(deleted, storage_errors, missing)
+    return bulk_documents.summarize(results, time.perf_counter() - started)
+
+
 @app.get("/api/documents/{document_id}", response_model=schemas.DocumentResponse)
-def get_document(
+async def get_document(
     document_id: int,
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Obtiene información detallada de un documento específico.
+    
+    Responde con ETag. Si el cliente envía uno emitido con la versión actual
+    del catálogo, retorna 304 sin leer el documento; si el catálogo cambió,
+    compara la fecha de modificación del documento.
     """
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
+    version = await db.run(documents_version)
+    client_etag = http_cache.current_document_etag(request, document_id, version)
+    if client_etag:
+        # Nada cambió en el catálogo desde que se emitió la etiqueta del cliente
+        return http_cache.not_modified(client_etag)
     
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Documento no encontrado"
-        )
+    document = await db.run(_get_document_or_404, document_id)
+    stamp = http_cache.document_stamp(document.updated_at, document.processed_at)
+    etag = http_cache.document_etag(document_id, stamp, version)
+    if http_cache.document_stamp_matches(request, document_id, stamp):
+        return http_cache.not_modified(etag)
+    
+    http_cache.set_cache_headers(response, etag)
+    return document
+
+
+def _update_document(db: Session, document_id: int, update_data: dict) -> models.Document:
+    """Aplica los cambios de metadata a un documento"""
+    document = _get_document_or_404(db, document_id)
+    
+    for field, value in update_data.items():
+        setattr(document, field, value)
+    
+    db.commit()
+    db.refresh(document)
     
     return document
 
 
 @app.put("/api/documents/{document_id}", response_model=schemas.DocumentResponse)
-def update_document(
+async def update_document(
     document_id: int,
     document_update: schemas.DocumentUpdate,
-    db: Session = Depends(get_db)
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Actualiza la metadata de un documento.
     """
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
-    
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Documento no encontrado"
-        )
-    
     # Actualizar solo los campos proporcionados
     update_data = document_update.model_dump(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(document, field, value)
-    
+    return await db.run(_update_document, document_id, update_data)
+
+
+def _delete_document_row(db: Session, document: models.Document) -> List[str]:
+    """Elimina la fila; retorna las keys del storage que ya no usa ningún documento"""
+    db.delete(document)
     db.commit()
-    db.refresh(document)
-    
-    return document
+    return dedup.pop_released_keys(db)
 
 
 @app.delete("/api/documents/{document_id}")
-def delete_document(
+async def delete_document(
     document_id: int,
-    db: Session = Depends(get_db)
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Elimina un documento de la base de conocimiento.
-    Elimina tanto el archivo del storage como el registro de la BD.
+    Elimina el registro de la BD y, si ningún otro documento usa el mismo
+    archivo (ver dedup.py), también el archivo del storage.
     """
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
-    
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Documento no encontrado"
-        )
-    
-    # Eliminar archivo del storage
-    try:
-        storage_service.delete_file(document.storage_key)
-    except Exception as e:
-        # Log el error pero continuar con la eliminación de la BD
-        print(f"Error al eliminar archivo del storage: {str(e)}")
+    document = await db.run(_get_document_or_404, document_id)
     
     # Eliminar registro de la BD
-    db.delete(document)
-    db.commit()
+    released_keys = await db.run(_delete_document_row, document)
+    
+    # Eliminar archivo del storage (boto3 es bloqueante: se ejecuta en el threadpool);
+    # si falla, el objeto queda huérfano pero el documento ya no existe
+    await _delete_storage_objects(released_keys)
     
     return {
         "message": "Documento eliminado exitosamente",
@@ -458,45 +1469,196 @@ def delete_document(
     }
 
 
+def _download_targets(db: Session, document_ids: List[int]) -> List[tuple]:
+    """(id, name, storage_key) de los documentos, en una sola consulta y sin cargar filas completas"""
+    return db.query(
+        models.Document.id, models.Document.name, models.Document.storage_key
+    ).filter(models.Document.id.in_(document_ids)).all()
+
+
+def _download_url(document_id: int, filename: str, storage_key: str) -> dict:
+    """Firma (o toma de la caché) la URL; bloqueante: se llama desde el threadpool"""
+    download_url, expires_in = download_url_cache.get_url(storage_key)
+    return {
+        "download_url": download_url,
+        "document_id": document_id,
+        "filename": filename,
+        "expires_in": expires_in
+    }
+
+
+def _download_urls(targets: List[tuple]) -> List[dict]:
+    return [_download_url(*target) for target in targets]
+
+
+@app.post("/api/documents/download-urls", response_model=schemas.DownloadUrlBatchResponse)
+async def get_download_urls(
+    batch: schemas.DownloadUrlBatchRequest,
+    db: DatabaseSession = Depends(get_database_session)
+):
+    """
+    URLs firmadas de descarga para varios documentos en una sola petición
+    (una consulta a la BD; las URLs salen de la caché mientras sigan vigentes).
+    """
+    document_ids = list(dict.fromkeys(batch.ids))
+    if len(document_ids) > DOWNLOAD_URL_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Máximo {DOWNLOAD_URL_BATCH_MAX} documentos por petición"
+        )
+    
+    targets = await db.run(_download_targets, document_ids) if document_ids else []
+    found = {document_id for document_id, _, _ in targets}
+    return {
+        "urls": await run_in_threadpool(_download_urls, targets),
+        "missing": [document_id for document_id in document_ids if document_id not in found]
+    }
+
+
 @app.get("/api/documents/{document_id}/download-url")
-def get_download_url(
+async def get_download_url(
     document_id: int,
-    db: Session = Depends(get_db)
+    db: DatabaseSession = Depends(get_database_session)
 ):
     """
     Genera una URL firmada temporalmente para descargar el documento.
+    La URL se reutiliza desde la caché mientras le quede suficiente vigencia.
     """
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
-    
-    if not document:
+    targets = await db.run(_download_targets, [document_id])
+    if not targets:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Documento no encontrado"
         )
     
-    # Generar URL firmada (válida por 1 hora)
-    download_url = storage_service.generate_presigned_url(document.storage_key)
-    
-    return {
-        "download_url": download_url,
-        "document_id": document_id,
-        "filename": document.name
-    }
+    return await run_in_threadpool(_download_url, *targets[0])
 
 
 @app.get("/api/documents/categories/list")
-def list_categories(db: Session = Depends(get_db)):
+async def list_categories(
+    request: Request,
+    response: Response,
+    db: DatabaseSession = Depends(get_database_session)
+):
     """
     Retorna la lista de categorías únicas de documentos.
+    Sale de la caché de facetas (sin SELECT DISTINCT sobre documents).
     """
-    categories = db.query(models.Document.category).distinct().all()
+    facets = await db.run(facet_cache.get)
+    etag = http_cache.collection_etag("categories", facets["version"], request)
+    if http_cache.matches(request, etag):
+        return http_cache.not_modified(etag)
+    http_cache.set_cache_headers(response, etag)
     return {
-        "categories": [cat[0] for cat in categories if cat[0]]
+        "categories": [facet["name"] for facet in facets["categories"] if facet["name"]]
     }
 
 
+# ===== ENDPOINTS DE BÚSQUEDA SEMÁNTICA =====
+
+@app.post("/api/search/semantic", response_model=schemas.SemanticSearchResponse)
+async def semantic_search(search_request: schemas.SemanticSearchRequest):
+    """
+    Fragmentos de documentos más parecidos a cada consulta (ver semantic.py).
+    Varias consultas en una petición se resuelven juntas; `category` limita
+    la búsqueda a los documentos de esa categoría.
+    """
+    if len(search_request.queries) > semantic.SEMANTIC_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Máximo {semantic.SEMANTIC_BATCH_MAX} consultas por petición"
+        )
+    if search_request.top_k > semantic.SEMANTIC_TOP_K_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"top_k máximo: {semantic.SEMANTIC_TOP_K_MAX}"
+        )
+    
+    # El índice y el embedder usan CPU: fuera del event loop, con su propia sesión
+    return await run_in_threadpool(
+        semantic.search, search_request.queries, search_request.top_k, search_request.category
+    )
+
+
+# ===== ENDPOINTS DEL STORAGE LOCAL (STORAGE_PROVIDER=local) =====
+
+def _local_store() -> local_storage.LocalObjectStore:
+    if storage_service.provider != "local":
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not Found"
+        )
+    return storage_service.client
+
+
+def _check_local_signature(method: str, storage_key: str, expires: Optional[int], signature: Optional[str],
+                           upload_id: Optional[str] = None, part_number: Optional[int] = None) -> None:
+    if not local_storage.verify_signature(method, storage_key, expires, signature, upload_id, part_number):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="La URL no es válida o ya venció"
+        )
+
+
+@app.api_route("/api/storage/local/{storage_key:path}", methods=["GET", "HEAD"])
+async def download_local_object(
+    storage_key: str,
+    request: Request,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None
+):
+    """
+    Descarga un archivo del storage local con una URL firmada (la que retorna
+    `/api/documents/{id}/download-url`). Soporta `Range` (respuesta 206) para
+    retomar descargas y para visores que piden el PDF por partes.
+    """
+    store = _local_store()
+    _check_local_signature("GET", storage_key, expires, signature)
+    try:
+        return local_storage.file_response(request, store, storage_key)
+    except ClientError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Archivo no encontrado en el storage"
+        )
+
+
+@app.put("/api/storage/local/{storage_key:path}")
+async def upload_local_object(
+    storage_key: str,
+    request: Request,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    upload_id: Optional[str] = None,
+    part_number: Optional[int] = Query(None, ge=1, le=MAX_UPLOAD_PARTS)
+):
+    """
+    Recibe una subida directa al storage local (archivo completo o una parte
+    de una subida multipart) con la URL firmada que entregó
+    `/api/documents/uploads/initiate` o `/uploads/multipart/parts`.
+    """
+    store = _local_store()
+    if upload_id and part_number is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Falta part_number"
+        )
+    _check_local_signature("PUT", storage_key, expires, signature, upload_id, part_number)
+    try:
+        etag = await local_storage.receive_upload(request, store, storage_key, MAX_FILE_SIZE, upload_id, part_number)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="La subida no existe, ya se completó o fue cancelada"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Key inválida: {storage_key}"
+        )
+    return Response(status_code=status.HTTP_200_OK, headers={"ETag": etag})
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
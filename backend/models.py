@@ -1,5 +1,6 @@
-from sqlalchemy import Column, String, DateTime, Boolean, Integer, Text, Enum
-from sqlalchemy.sql import func
+from sqlalchemy import Column, String, DateTime, Boolean, Integer, BigInteger, Text, Enum, Index, ForeignKey, LargeBinary
+from sqlalchemy.sql import func, text
+from sqlalchemy.dialects import postgresql  # registra to_tsvector() y demás funciones de texto completo
 from database import Base
 import enum
 
@@ -24,6 +25,7 @@ class Student(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")  # Se incrementa para revocar tokens
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -42,6 +44,7 @@ class Admin(Base):
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     is_superuser = Column(Boolean, default=False)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")  # Se incrementa para revocar tokens
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -52,6 +55,20 @@ class Document(Base):
     Almacena metadata de documentos subidos al storage en la nube.
     """
     __tablename__ = "documents"
+    __table_args__ = (
+        # Orden del listado (created_at DESC, id DESC) para paginación por keyset
+        Index("ix_documents_created_at_id", "created_at", "id"),
+        # Filtros del listado + mismo orden: el filtro y el ORDER BY salen del índice
+        Index("ix_documents_category_created_at_id", "category", "created_at", "id"),
+        Index("ix_documents_status_created_at_id", "status", "created_at", "id"),
+        # Un objeto sin content_hash pertenece a un solo documento (no lo cuenta
+        # stored_objects): también hace idempotente el finalize de la subida directa
+        Index(
+            "ux_documents_storage_key_unshared", "storage_key", unique=True,
+            postgresql_where=text("content_hash IS NULL"),
+            sqlite_where=text("content_hash IS NULL"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)  # Nombre original del archivo
@@ -62,7 +79,9 @@ class Document(Base):
     
     # URLs y paths en el storage
     storage_url = Column(String, nullable=False)  # URL pública del documento
-    storage_key = Column(String, nullable=False, unique=True)  # Key/path único en el storage
+    # Key/path en el storage; documentos con el mismo contenido comparten el objeto (ver dedup.py)
+    storage_key = Column(String, nullable=False, index=True)
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 del archivo (hex)
     
     # Información del uploader
     uploaded_by = Column(Integer, nullable=True)  # ID del admin que subió
@@ -75,4 +94,145 @@ class Document(Base):
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    processed_at = Column(DateTime(timezone=True), nullable=True)  # Cuando se completó el procesamiento
\ No newline at end of file
+    processed_at = Column(DateTime(timezone=True), nullable=True)  # Cuando se completó el procesamiento
+    
+    # Cola de procesamiento (ver processing.py)
+    processing_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    processing_lease_until = Column(DateTime(timezone=True), nullable=True)  # Worker que lo procesa / reintento
+    processing_error = Column(String, nullable=True)  # Motivo del estado ERROR
+
+
+def document_search_vector(name, description, tags):
+    """
+    tsvector de búsqueda de un documento (PostgreSQL, stemming en español).
+    Pesos: nombre (A) > tags (B) > descripción (C). La consulta de búsqueda debe
+    usar exactamente esta expresión para que PostgreSQL use el índice GIN.
+    """
+    config = text("'spanish'")
+    empty = text("''")
+    return (
+        func.setweight(func.to_tsvector(config, func.coalesce(name, empty)), text("'A'"))
+        .op("||")(func.setweight(func.to_tsvector(config, func.coalesce(tags, empty)), text("'B'")))
+        .op("||")(func.setweight(func.to_tsvector(config, func.coalesce(description, empty)), text("'C'")))
+    )
+
+
+# Índices de búsqueda (solo PostgreSQL; en SQLite se usa FTS5, ver search.py)
+Index(
+    "ix_documents_search_vector",
+    document_search_vector(Document.name, Document.description, Document.tags),
+    postgresql_using="gin",
+).ddl_if(dialect="postgresql")
+
+# Trigramas sobre el nombre: ILIKE '%...%' y coincidencias aproximadas con índice
+Index(
+    "ix_documents_name_trgm",
+    Document.name,
+    postgresql_using="gin",
+    postgresql_ops={"name": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql")
+
+
+class DocumentCounter(Base):
+    """
+    Conteo de documentos y bytes por (categoría, estado).
+    Se mantiene de forma incremental (ver catalog.py) para que el listado y
+    las facetas no tengan que recorrer toda la tabla en cada petición.
+    """
+    __tablename__ = "document_counters"
+
+    category = Column(String, primary_key=True)  # "" para documentos sin categoría
+    status = Column(String, primary_key=True)  # Valor de DocumentStatus
+    document_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_bytes = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+class CatalogState(Base):
+    """
+    Valores globales del catálogo de documentos (clave -> entero), p. ej.
+    `documents_version`, que aumenta con cada cambio en los documentos y sirve
+    para invalidar cachés.
+    """
+    __tablename__ = "catalog_state"
+
+    name = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+class Tag(Base):
+    """
+    Tag normalizado (minúsculas, sin espacios repetidos).
+    `document_count` se mantiene de forma incremental (ver tagging.py).
+    """
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True, nullable=False)
+    document_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class DocumentTag(Base):
+    """
+    Relación muchos a muchos entre documentos y tags.
+    `Document.tags` conserva el texto original separado por comas; esta tabla
+    es el índice que permite filtrar por tag sin recorrer los documentos.
+    """
+    __tablename__ = "document_tags"
+    __table_args__ = (
+        # Búsqueda por tag: tag_id -> documentos
+        Index("ix_document_tags_tag_id_document_id", "tag_id", "document_id"),
+    )
+
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
+
+
+class StoredObject(Base):
+    """
+    Objeto del storage identificado por su contenido (SHA-256).
+    `ref_count` cuenta los documentos que lo usan; se mantiene de forma
+    incremental (ver dedup.py) y el objeto se elimina al llegar a cero.
+    """
+    __tablename__ = "stored_objects"
+
+    content_hash = Column(String(64), primary_key=True)
+    storage_key = Column(String, unique=True, nullable=False)
+    storage_url = Column(String, nullable=False)
+    file_size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class DocumentText(Base):
+    """
+    Texto extraído de un documento por los workers de procesamiento (ver
+    processing.py). Tabla aparte para que el listado de documentos no cargue
+    el texto completo.
+    """
+    __tablename__ = "document_texts"
+
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    content = Column(Text, nullable=False)
+    char_count = Column(Integer, nullable=False)
+    truncated = Column(Boolean, nullable=False, default=False)  # Se cortó en PROCESSING_MAX_TEXT_CHARS
+    extracted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class DocumentChunk(Base):
+    """
+    Fragmento del texto de un documento con su embedding, para la búsqueda
+    semántica (ver semantic.py). Al reprocesar un documento sus fragmentos
+    se reemplazan por completo.
+    """
+    __tablename__ = "document_chunks"
+    # El índice en memoria carga los fragmentos con id mayor al último cargado:
+    # en SQLite los ids no deben reutilizarse al eliminar los últimos
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False)  # Posición del fragmento en el documento
+    char_start = Column(Integer, nullable=False)  # Offset del fragmento en document_texts.content
+    content = Column(Text, nullable=False)
+    embedder = Column(String, nullable=False)  # Modelo que generó el embedding (p. ej. "hashing-256")
+    embedding = Column(LargeBinary, nullable=False)  # Vector float32 normalizado (little-endian)
@@ -0,0 +1,42 @@
+"""
+Cursores opacos para paginación por keyset.
+
+En lugar de `OFFSET n`, que obliga a la BD a recorrer y descartar n filas,
+el cliente envía el cursor de la última fila recibida y la consulta continúa
+con `WHERE (created_at, id) < (:created_at, :id)`, que usa el índice
+compuesto `ix_documents_created_at_id`. La página N cuesta lo mismo que la 1.
+
+El cursor es un JSON codificado en base64 url-safe; el cliente no debe
+interpretarlo, solo reenviarlo.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(created_at: datetime, document_id: int) -> str:
+    """Codifica la posición (created_at, id) de la última fila de una página"""
+    raw = json.dumps([created_at.isoformat(), document_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decodifica un cursor generado por `encode_cursor`.
+
+    Raises:
+        HTTPException: 400 si el cursor no es válido
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, document_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(created_at), int(document_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginación inválido"
+        )
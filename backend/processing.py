@@ -0,0 +1,556 @@
+"""
+Procesamiento de documentos en segundo plano (extracción de texto).
+
+Antes la subida marcaba el documento como READY en la misma petición sin
+procesar nada. Ahora la subida responde en cuanto el archivo está en el
+storage (estado PROCESSING) y un pool de procesos worker lo procesa:
+
+- La cola es la propia tabla `documents` (no hace falta un broker): cada
+  worker reclama el documento PROCESSING más antiguo con
+  `SELECT ... FOR UPDATE SKIP LOCKED` y le asigna un lease
+  (`processing_lease_until`). Varios workers, o varias instancias de la API,
+  reclaman documentos distintos sin esperarse entre sí
+- El worker descarga el archivo, extrae el texto (PDF con pypdf, DOCX y TXT;
+  los .doc quedan sin texto) y lo guarda en `document_texts` junto con sus
+  fragmentos para la búsqueda semántica (ver semantic.py); después marca el
+  documento READY (o ERROR con `processing_error`) y `processed_at`
+- Mientras procesa, el worker renueva el lease cada tercio de
+  PROCESSING_LEASE_SECONDS (un PDF grande puede tardar más que el lease). El
+  resultado solo se guarda si el lease sigue siendo suyo: si lo perdió y otro
+  worker reclamó el documento, se descarta
+- Si un worker muere, el lease vence y otro worker retoma el documento. Un
+  documento que falla se reintenta (con espera creciente) hasta
+  PROCESSING_MAX_ATTEMPTS veces
+- Un documento con el mismo contenido (`content_hash`) que otro ya procesado
+  copia su texto sin descargar el archivo
+
+El procesamiento es CPU intensivo (PDF): cada worker es un proceso aparte, así
+que el throughput escala con PROCESSING_WORKERS sin competir por el GIL con
+la API.
+
+Uso (PROCESSING_MODE=external):
+    python processing.py --workers 4
+
+Configuración (variables de entorno):
+- PROCESSING_MODE: "workers" (por defecto: la API inicia los procesos worker),
+  "external" (la API solo encola; los workers corren con `python processing.py`)
+  o "inline" (se procesa dentro de la petición de subida; para Vercel/serverless)
+- PROCESSING_WORKERS: procesos worker que inicia la API (por defecto 2)
+- PROCESSING_POLL_SECONDS: espera de un worker sin trabajo antes de volver
+  a consultar la cola (por defecto 5; la API despierta a sus workers al encolar)
+- PROCESSING_LEASE_SECONDS: tiempo que un worker tiene reservado un documento
+  sin renovarlo (por defecto 300)
+- PROCESSING_MAX_ATTEMPTS: intentos antes de marcar ERROR (por defecto 3)
+- PROCESSING_MAX_TEXT_CHARS: máximo de caracteres de texto guardados por
+  documento (por defecto 1000000)
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, List, Optional, Tuple
+from xml.etree import ElementTree
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import delete, event, func, or_, select, update
+from sqlalchemy.orm import Session
+
+import catalog
+import models
+import semantic
+from storage import storage_service
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+PROCESSING_MODE = os.getenv("PROCESSING_MODE", "workers")
+PROCESSING_WORKERS = max(0, int(os.getenv("PROCESSING_WORKERS", "2")))
+PROCESSING_POLL_SECONDS = float(os.getenv("PROCESSING_POLL_SECONDS", "5"))
+PROCESSING_LEASE_SECONDS = int(os.getenv("PROCESSING_LEASE_SECONDS", "300"))
+PROCESSING_MAX_ATTEMPTS = max(1, int(os.getenv("PROCESSING_MAX_ATTEMPTS", "3")))
+PROCESSING_MAX_TEXT_CHARS = int(os.getenv("PROCESSING_MAX_TEXT_CHARS", "1000000"))
+
+# Archivos hasta este tamaño se descargan en memoria; los mayores, a disco
+_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Espera antes de reintentar un documento que falló (se multiplica por el intento)
+_RETRY_DELAY_SECONDS = 60
+
+# Segundos que se espera a los workers al apagar antes de terminarlos
+_SHUTDOWN_TIMEOUT = 10
+
+_WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_documents = models.Document.__table__
+
+
+class ExtractionError(Exception):
+    """El archivo no se pudo leer (dañado, cifrado o formato no soportado)"""
+
+
+# ============================================================================
+# EXTRACCIÓN DE TEXTO
+# ============================================================================
+
+def _extract_pdf(fileobj: BinaryIO, max_chars: int) -> str:
+    try:
+        from pypdf import PdfReader
+        from pypdf.errors import PdfReadError
+    except ImportError:
+        raise ExtractionError("pypdf no está instalado (pip install -r requirements.txt)")
+
+    try:
+        reader = PdfReader(fileobj)
+        if reader.is_encrypted and not reader.decrypt(""):
+            raise ExtractionError("El PDF está protegido con contraseña")
+        pages, length = [], 0
+        for page in reader.pages:
+            page_text = page.extract_text() or ""
+            pages.append(page_text)
+            length += len(page_text) + 1
+            if length > max_chars:
+                break
+        return "\n".join(pages)
+    except PdfReadError as e:
+        raise ExtractionError(f"PDF inválido: {e}")
+
+
+def _extract_docx(fileobj: BinaryIO) -> str:
+    """Texto de word/document.xml (un párrafo por línea), sin dependencias externas"""
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            document_xml = archive.read("word/document.xml")
+        root = ElementTree.fromstring(document_xml)
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise ExtractionError(f"DOCX inválido: {e}")
+
+    paragraphs = []
+    for paragraph in root.iter(f"{_WORD_NAMESPACE}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{_WORD_NAMESPACE}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{_WORD_NAMESPACE}tab":
+                parts.append("\t")
+            elif node.tag in (f"{_WORD_NAMESPACE}br", f"{_WORD_NAMESPACE}cr"):
+                parts.append("\n")
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+
+def _extract_txt(fileobj: BinaryIO, max_chars: int) -> str:
+    # Como mucho 4 bytes por carácter en UTF-8
+    data = fileobj.read(max_chars * 4 + 4)
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1252", errors="replace")
+
+
+def extract_text(fileobj: BinaryIO, file_type: str,
+                 max_chars: int = PROCESSING_MAX_TEXT_CHARS) -> Tuple[Optional[str], bool]:
+    """
+    Texto de un archivo según su tipo (PDF, DOCX, TXT).
+
+    Returns:
+        Tuple[Optional[str], bool]: (texto o None si el tipo no se procesa, si se cortó en max_chars)
+
+    Raises:
+        ExtractionError: el archivo no se pudo leer
+    """
+    file_type = file_type.upper()
+    if file_type == "PDF":
+        content = _extract_pdf(fileobj, max_chars)
+    elif file_type == "DOCX":
+        content = _extract_docx(fileobj)
+    elif file_type == "TXT":
+        content = _extract_txt(fileobj, max_chars)
+    else:
+        # .doc (formato binario de Word 97-2003): se conserva sin texto
+        return None, False
+
+    # PostgreSQL no admite el carácter NUL en columnas de texto
+    content = content.replace("\x00", "").strip()
+    return content[:max_chars], len(content) > max_chars
+
+
+# ============================================================================
+# COLA (tabla documents)
+# ============================================================================
+
+def _claimable(now: datetime):
+    return (
+        _documents.c.status == models.DocumentStatus.PROCESSING,
+        or_(_documents.c.processing_lease_until.is_(None), _documents.c.processing_lease_until < now),
+    )
+
+
+def claim_document(engine, document_id: Optional[int] = None):
+    """
+    Reclama el documento pendiente más antiguo (o `document_id`) y le asigna
+    un lease. Retorna la fila (id, name, storage_key, file_type, content_hash,
+    processing_attempts, processing_lease_until) o None si no hay trabajo.
+    """
+    now = datetime.now(timezone.utc)
+    conditions = _claimable(now)
+    candidate = select(_documents.c.id).where(*conditions)
+    if document_id is not None:
+        candidate = candidate.where(_documents.c.id == document_id)
+    candidate = (
+        candidate.order_by(_documents.c.created_at, _documents.c.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+
+    with engine.begin() as connection:
+        row = connection.execute(candidate).first()
+        if row is None:
+            return None
+        # Se repite la condición: en SQLite FOR UPDATE no existe y otro worker pudo ganar la fila
+        return connection.execute(
+            update(_documents)
+            .where(_documents.c.id == row.id, *conditions)
+            .values(
+                processing_lease_until=now + timedelta(seconds=PROCESSING_LEASE_SECONDS),
+                processing_attempts=_documents.c.processing_attempts + 1,
+                # Reclamar no es un cambio del documento (no invalida su ETag)
+                updated_at=_documents.c.updated_at,
+            )
+            .returning(
+                _documents.c.id, _documents.c.name, _documents.c.storage_key, _documents.c.file_type,
+                _documents.c.content_hash, _documents.c.processing_attempts,
+                _documents.c.processing_lease_until,
+            )
+        ).first()
+
+
+class _Lease:
+    """
+    Lease de un documento reclamado. El valor de `processing_lease_until` que
+    escribió este worker identifica al dueño: si otro worker reclama el
+    documento (o un administrador lo cambia), el valor ya no coincide.
+    Usado como context manager, un hilo lo renueva mientras se procesa.
+    """
+
+    def __init__(self, engine, document_id: int, until: datetime):
+        self.engine = engine
+        self.document_id = document_id
+        self.until = until
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def owned(self):
+        """Condiciones WHERE: el documento sigue pendiente y con este lease"""
+        return (
+            _documents.c.id == self.document_id,
+            _documents.c.status == models.DocumentStatus.PROCESSING,
+            _documents.c.processing_lease_until == self.until,
+        )
+
+    def renew(self) -> bool:
+        """Extiende el lease; False si ya no es de este worker"""
+        until = datetime.now(timezone.utc) + timedelta(seconds=PROCESSING_LEASE_SECONDS)
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                update(_documents)
+                .where(*self.owned())
+                .values(processing_lease_until=until, updated_at=_documents.c.updated_at)
+            )
+        if not result.rowcount:
+            return False
+        self.until = until
+        return True
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(PROCESSING_LEASE_SECONDS / 3):
+            try:
+                if not self.renew():
+                    return
+            except Exception as e:
+                # Error transitorio de la BD: se reintenta en el próximo latido
+                print(f"Error al renovar el lease del documento {self.document_id}: {e}")
+
+    def __enter__(self) -> "_Lease":
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def _existing_text(db: Session, document) -> Optional[models.DocumentText]:
+    """Texto ya extraído de otro documento con el mismo contenido"""
+    if not document.content_hash:
+        return None
+    return db.execute(
+        select(models.DocumentText)
+        .join(models.Document, models.Document.id == models.DocumentText.document_id)
+        .where(models.Document.content_hash == document.content_hash, models.Document.id != document.id)
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def _read_text(engine, document) -> Tuple[Optional[str], bool]:
+    with Session(engine) as db:
+        existing = _existing_text(db, document)
+        if existing is not None:
+            return existing.content, existing.truncated
+
+    with tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE) as fileobj:
+        storage_service.download_file(document.storage_key, fileobj)
+        return extract_text(fileobj, document.file_type)
+
+
+def _complete(engine, lease: _Lease, content: Optional[str], truncated: bool, chunks: List[dict]) -> None:
+    document_id = lease.document_id
+    with Session(engine) as db:
+        document = db.execute(select(models.Document).where(*lease.owned())).scalar_one_or_none()
+        if document is None:
+            # Se eliminó, lo cambió un administrador o el lease venció y otro worker lo reclamó
+            return
+        if content is not None:
+            db.merge(models.DocumentText(
+                document_id=document_id,
+                content=content,
+                char_count=len(content),
+                truncated=truncated,
+            ))
+        semantic.replace_chunks(db, document_id, chunks)
+        document.status = models.DocumentStatus.READY
+        document.processed_at = datetime.now(timezone.utc)
+        document.processing_lease_until = None
+        document.processing_error = None
+        db.commit()
+
+
+def _fail(engine, lease: _Lease, attempts: int, error: str) -> None:
+    now = datetime.now(timezone.utc)
+    if attempts < PROCESSING_MAX_ATTEMPTS:
+        # Reintento: el lease pasa a ser la hora a partir de la cual se puede reclamar otra vez
+        with engine.begin() as connection:
+            result = connection.execute(
+                update(_documents)
+                .where(*lease.owned())
+                .values(
+                    processing_lease_until=now + timedelta(seconds=_RETRY_DELAY_SECONDS * attempts),
+                    processing_error=error,
+                    updated_at=_documents.c.updated_at,
+                )
+            )
+            # processing_error se muestra en la respuesta del documento: invalidar los ETags
+            if result.rowcount:
+                catalog.bump_documents_version(connection)
+        return
+
+    with Session(engine) as db:
+        row = db.execute(select(models.Document).where(*lease.owned())).scalar_one_or_none()
+        if row is None:
+            return
+        row.status = models.DocumentStatus.ERROR
+        row.processed_at = now
+        row.processing_lease_until = None
+        row.processing_error = error
+        db.commit()
+
+
+def process_claimed(engine, document) -> bool:
+    """Procesa un documento ya reclamado; True si quedó READY"""
+    lease = _Lease(engine, document.id, document.processing_lease_until)
+    try:
+        with lease:
+            content, truncated = _read_text(engine, document)
+            # Embeddings fuera de la transacción (es lo más costoso después de la extracción)
+            chunks = semantic.embed_chunks(content) if content else []
+    except ExtractionError as e:
+        # El archivo no cambia: reintentar no sirve
+        _fail(engine, lease, PROCESSING_MAX_ATTEMPTS, str(e)[:500])
+        return False
+    except HTTPException as e:
+        _fail(engine, lease, document.processing_attempts, str(e.detail)[:500])
+        return False
+    except Exception as e:
+        _fail(engine, lease, document.processing_attempts, f"{type(e).__name__}: {e}"[:500])
+        return False
+    _complete(engine, lease, content, truncated, chunks)
+    return True
+
+
+def process_document(document_id: int, engine=None) -> bool:
+    """Procesa un documento concreto si está pendiente (PROCESSING_MODE=inline)"""
+    if engine is None:
+        from database import engine
+    document = claim_document(engine, document_id)
+    return document is not None and process_claimed(engine, document)
+
+
+def queue_length(db: Session) -> int:
+    """Documentos pendientes de procesar (incluye los que se están procesando)"""
+    return db.query(func.count(models.Document.id)).filter(
+        models.Document.status == models.DocumentStatus.PROCESSING
+    ).scalar()
+
+
+@event.listens_for(Session, "before_flush")
+def _delete_document_texts(session: Session, flush_context, instances) -> None:
+    """Elimina el texto de los documentos eliminados (SQLite no aplica ON DELETE CASCADE)"""
+    document_ids = [obj.id for obj in session.deleted if isinstance(obj, models.Document)]
+    if document_ids:
+        session.connection().execute(
+            delete(models.DocumentText).where(models.DocumentText.document_id.in_(document_ids))
+        )
+
+
+# ============================================================================
+# WORKERS
+# ============================================================================
+
+def run_worker(stop_event, wakeup, processed=None, failed=None, engine=None) -> None:
+    """Bucle de un worker: reclama y procesa documentos hasta que se pida detenerse"""
+    if engine is None:
+        from database import engine
+
+    while not stop_event.is_set():
+        try:
+            document = claim_document(engine)
+        except Exception as e:
+            print(f"Error al consultar la cola de procesamiento: {e}")
+            document = None
+        if document is None:
+            wakeup.wait(PROCESSING_POLL_SECONDS)
+            wakeup.clear()
+            continue
+
+        try:
+            ok = process_claimed(engine, document)
+        except Exception as e:
+            # No se pudo guardar el resultado: el lease vence y el documento se reintenta
+            print(f"Error al procesar el documento {document.id}: {e}")
+            ok = False
+        counter = processed if ok else failed
+        if counter is not None:
+            with counter.get_lock():
+                counter.value += 1
+
+
+def _worker_main(stop_event, wakeup, processed, failed) -> None:
+    # Ctrl+C llega a todo el grupo de procesos: el proceso padre coordina la salida
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_worker(stop_event, wakeup, processed, failed)
+
+
+class WorkerPool:
+    """
+    Procesos worker de la cola de documentos. Usa `spawn`: cada worker abre
+    sus propias conexiones (no hereda las del proceso de la API).
+    """
+
+    def __init__(self, workers: int = PROCESSING_WORKERS):
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._wakeup = self._context.Event()
+        self._processed = self._context.Value("q", 0)
+        self._failed = self._context.Value("q", 0)
+        self._processes: List = []
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            process = self._context.Process(
+                target=_worker_main,
+                args=(self._stop_event, self._wakeup, self._processed, self._failed),
+                name=f"document-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+    def notify(self) -> None:
+        """Despierta a los workers (hay documentos nuevos en la cola)"""
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for process in self._processes if process.is_alive()),
+            "processed": self._processed.value,
+            "failed": self._failed.value,
+        }
+
+    def stop(self, timeout: float = _SHUTDOWN_TIMEOUT) -> None:
+        """Pide a los workers que terminen el documento en curso y salgan"""
+        self._stop_event.set()
+        self._wakeup.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes.clear()
+
+
+# Pool de la API (se inicia en el lifespan si PROCESSING_MODE=workers)
+worker_pool: Optional[WorkerPool] = None
+
+
+def start_workers() -> None:
+    global worker_pool
+    if PROCESSING_MODE == "workers" and PROCESSING_WORKERS > 0 and worker_pool is None:
+        worker_pool = WorkerPool(PROCESSING_WORKERS)
+        worker_pool.start()
+
+
+def stop_workers() -> None:
+    global worker_pool
+    if worker_pool is not None:
+        worker_pool.stop()
+        worker_pool = None
+
+
+def notify_workers() -> None:
+    if worker_pool is not None:
+        worker_pool.notify()
+
+
+def stats() -> dict:
+    data = {"mode": PROCESSING_MODE}
+    if worker_pool is not None:
+        data.update(worker_pool.stats())
+    return data
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Workers de procesamiento de documentos")
+    parser.add_argument("--workers", type=int, default=max(1, PROCESSING_WORKERS))
+    args = parser.parse_args(argv)
+
+    pool = WorkerPool(max(1, args.workers))
+    pool.start()
+    print(f"Procesando documentos con {pool.workers} workers (Ctrl+C para detener)...")
+
+    def request_stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, request_stop)
+    try:
+        while any(process.is_alive() for process in pool._processes):
+            pool._processes[0].join(PROCESSING_POLL_SECONDS)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+
+    stats_data = pool.stats()
+    print(f"Workers detenidos: {stats_data['processed']} documentos procesados, {stats_data['failed']} con error")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
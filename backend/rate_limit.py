@@ -0,0 +1,247 @@
+"""
+Rate limiting en memoria para los endpoints de login.
+
+Cada intento de login ejecuta una verificación bcrypt completa (~250 ms de CPU),
+incluso para usuarios inexistentes. Un solo cliente insistente puede ocupar
+todos los núcleos. Este módulo rechaza con 429 *antes* de consultar la BD o
+hashear, usando token buckets por IP y por cuenta (student_id / username).
+
+Cada intento reserva un token antes de verificar; si la contraseña es
+correcta el token se devuelve (`succeeded`), así que solo los intentos
+fallidos consumen el límite. Un curso completo que inicia sesión detrás de la
+misma IP (NAT del campus) no recibe 429 por los logins correctos.
+
+El almacén de buckets:
+- Está particionado en shards, cada uno con su propio lock (poca contención)
+- Tiene un tamaño máximo: al llenarse desaloja los buckets menos usados
+- Elimina buckets inactivos (ya rellenados por completo), que no aportan información
+
+Configuración (variables de entorno):
+- RATE_LIMIT_ENABLED: "true"/"false"
+- RATE_LIMIT_IP_BURST / RATE_LIMIT_IP_PER_MINUTE: intentos por IP
+- RATE_LIMIT_ACCOUNT_BURST / RATE_LIMIT_ACCOUNT_PER_MINUTE: intentos por cuenta
+- RATE_LIMIT_MAX_KEYS: máximo de buckets en memoria (por almacén)
+- RATE_LIMIT_TRUST_PROXY: tomar la IP de los headers del proxy (Vercel)
+- RATE_LIMIT_PROXY_HOPS: proxies confiables que agregan su entrada a
+  X-Forwarded-For (por defecto 1)
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, status
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+# Por IP: ráfaga de 60 intentos, recarga de 30 por minuto. La ráfaga cubre los
+# logins simultáneos de un aula detrás de una misma IP (cada uno reserva un
+# token hasta terminar la verificación)
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "60"))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "30"))
+
+# Por cuenta: ráfaga de 5 intentos, recarga de 5 por minuto
+RATE_LIMIT_ACCOUNT_BURST = int(os.getenv("RATE_LIMIT_ACCOUNT_BURST", "5"))
+RATE_LIMIT_ACCOUNT_PER_MINUTE = float(os.getenv("RATE_LIMIT_ACCOUNT_PER_MINUTE", "5"))
+
+# Máximo de buckets en memoria por almacén y número de shards
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+
+# Confiar en los headers del proxy (solo detrás de un proxy confiable, p. ej. Vercel)
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+
+# Proxies confiables delante de la API: la IP del cliente es la entrada que
+# agregó el más externo, contando desde la derecha de X-Forwarded-For (las de
+# la izquierda las puede escribir el propio cliente)
+RATE_LIMIT_PROXY_HOPS = max(1, int(os.getenv("RATE_LIMIT_PROXY_HOPS", "1")))
+
+# Headers que la plataforma fija con la IP del cliente (reemplazan al del cliente)
+_PLATFORM_IP_HEADERS = ("x-vercel-forwarded-for", "x-real-ip")
+
+# Costo estimado de una verificación bcrypt, para reportar el CPU ahorrado
+RATE_LIMIT_HASH_COST_MS = float(os.getenv("RATE_LIMIT_HASH_COST_MS", "250"))
+
+
+class TokenBucketStore:
+    """
+    Almacén de token buckets acotado en memoria.
+
+    Cada clave tiene un bucket con capacidad `capacity` que se recarga a
+    `refill_per_second`. Las claves se reparten en shards por hash; cada shard
+    es un OrderedDict en orden LRU protegido por su propio lock.
+    """
+
+    def __init__(self, capacity: int, refill_per_second: float,
+                 max_keys: int = RATE_LIMIT_MAX_KEYS, shards: int = RATE_LIMIT_SHARDS):
+        self.capacity = max(1, capacity)
+        self.refill_per_second = max(refill_per_second, 1e-9)
+        self.shard_count = max(1, shards)
+        self.max_keys_per_shard = max(1, max_keys // self.shard_count)
+        # Tiempo tras el cual un bucket inactivo está lleno de nuevo
+        self.idle_seconds = self.capacity / self.refill_per_second
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(self.shard_count)]
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.refunded = 0
+
+    def consume(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """
+        Intenta consumir `cost` tokens del bucket de `key`.
+
+        Returns:
+            Tuple[bool, float]: (permitido, segundos hasta que haya tokens suficientes)
+        """
+        now = time.monotonic()
+        lock, buckets = self._shards[hash(key) % self.shard_count]
+        with lock:
+            self._evict_idle(buckets, now)
+
+            bucket = buckets.get(key)
+            if bucket is None:
+                tokens = float(self.capacity)
+            else:
+                tokens, updated_at = bucket
+                tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+
+            if tokens >= cost:
+                buckets[key] = (tokens - cost, now)
+                buckets.move_to_end(key)
+                self._evict_overflow(buckets)
+                self.allowed += 1
+                return True, 0.0
+
+            buckets[key] = (tokens, now)
+            buckets.move_to_end(key)
+            self._evict_overflow(buckets)
+            self.rejected += 1
+            return False, (cost - tokens) / self.refill_per_second
+
+    def refund(self, key: str, cost: float = 1.0) -> None:
+        """Devuelve tokens consumidos (sin superar la capacidad)"""
+        lock, buckets = self._shards[hash(key) % self.shard_count]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is not None:
+                tokens, updated_at = bucket
+                buckets[key] = (min(self.capacity, tokens + cost), updated_at)
+                self.refunded += 1
+
+    def _evict_idle(self, buckets: OrderedDict, now: float) -> None:
+        """Elimina desde el extremo LRU los buckets que ya se rellenaron por completo"""
+        while buckets:
+            key, (_, updated_at) = next(iter(buckets.items()))
+            if now - updated_at < self.idle_seconds:
+                break
+            del buckets[key]
+            self.evicted += 1
+
+    def _evict_overflow(self, buckets: OrderedDict) -> None:
+        """Respeta el máximo de claves desalojando las menos usadas"""
+        while len(buckets) > self.max_keys_per_shard:
+            buckets.popitem(last=False)
+            self.evicted += 1
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for _, buckets in self._shards)
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "refunded": self.refunded,
+            "capacity": self.capacity,
+            "refill_per_minute": round(self.refill_per_second * 60, 3),
+        }
+
+
+class LoginRateLimiter:
+    """Limita los intentos de login por IP y por cuenta"""
+
+    def __init__(self):
+        self.enabled = RATE_LIMIT_ENABLED
+        self.by_ip = TokenBucketStore(RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_MINUTE / 60)
+        self.by_account = TokenBucketStore(RATE_LIMIT_ACCOUNT_BURST, RATE_LIMIT_ACCOUNT_PER_MINUTE / 60)
+
+    def check(self, request: Request, account: Optional[str] = None) -> None:
+        """
+        Consume un intento para la IP del cliente y para la cuenta.
+        Debe llamarse antes de cualquier consulta a la BD o verificación bcrypt.
+
+        Raises:
+            HTTPException: 429 con header Retry-After si se excedió el límite
+        """
+        if not self.enabled:
+            return
+
+        ip_key = f"ip:{client_ip(request)}"
+        allowed, retry_after = self.by_ip.consume(ip_key)
+        if allowed and account:
+            allowed, retry_after = self.by_account.consume(f"account:{account}")
+            if not allowed:
+                # Una cuenta bloqueada no debe agotar el límite de toda la IP (NAT del campus)
+                self.by_ip.refund(ip_key)
+
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Demasiados intentos de inicio de sesión. Intenta de nuevo más tarde.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+    def succeeded(self, request: Request, account: Optional[str] = None) -> None:
+        """
+        Devuelve el intento reservado por `check` cuando la contraseña es
+        correcta: solo los intentos fallidos cuentan contra el límite.
+        """
+        if not self.enabled:
+            return
+        self.by_ip.refund(f"ip:{client_ip(request)}")
+        if account:
+            self.by_account.refund(f"account:{account}")
+
+    def stats(self) -> dict:
+        """Contadores del limitador, incluido el CPU de bcrypt estimado que se evitó"""
+        rejected = self.by_ip.rejected + self.by_account.rejected
+        return {
+            "enabled": self.enabled,
+            "by_ip": self.by_ip.stats(),
+            "by_account": self.by_account.stats(),
+            "rejected_total": rejected,
+            "estimated_cpu_seconds_saved": round(rejected * RATE_LIMIT_HASH_COST_MS / 1000, 3),
+        }
+
+
+def client_ip(request: Request) -> str:
+    """
+    IP del cliente. Con RATE_LIMIT_TRUST_PROXY usa el header de la plataforma
+    o, si no está, la entrada de X-Forwarded-For que agregó el proxy confiable
+    más externo (RATE_LIMIT_PROXY_HOPS desde la derecha).
+    """
+    if RATE_LIMIT_TRUST_PROXY:
+        for header in _PLATFORM_IP_HEADERS:
+            value = request.headers.get(header)
+            if value:
+                return value.split(",")[0].strip()
+        forwarded = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",") if entry.strip()]
+        if forwarded:
+            return forwarded[-min(RATE_LIMIT_PROXY_HOPS, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+
+# Instancia global del limitador de login
+login_rate_limiter = LoginRateLimiter()
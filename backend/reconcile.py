@@ -0,0 +1,353 @@
+"""
+Reconciliación entre el storage y la tabla de documentos.
+
+Con el tiempo el bucket y la BD se desincronizan:
+- Objetos huérfanos: se subió el archivo pero falló el commit del documento,
+  o falló el borrado del archivo después de eliminar la fila. Ocupan espacio
+  (y se pagan) sin que ningún documento los use
+- Documentos colgados: la fila existe pero su archivo ya no está en el storage
+
+La reconciliación recorre el storage con `list_objects_v2` página a página
+(RECONCILE_BATCH_SIZE objetos en memoria) y busca las keys de cada página en
+`documents.storage_key` / `stored_objects.storage_key` con una consulta
+`IN (...)` por página. Después recorre los documentos por lotes (keyset por
+id) y verifica sus archivos con HEAD en paralelo. La memoria no depende del
+tamaño del bucket, así que sirve para millones de keys.
+
+Los objetos más recientes que RECONCILE_GRACE_HOURS no se tocan: pueden ser
+subidas en curso cuyo documento todavía no se guardó (p. ej. subidas directas
+pendientes de `finalize`).
+
+Por defecto solo reporta. Con `--delete-orphans` borra los objetos huérfanos
+y con `--delete-dangling` elimina los documentos colgados. En PostgreSQL un
+advisory lock evita que dos procesos reconcilien a la vez.
+
+Uso:
+    python reconcile.py
+    python reconcile.py --list
+    python reconcile.py --delete-orphans --delete-dangling
+
+También corre como tarea periódica dentro de la API si RECONCILE_INTERVAL_HOURS > 0.
+
+Configuración (variables de entorno):
+- RECONCILE_PREFIX: prefijo de los documentos en el storage (por defecto documents/)
+- RECONCILE_BATCH_SIZE: objetos por página y documentos por lote (por defecto 1000)
+- RECONCILE_GRACE_HOURS: antigüedad mínima de un objeto para considerarlo
+  huérfano (por defecto 24)
+- RECONCILE_CONCURRENCY: verificaciones HEAD en paralelo (por defecto 16)
+- RECONCILE_INTERVAL_HOURS: cada cuántas horas corre la tarea dentro de la
+  API (por defecto 0: desactivada)
+- RECONCILE_AUTO_DELETE: "true" para que la tarea periódica borre huérfanos
+  y documentos colgados (por defecto solo reporta)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Set
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+import dedup
+import models
+import processing  # Listener que elimina el texto extraído de los documentos eliminados
+from download_urls import download_url_cache
+from storage import storage_service
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+RECONCILE_PREFIX = os.getenv("RECONCILE_PREFIX", "documents/")
+RECONCILE_BATCH_SIZE = max(1, int(os.getenv("RECONCILE_BATCH_SIZE", "1000")))
+RECONCILE_GRACE_HOURS = float(os.getenv("RECONCILE_GRACE_HOURS", "24"))
+RECONCILE_CONCURRENCY = max(1, int(os.getenv("RECONCILE_CONCURRENCY", "16")))
+RECONCILE_INTERVAL_HOURS = float(os.getenv("RECONCILE_INTERVAL_HOURS", "0"))
+RECONCILE_AUTO_DELETE = os.getenv("RECONCILE_AUTO_DELETE", "false").lower() == "true"
+
+# Máximo de keys / IDs de ejemplo que se incluyen en el reporte
+MAX_REPORTED_ITEMS = 100
+
+# Clave del advisory lock de PostgreSQL (una sola reconciliación a la vez)
+_ADVISORY_LOCK_KEY = 0x626F6C01
+
+# Último reporte de la tarea periódica (ver /health/storage)
+last_report: Optional[dict] = None
+
+
+class ReconcileLocked(Exception):
+    """Otro proceso está reconciliando"""
+
+
+@dataclass
+class ReconcileReport:
+    """Resultado de una reconciliación"""
+    deleting_orphans: bool = False
+    deleting_dangling: bool = False
+    objects_scanned: int = 0
+    skipped_recent: int = 0
+    orphans: int = 0
+    orphan_bytes: int = 0
+    orphans_deleted: int = 0
+    documents_scanned: int = 0
+    dangling: int = 0
+    dangling_deleted: int = 0
+    unverified: int = 0
+    elapsed_seconds: float = 0.0
+    orphan_keys: List[str] = field(default_factory=list)
+    dangling_ids: List[int] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+    def add_error(self, message: str) -> None:
+        if len(self.errors) < MAX_REPORTED_ITEMS:
+            self.errors.append(message)
+
+    def to_dict(self) -> dict:
+        return {
+            "deleting_orphans": self.deleting_orphans,
+            "deleting_dangling": self.deleting_dangling,
+            "objects_scanned": self.objects_scanned,
+            "skipped_recent": self.skipped_recent,
+            "orphans": self.orphans,
+            "orphan_bytes": self.orphan_bytes,
+            "orphans_deleted": self.orphans_deleted,
+            "documents_scanned": self.documents_scanned,
+            "dangling": self.dangling,
+            "dangling_deleted": self.dangling_deleted,
+            "unverified": self.unverified,
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "orphan_keys": self.orphan_keys,
+            "dangling_ids": self.dangling_ids,
+            "errors": self.errors,
+        }
+
+
+def _referenced_keys(engine, storage_keys: List[str]) -> Set[str]:
+    """Keys de la página que usa algún documento (o un objeto deduplicado)"""
+    with engine.connect() as connection:
+        referenced = set(connection.execute(
+            select(models.Document.storage_key).where(models.Document.storage_key.in_(storage_keys))
+        ).scalars())
+        referenced.update(connection.execute(
+            select(models.StoredObject.storage_key).where(models.StoredObject.storage_key.in_(storage_keys))
+        ).scalars())
+    return referenced
+
+
+def find_orphans(engine, report: ReconcileReport, delete: bool = False, prefix: str = RECONCILE_PREFIX,
+                 batch_size: int = RECONCILE_BATCH_SIZE, grace_hours: float = RECONCILE_GRACE_HOURS,
+                 on_orphan: Optional[Callable[[dict], None]] = None) -> None:
+    """Recorre el storage y reporta (o borra) los objetos que no usa ningún documento"""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+
+    for page in storage_service.iter_object_pages(prefix, batch_size):
+        report.objects_scanned += len(page)
+        candidates = [item for item in page if item["LastModified"] < cutoff]
+        report.skipped_recent += len(page) - len(candidates)
+        if not candidates:
+            continue
+
+        referenced = _referenced_keys(engine, [item["Key"] for item in candidates])
+        orphans = [item for item in candidates if item["Key"] not in referenced]
+        for item in orphans:
+            report.orphans += 1
+            report.orphan_bytes += item["Size"]
+            if len(report.orphan_keys) < MAX_REPORTED_ITEMS:
+                report.orphan_keys.append(item["Key"])
+            if on_orphan:
+                on_orphan(item)
+
+        if delete and orphans:
+            storage_keys = [item["Key"] for item in orphans]
+            download_url_cache.evict(storage_keys)
+            for storage_key, error in storage_service.delete_files(storage_keys).items():
+                if error:
+                    report.add_error(f"{storage_key}: {error}")
+                else:
+                    report.orphans_deleted += 1
+
+
+def _delete_documents(engine, document_ids: List[int]) -> List[str]:
+    """Elimina los documentos colgados; retorna las keys que quedaron sin referencias"""
+    with Session(engine) as db:
+        for document in db.query(models.Document).filter(models.Document.id.in_(document_ids)):
+            db.delete(document)
+        db.commit()
+        return dedup.pop_released_keys(db)
+
+
+def find_dangling(engine, report: ReconcileReport, delete: bool = False, prefix: str = RECONCILE_PREFIX,
+                  batch_size: int = RECONCILE_BATCH_SIZE, concurrency: int = RECONCILE_CONCURRENCY,
+                  on_dangling: Optional[Callable[[int, str], None]] = None) -> None:
+    """Recorre los documentos por lotes y reporta (o elimina) los que no tienen archivo en el storage"""
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reconcile") as executor:
+        while True:
+            with engine.connect() as connection:
+                rows = connection.execute(
+                    select(models.Document.id, models.Document.storage_key)
+                    .where(models.Document.id > last_id, models.Document.storage_key.startswith(prefix))
+                    .order_by(models.Document.id)
+                    .limit(batch_size)
+                ).all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            report.documents_scanned += len(rows)
+
+            storage_keys = list(dict.fromkeys(row.storage_key for row in rows))
+            exists = dict(zip(storage_keys, executor.map(storage_service.object_exists, storage_keys)))
+
+            dangling_ids = []
+            for row in rows:
+                if exists[row.storage_key] is None:
+                    report.unverified += 1
+                    report.add_error(f"No se pudo verificar {row.storage_key} (documento {row.id})")
+                elif not exists[row.storage_key]:
+                    report.dangling += 1
+                    dangling_ids.append(row.id)
+                    if len(report.dangling_ids) < MAX_REPORTED_ITEMS:
+                        report.dangling_ids.append(row.id)
+                    if on_dangling:
+                        on_dangling(row.id, row.storage_key)
+
+            if delete and dangling_ids:
+                released = _delete_documents(engine, dangling_ids)
+                report.dangling_deleted += len(dangling_ids)
+                if released:
+                    # Normalmente ya no existen; quedan por si otro documento los subió de nuevo
+                    download_url_cache.evict(released)
+                    storage_service.delete_files(released)
+
+
+def reconcile(engine=None, delete_orphans: bool = False, delete_dangling: bool = False,
+              check_orphans: bool = True, check_dangling: bool = True,
+              prefix: str = RECONCILE_PREFIX, batch_size: int = RECONCILE_BATCH_SIZE,
+              grace_hours: float = RECONCILE_GRACE_HOURS,
+              on_orphan: Optional[Callable[[dict], None]] = None,
+              on_dangling: Optional[Callable[[int, str], None]] = None) -> ReconcileReport:
+    """
+    Reconcilia el storage con la BD.
+
+    Raises:
+        ReconcileLocked: otro proceso está reconciliando (solo PostgreSQL)
+    """
+    if engine is None:
+        from database import engine
+
+    report = ReconcileReport(deleting_orphans=delete_orphans, deleting_dangling=delete_dangling)
+    started = time.perf_counter()
+
+    with engine.connect() as lock_connection:
+        is_postgres = engine.dialect.name == "postgresql"
+        if is_postgres:
+            locked = lock_connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY}
+            ).scalar()
+            lock_connection.commit()
+            if not locked:
+                raise ReconcileLocked("Otra reconciliación está en curso")
+        try:
+            if check_orphans:
+                find_orphans(engine, report, delete_orphans, prefix, batch_size, grace_hours, on_orphan)
+            if check_dangling:
+                find_dangling(engine, report, delete_dangling, prefix, batch_size, on_dangling=on_dangling)
+        finally:
+            if is_postgres:
+                lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+                lock_connection.commit()
+
+    report.elapsed_seconds = time.perf_counter() - started
+    return report
+
+
+def _run_scheduled() -> None:
+    global last_report
+    try:
+        report = reconcile(delete_orphans=RECONCILE_AUTO_DELETE, delete_dangling=RECONCILE_AUTO_DELETE)
+    except ReconcileLocked:
+        return
+    except Exception as e:
+        print(f"Error en la reconciliación del storage: {e}")
+        return
+    last_report = {**report.to_dict(), "finished_at": datetime.now(timezone.utc).isoformat()}
+    print(f"Reconciliación del storage: {report.orphans} objetos huérfanos "
+          f"({report.orphans_deleted} borrados), {report.dangling} documentos sin archivo "
+          f"({report.dangling_deleted} eliminados) en {report.elapsed_seconds:.1f} s")
+
+
+async def _reconcile_periodically(interval_seconds: float) -> None:
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await run_in_threadpool(_run_scheduled)
+
+
+def start_background_task() -> Optional[asyncio.Task]:
+    """Inicia la reconciliación periódica (se llama al arrancar la API); None si está desactivada"""
+    if RECONCILE_INTERVAL_HOURS <= 0:
+        return None
+    return asyncio.create_task(_reconcile_periodically(RECONCILE_INTERVAL_HOURS * 3600))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Reconciliación entre el storage y la tabla de documentos")
+    parser.add_argument("--delete-orphans", action="store_true", help="Borra los objetos que no usa ningún documento")
+    parser.add_argument("--delete-dangling", action="store_true", help="Elimina los documentos sin archivo")
+    parser.add_argument("--skip-orphans", action="store_true", help="No recorre el storage")
+    parser.add_argument("--skip-dangling", action="store_true", help="No verifica los archivos de los documentos")
+    parser.add_argument("--prefix", default=RECONCILE_PREFIX)
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("--grace-hours", type=float, default=RECONCILE_GRACE_HOURS)
+    parser.add_argument("--list", action="store_true", help="Imprime cada objeto huérfano y documento colgado")
+    parser.add_argument("--json", action="store_true", help="Imprime el reporte como JSON")
+    args = parser.parse_args(argv)
+
+    from database import engine
+
+    def print_orphan(item: dict):
+        print(f"  huérfano  {item['Key']}  {item['Size']} bytes  {item['LastModified'].isoformat()}")
+
+    def print_dangling(document_id: int, storage_key: str):
+        print(f"  colgado   documento {document_id}  {storage_key}")
+
+    try:
+        report = reconcile(
+            engine,
+            delete_orphans=args.delete_orphans,
+            delete_dangling=args.delete_dangling,
+            check_orphans=not args.skip_orphans,
+            check_dangling=not args.skip_dangling,
+            prefix=args.prefix,
+            batch_size=max(1, args.batch_size),
+            grace_hours=args.grace_hours,
+            on_orphan=print_orphan if args.list else None,
+            on_dangling=print_dangling if args.list else None,
+        )
+    except ReconcileLocked as e:
+        print(e)
+        return 1
+
+    if args.json:
+        print(json.dumps(report.to_dict(), indent=2))
+    else:
+        print(f"\nReconciliación terminada en {report.elapsed_seconds:.1f} s")
+        print(f"  {report.objects_scanned} objetos revisados ({report.skipped_recent} recientes omitidos)")
+        print(f"  {report.orphans} huérfanos ({report.orphan_bytes / 1024 / 1024:.1f} MB), "
+              f"{report.orphans_deleted} borrados")
+        print(f"  {report.documents_scanned} documentos revisados: {report.dangling} sin archivo, "
+              f"{report.dangling_deleted} eliminados, {report.unverified} sin verificar")
+        for error in report.errors:
+            print(f"  Error: {error}")
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 from enum import Enum
 
 
@@ -69,6 +69,12 @@ class TokenResponse(BaseModel):
     token_type: str = "bearer"
     role: str  # "student" o "admin"
     user: dict  # Información básica del usuario
+    refresh_token: Optional[str] = None  # Solo en formato "profile"
+    expires_in: Optional[int] = None  # Segundos de vida del access token (formato "profile")
+
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str = Field(..., description="Refresh token emitido en el login")
 
 
 class MessageResponse(BaseModel):
@@ -76,6 +82,24 @@ class MessageResponse(BaseModel):
     detail: Optional[str] = None
 
 
+# ===== SCHEMAS PARA IMPORTACIÓN MASIVA =====
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+
+class ImportReportResponse(BaseModel):
+    kind: str  # "students" o "admins"
+    processed: int
+    inserted: int
+    updated: int
+    skipped: int
+    failed: int
+    elapsed_seconds: float
+    rows_per_second: float
+    errors: List[ImportRowError] = []
+
+
 # ===== SCHEMAS PARA DOCUMENTOS =====
 class DocumentBase(BaseModel):
     name: str
@@ -108,6 +132,8 @@ class DocumentResponse(DocumentBase):
     storage_key: str
     uploaded_by: Optional[int] = None
     uploaded_by_type: Optional[str] = None
+    content_hash: Optional[str] = None
+    processing_error: Optional[str] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
     processed_at: Optional[datetime] = None
@@ -116,7 +142,192 @@ class DocumentResponse(DocumentBase):
         from_attributes = True
 
 
+class DocumentProjection(BaseModel):
+    """
+    Documento con solo las columnas pedidas en `fields=` (ver GET /api/documents).
+    Todos los campos son opcionales; la respuesta incluye únicamente los pedidos.
+    """
+    id: Optional[int] = None
+    name: Optional[str] = None
+    file_type: Optional[str] = None
+    file_size: Optional[int] = None
+    category: Optional[str] = None
+    status: Optional[DocumentStatusEnum] = None
+    storage_url: Optional[str] = None
+    storage_key: Optional[str] = None
+    uploaded_by: Optional[int] = None
+    uploaded_by_type: Optional[str] = None
+    content_hash: Optional[str] = None
+    processing_error: Optional[str] = None
+    description: Optional[str] = None
+    tags: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    processed_at: Optional[datetime] = None
+
+
+class DocumentProjectionListResponse(BaseModel):
+    total: Optional[int] = None
+    total_is_estimate: bool = False
+    documents: List[DocumentProjection]
+    next_cursor: Optional[str] = None
+
+
 class DocumentListResponse(BaseModel):
-    total: int
+    total: Optional[int] = None  # None con include_total=false
+    total_is_estimate: bool = False  # True si el total viene de las estadísticas del planificador
     documents: List[DocumentResponse]
+    next_cursor: Optional[str] = None  # Solo en paginación por cursor; None si no hay más páginas
+
+
+class CategoryFacet(BaseModel):
+    name: Optional[str] = None  # None para documentos sin categoría
+    document_count: int
+    total_bytes: int
+    statuses: Dict[str, int]  # Documentos por estado dentro de la categoría
+
+
+class DocumentFacetsResponse(BaseModel):
+    version: int  # Cambia con cada modificación del catálogo
+    total_documents: int
+    total_bytes: int
+    statuses: Dict[str, int]
+    categories: List[CategoryFacet]
+
+
+# ===== SCHEMAS PARA SUBIDA DIRECTA AL STORAGE =====
+class DirectUploadInitiateRequest(BaseModel):
+    filename: str
+    file_size: int  # Tamaño declarado en bytes (se verifica con HEAD al finalizar)
+    content_type: Optional[str] = None
+
+
+class DirectUploadInitiateResponse(BaseModel):
+    upload_url: str
+    method: str
+    headers: Dict[str, str]  # Headers que el cliente debe enviar en la subida
+    storage_key: str
+    upload_token: str
+    expires_in: int
+
+
+class MultipartUploadInitiateResponse(BaseModel):
+    storage_key: str
+    upload_id: str
+    part_size: int  # Bytes por parte (todas salvo la última)
+    part_count: int
+    upload_token: str
+    expires_in: int  # Segundos que el ticket permite retomar la subida
+
+
+class UploadTokenRequest(BaseModel):
+    upload_token: str
+
+
+class MultipartPartsRequest(UploadTokenRequest):
+    part_numbers: Optional[List[int]] = None  # Por defecto, todas las partes que falten
+
+
+class UploadedPart(BaseModel):
+    part_number: int
+    size: int
+
+
+class PartUploadUrl(BaseModel):
+    part_number: int
+    url: str
+
+
+class MultipartPartsResponse(BaseModel):
+    upload_id: str
+    uploaded_parts: List[UploadedPart]
+    urls: List[PartUploadUrl]
+    expires_in: int
+
+
+class DirectUploadFinalizeRequest(BaseModel):
+    upload_token: str
+    category: str = "Sin categoría"
+    description: Optional[str] = None
+    tags: Optional[str] = None
+
+
+# ===== SCHEMAS PARA URLS DE DESCARGA =====
+class DownloadUrlBatchRequest(BaseModel):
+    ids: List[int]
+
+
+class DocumentDownloadUrl(BaseModel):
+    document_id: int
+    filename: str
+    download_url: str
+    expires_in: int  # Segundos de validez restantes de la URL
+
+
+class DownloadUrlBatchResponse(BaseModel):
+    urls: List[DocumentDownloadUrl]
+    missing: List[int]  # IDs que no existen
+
+
+# ===== SCHEMAS PARA OPERACIONES MASIVAS DE DOCUMENTOS =====
+class DocumentFilter(BaseModel):
+    category: Optional[str] = None
+    status: Optional[DocumentStatusEnum] = None
+    tags: Optional[List[str]] = None  # Documentos con alguno de estos tags
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+
+class DocumentBulkSelection(BaseModel):
+    """Documentos afectados: una lista de IDs o un filtro (uno de los dos)"""
+    ids: Optional[List[int]] = None
+    filter: Optional[DocumentFilter] = None
+
+
+class DocumentBulkUpdateRequest(DocumentBulkSelection):
+    changes: DocumentUpdate
+
+
+class DocumentBulkDeleteRequest(DocumentBulkSelection):
+    pass
+
+
+class BulkItemResult(BaseModel):
+    id: int
+    status: str  # "updated", "deleted", "not_found" o "storage_error"
+    detail: Optional[str] = None
+
+
+class BulkOperationResponse(BaseModel):
+    requested: int
+    succeeded: int
+    failed: int
+    elapsed_seconds: float
+    results: List[BulkItemResult]
+
+
+# ===== SCHEMAS PARA BÚSQUEDA SEMÁNTICA =====
+class SemanticSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, description="Consultas a resolver en la misma petición")
+    top_k: int = Field(5, ge=1, description="Fragmentos por consulta")
+    category: Optional[str] = None  # Solo documentos de esta categoría
+
+
+class SemanticHit(BaseModel):
+    document_id: int
+    document_name: str
+    category: Optional[str] = None
+    chunk_index: int
+    score: float  # Similitud coseno (1 = idéntico)
+    content: str
+
+
+class SemanticQueryResult(BaseModel):
+    query: str
+    hits: List[SemanticHit]
+
 
+class SemanticSearchResponse(BaseModel):
+    results: List[SemanticQueryResult]
+    indexed_chunks: int
+    took_ms: float
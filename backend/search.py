@@ -0,0 +1,136 @@
+"""
+Búsqueda de texto completo sobre nombre, descripción y tags de los documentos.
+
+`Document.name.ilike('%term%')` no puede usar ningún índice (comodín inicial)
+e ignora la descripción y los tags. Aquí la búsqueda depende del motor:
+
+- PostgreSQL: `tsvector` con stemming en español e índice GIN
+  (`ix_documents_search_vector`, ver models.py) y trigramas sobre el nombre
+  (`ix_documents_name_trgm`, extensión pg_trgm) para nombres de archivo
+  parciales o con errores de tipeo. El orden combina `ts_rank_cd` y
+  `similarity`.
+- SQLite (desarrollo local / pruebas): tabla virtual FTS5 `documents_fts`
+  sincronizada con triggers; el orden usa `bm25`.
+
+Sin FTS5 disponible se vuelve al LIKE sobre el nombre.
+"""
+
+import re
+from typing import List, Optional
+
+from sqlalchemy import column, func, or_, select, table, text
+from sqlalchemy.exc import OperationalError
+
+import models
+
+# Tabla virtual FTS5 (solo SQLite)
+_fts = table("documents_fts", column("rowid"), column("documents_fts"))
+
+_SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5("
+    "name, description, tags, content='documents', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_ai AFTER INSERT ON documents BEGIN "
+    "INSERT INTO documents_fts(rowid, name, description, tags) "
+    "VALUES (new.id, new.name, new.description, new.tags); END",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_ad AFTER DELETE ON documents BEGIN "
+    "INSERT INTO documents_fts(documents_fts, rowid, name, description, tags) "
+    "VALUES ('delete', old.id, old.name, old.description, old.tags); END",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_au AFTER UPDATE ON documents BEGIN "
+    "INSERT INTO documents_fts(documents_fts, rowid, name, description, tags) "
+    "VALUES ('delete', old.id, old.name, old.description, old.tags); "
+    "INSERT INTO documents_fts(rowid, name, description, tags) "
+    "VALUES (new.id, new.name, new.description, new.tags); END",
+)
+
+# Se activa en `ensure_search_index` si el SQLite local soporta FTS5
+_sqlite_fts_enabled = False
+
+
+def ensure_search_index(bind) -> None:
+    """
+    Prepara el índice de búsqueda de SQLite (tabla FTS5 + triggers) y lo
+    llena con los documentos existentes la primera vez. En PostgreSQL los
+    índices los crea `ensure_schema` desde los modelos.
+    """
+    global _sqlite_fts_enabled
+    if bind.dialect.name != "sqlite":
+        return
+
+    try:
+        with bind.begin() as conn:
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'documents_fts'"
+            ).first() is not None
+            for statement in _SQLITE_FTS_DDL:
+                conn.exec_driver_sql(statement)
+            if not exists:
+                conn.exec_driver_sql("INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')")
+    except OperationalError as e:
+        print(f"FTS5 no disponible, la búsqueda usará LIKE: {str(e)}")
+        return
+    _sqlite_fts_enabled = True
+
+
+def _like_pattern(term: str) -> str:
+    """Patrón '%term%' con los comodines del usuario escapados"""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _name_contains(term: str):
+    return models.Document.name.ilike(_like_pattern(term), escape="\\")
+
+
+def _fts5_query(term: str) -> Optional[str]:
+    """Convierte el texto del usuario en una consulta FTS5 segura (AND de prefijos)"""
+    tokens = re.findall(r"\w+", term)
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def _search_vector():
+    return models.document_search_vector(
+        models.Document.name, models.Document.description, models.Document.tags
+    )
+
+
+def search_filter(dialect_name: str, term: str):
+    """Condición WHERE de la búsqueda de texto completo para el motor dado"""
+    if dialect_name == "postgresql":
+        tsquery = func.websearch_to_tsquery(text("'spanish'"), term)
+        return or_(
+            _search_vector().op("@@")(tsquery),
+            _name_contains(term),
+            models.Document.name.op("%")(term),
+        )
+
+    fts_query = _fts5_query(term)
+    if dialect_name == "sqlite" and _sqlite_fts_enabled and fts_query:
+        return or_(
+            models.Document.id.in_(select(_fts.c.rowid).where(_fts.c.documents_fts.match(fts_query))),
+            _name_contains(term),
+        )
+
+    return _name_contains(term)
+
+
+def search_order(dialect_name: str, term: str) -> List:
+    """Criterios ORDER BY por relevancia (los más relevantes primero)"""
+    if dialect_name == "postgresql":
+        tsquery = func.websearch_to_tsquery(text("'spanish'"), term)
+        rank = func.ts_rank_cd(_search_vector(), tsquery) + func.similarity(models.Document.name, term)
+        return [rank.desc()]
+
+    fts_query = _fts5_query(term)
+    if dialect_name == "sqlite" and _sqlite_fts_enabled and fts_query:
+        # bm25 con pesos nombre > tags > descripción (como A/B/C en PostgreSQL):
+        # valores más negativos = más relevantes; sin coincidencia FTS (solo LIKE) al final
+        rank = select(text("bm25(documents_fts, 10.0, 1.0, 5.0)")).where(
+            _fts.c.rowid == models.Document.id,
+            _fts.c.documents_fts.match(fts_query)
+        ).scalar_subquery()
+        return [rank.asc().nulls_last()]
+
+    return []
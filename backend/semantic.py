@@ -0,0 +1,988 @@
+"""
+Búsqueda semántica sobre el texto de los documentos.
+
+Los workers de processing.py extraen el texto de cada documento; aquí ese
+texto se divide en fragmentos que se solapan y cada fragmento se convierte
+en un embedding (vector normalizado). Los fragmentos y sus vectores se
+guardan en `document_chunks`, en la misma transacción que marca el
+documento READY.
+
+Cada proceso de la API mantiene en memoria un índice con todos los vectores
+en una matriz NumPy contigua (float32):
+
+- Se actualiza de forma incremental y en segundo plano: cada búsqueda lee
+  `catalog_state.documents_version` (una fila); si cambió, despierta un hilo
+  que carga solo los fragmentos nuevos, recalcula qué filas siguen vigentes
+  (documentos READY, última versión de sus fragmentos) y su categoría solo
+  para los documentos que cambiaron, reentrena el IVF si hace falta y publica
+  un snapshot nuevo. La búsqueda usa el snapshot vigente sin esperar (solo la
+  primera carga del proceso se hace dentro de la petición)
+- Índice "flat": producto punto contra toda la matriz (exacto)
+- Índice IVF: los vectores se agrupan con k-means en listas y cada consulta
+  revisa solo las SEMANTIC_IVF_PROBES listas más cercanas (aproximado). Con
+  SEMANTIC_INDEX=auto se usa desde SEMANTIC_IVF_MIN_CHUNKS fragmentos; con
+  1M de fragmentos una consulta revisa ~1-2% de la matriz
+- Varias consultas de una petición se resuelven juntas (un producto de
+  matrices en el índice flat)
+
+El embedder es intercambiable: "hashing" (por defecto) funciona sin red ni
+modelos descargados (feature hashing de palabras y bigramas sin tildes ni
+palabras vacías); "sentence-transformers" usa un modelo local de
+sentence-transformers (pip install sentence-transformers). Cada fragmento
+guarda el nombre del embedder que lo generó: al cambiar de embedder hay que
+recalcular con `python semantic.py --reindex`.
+
+Uso:
+    python semantic.py --reindex             # documentos sin fragmentos del embedder actual
+    python semantic.py --reindex --all       # todos los documentos
+    python semantic.py --requeue             # reprocesa documentos READY sin texto extraído
+    python semantic.py --query "requisitos de la práctica" --top-k 5
+
+Configuración (variables de entorno):
+- SEMANTIC_EMBEDDER: "hashing" (por defecto) o "sentence-transformers"
+- SEMANTIC_MODEL: modelo de sentence-transformers (por defecto
+  "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+- SEMANTIC_DIMENSIONS: dimensiones del embedder hashing (por defecto 256)
+- SEMANTIC_CHUNK_CHARS: tamaño de cada fragmento en caracteres (por defecto 1000)
+- SEMANTIC_CHUNK_OVERLAP: caracteres compartidos entre fragmentos consecutivos (por defecto 150)
+- SEMANTIC_INDEX: "auto" (por defecto), "flat" o "ivf"
+- SEMANTIC_IVF_MIN_CHUNKS: fragmentos a partir de los cuales "auto" usa IVF (por defecto 100000)
+- SEMANTIC_IVF_LISTS: listas del índice IVF (por defecto 0 = raíz cuadrada de los fragmentos)
+- SEMANTIC_IVF_PROBES: listas revisadas por consulta (por defecto 16)
+- SEMANTIC_TOP_K_MAX: máximo de resultados por consulta (por defecto 50)
+- SEMANTIC_BATCH_MAX: máximo de consultas por petición (por defecto 32)
+- SEMANTIC_WARMUP: "true" (por defecto) carga el índice al arrancar la API
+"""
+
+import argparse
+import math
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import delete, event, exists, func, select
+from sqlalchemy.orm import Session
+
+import models
+from catalog import bump_documents_version, documents_version
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+SEMANTIC_EMBEDDER = os.getenv("SEMANTIC_EMBEDDER", "hashing")
+SEMANTIC_MODEL = os.getenv("SEMANTIC_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+SEMANTIC_DIMENSIONS = int(os.getenv("SEMANTIC_DIMENSIONS", "256"))
+SEMANTIC_CHUNK_CHARS = max(100, int(os.getenv("SEMANTIC_CHUNK_CHARS", "1000")))
+SEMANTIC_CHUNK_OVERLAP = max(0, int(os.getenv("SEMANTIC_CHUNK_OVERLAP", "150")))
+SEMANTIC_INDEX = os.getenv("SEMANTIC_INDEX", "auto")
+SEMANTIC_IVF_MIN_CHUNKS = int(os.getenv("SEMANTIC_IVF_MIN_CHUNKS", "100000"))
+SEMANTIC_IVF_LISTS = int(os.getenv("SEMANTIC_IVF_LISTS", "0"))
+SEMANTIC_IVF_PROBES = max(1, int(os.getenv("SEMANTIC_IVF_PROBES", "16")))
+SEMANTIC_TOP_K_MAX = int(os.getenv("SEMANTIC_TOP_K_MAX", "50"))
+SEMANTIC_BATCH_MAX = int(os.getenv("SEMANTIC_BATCH_MAX", "32"))
+SEMANTIC_WARMUP = os.getenv("SEMANTIC_WARMUP", "true").lower() == "true"
+
+# Fragmentos leídos por consulta al cargar el índice y documentos por lote al reindexar
+_LOAD_BATCH_SIZE = 20000
+_REINDEX_BATCH_SIZE = 50
+
+# Filas no vigentes (documentos eliminados o reprocesados) que disparan la compactación de la matriz
+_COMPACT_FRACTION = 0.25
+
+# Filas nuevas fuera de las listas IVF (se recorren completas) que disparan re-entrenar el IVF
+_IVF_TAIL_FRACTION = 0.1
+
+# K-means del IVF: iteraciones y vectores de muestra por lista
+_KMEANS_ITERATIONS = 8
+_KMEANS_SAMPLES_PER_LIST = 32
+
+# Bloque de filas al asignar los vectores a las listas IVF (acota la memoria temporal)
+_ASSIGN_BLOCK_SIZE = 65536
+
+# Los cambios de documentos se buscan por `updated_at` desde la última
+# actualización menos este margen: en PostgreSQL now() es la hora de inicio de
+# la transacción, así que un commit puede llegar con una hora anterior
+_CHANGE_MARGIN_SECONDS = 300
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# Palabras vacías del español: sin IDF dominarían los vectores del embedder hashing
+_STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el ella
+ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos fue ha hay la las le les
+lo los mas me mi mis mucho muy no nos o otra otro para pero poco por porque que quien se ser si sin
+sobre su sus tambien te tiene tu un una uno unos y ya yo
+""".split())
+
+
+# ============================================================================
+# FRAGMENTOS
+# ============================================================================
+
+def chunk_text(text: str, size: int = SEMANTIC_CHUNK_CHARS,
+               overlap: int = SEMANTIC_CHUNK_OVERLAP) -> List[Tuple[int, str]]:
+    """
+    Divide el texto en fragmentos de hasta `size` caracteres que comparten
+    `overlap` caracteres con el anterior. Corta preferentemente en un fin de
+    párrafo, de línea, de oración o entre palabras.
+
+    Returns:
+        List[Tuple[int, str]]: (offset en el texto, fragmento)
+    """
+    overlap = min(overlap, size // 2)
+    chunks = []
+    start, length = 0, len(text)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            for separator in ("\n\n", "\n", ". ", " "):
+                cut = text.rfind(separator, start + size // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+
+        piece = text[start:end]
+        stripped = piece.lstrip()
+        if stripped.strip():
+            chunks.append((start + len(piece) - len(stripped), stripped.rstrip()))
+        if end >= length:
+            break
+
+        # El siguiente fragmento empieza `overlap` caracteres antes, en un límite de palabra
+        next_start = max(end - overlap, start + 1)
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return chunks
+
+
+# ============================================================================
+# EMBEDDERS
+# ============================================================================
+
+def _normalize_text(text: str) -> str:
+    """Minúsculas y sin tildes (la consulta "practica" encuentra "práctica")"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+@lru_cache(maxsize=200000)
+def _hash_feature(feature: str, dimensions: int) -> Tuple[int, float]:
+    """Posición y signo de un término en el vector (el signo reduce el sesgo de las colisiones)"""
+    value = zlib.crc32(feature.encode("utf-8"))
+    return value % dimensions, (1.0 if value & 0x80000000 else -1.0)
+
+
+class HashingEmbedder:
+    """
+    Embedder sin dependencias ni red: cada palabra y cada par de palabras
+    consecutivas suma `1 + log(frecuencia)` en la posición que le asigna un
+    hash. Encuentra fragmentos con las mismas palabras (sin importar tildes
+    ni orden); no entiende sinónimos.
+    """
+
+    def __init__(self, dimensions: int = SEMANTIC_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = [token for token in _TOKEN_PATTERN.findall(_normalize_text(text)) if token not in _STOPWORDS]
+            features = Counter(tokens)
+            features.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+            for feature, count in features.items():
+                index, sign = _hash_feature(feature, self.dimensions)
+                matrix[row, index] += sign * (1.0 + math.log(count))
+        return _normalize_rows(matrix)
+
+
+class SentenceTransformerEmbedder:
+    """Modelo local de sentence-transformers (se descarga una vez y luego funciona sin red)"""
+
+    def __init__(self, model_name: str = SEMANTIC_MODEL):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError(
+                "SEMANTIC_EMBEDDER=sentence-transformers requiere: pip install sentence-transformers"
+            )
+        self._model = SentenceTransformer(model_name)
+        self.dimensions = self._model.get_sentence_embedding_dimension()
+        self.name = embedder_name()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = self._model.encode(list(texts), batch_size=32, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype(np.float32, copy=False)
+
+
+def embedder_name() -> str:
+    """Nombre del embedder configurado (se conoce sin cargar el modelo)"""
+    if SEMANTIC_EMBEDDER == "sentence-transformers":
+        return f"st:{SEMANTIC_MODEL}"
+    return f"hashing-{SEMANTIC_DIMENSIONS}"
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """Embedder configurado (se crea en el primer uso: el modelo tarda en cargar)"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                if SEMANTIC_EMBEDDER == "sentence-transformers":
+                    _embedder = SentenceTransformerEmbedder()
+                else:
+                    _embedder = HashingEmbedder()
+    return _embedder
+
+
+# ============================================================================
+# FRAGMENTOS EN LA BD
+# ============================================================================
+
+def embed_chunks(content: str) -> List[dict]:
+    """Fragmentos del texto con sus embeddings (filas de `document_chunks` sin `document_id`)"""
+    chunks = chunk_text(content)
+    if not chunks:
+        return []
+    embedder = get_embedder()
+    vectors = embedder.embed([piece for _, piece in chunks])
+    return [
+        {
+            "chunk_index": index,
+            "char_start": char_start,
+            "content": piece,
+            "embedder": embedder.name,
+            "embedding": vector.astype("<f4").tobytes(),
+        }
+        for index, ((char_start, piece), vector) in enumerate(zip(chunks, vectors))
+    ]
+
+
+def replace_chunks(db: Session, document_id: int, chunks: List[dict]) -> None:
+    """Reemplaza los fragmentos del documento (se confirma con la transacción de `db`)"""
+    db.execute(delete(models.DocumentChunk).where(models.DocumentChunk.document_id == document_id))
+    db.add_all(models.DocumentChunk(document_id=document_id, **chunk) for chunk in chunks)
+
+
+@event.listens_for(Session, "before_flush")
+def _delete_document_chunks(session: Session, flush_context, instances) -> None:
+    """Elimina los fragmentos de los documentos eliminados (SQLite no aplica ON DELETE CASCADE)"""
+    document_ids = [obj.id for obj in session.deleted if isinstance(obj, models.Document)]
+    if document_ids:
+        session.connection().execute(
+            delete(models.DocumentChunk).where(models.DocumentChunk.document_id.in_(document_ids))
+        )
+
+
+# ============================================================================
+# ÍNDICE EN MEMORIA
+# ============================================================================
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Posiciones de los `k` mayores puntajes finitos, de mayor a menor"""
+    k = min(k, scores.shape[0])
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return candidates[np.isfinite(scores[candidates])]
+
+
+def _train_centroids(vectors: np.ndarray, lists: int) -> np.ndarray:
+    """K-means esférico sobre una muestra (los vectores están normalizados: similitud coseno)"""
+    rng = np.random.default_rng(0)
+    sample_size = min(vectors.shape[0], lists * _KMEANS_SAMPLES_PER_LIST)
+    sample = vectors[np.sort(rng.choice(vectors.shape[0], sample_size, replace=False))]
+    centroids = sample[rng.choice(sample_size, lists, replace=False)].copy()
+    for _ in range(_KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        members, starts = np.unique(assignment[order], return_index=True)
+        # Las listas sin vectores conservan su centroide anterior
+        centroids[members] = np.add.reduceat(sample[order], starts, axis=0)
+        centroids = _normalize_rows(centroids)
+    return centroids
+
+
+def _assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignment = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], _ASSIGN_BLOCK_SIZE):
+        block = vectors[start:start + _ASSIGN_BLOCK_SIZE]
+        assignment[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    """
+    Estado del índice en una versión del catálogo. No se modifica: al
+    actualizar se arma otro snapshot, así las búsquedas en curso no necesitan
+    un lock.
+    """
+    version: Optional[int]
+    dimensions: int
+    vectors: np.ndarray  # (filas, dimensiones) float32; con IVF, las primeras `ivf_rows` ordenadas por lista
+    chunk_ids: np.ndarray  # int64
+    document_ids: np.ndarray  # int64
+    chunk_indexes: np.ndarray  # int32
+    bias: np.ndarray  # 0 si la fila está vigente, -inf si no (se suma al puntaje)
+    category_codes: np.ndarray  # int32, código de la categoría del documento (-1 si no está vigente)
+    categories: Dict[Optional[str], int]
+    ready_document_ids: np.ndarray  # int64 ordenado, documentos READY en esta versión
+    ready_category_codes: np.ndarray  # int32, código de la categoría de cada documento READY
+    last_chunk_id: int
+    live_rows: int
+    centroids: Optional[np.ndarray] = None
+    list_offsets: Optional[np.ndarray] = None  # Inicio de cada lista IVF (len = listas + 1)
+    ivf_rows: int = 0
+    changed_until: Optional[datetime] = None  # Mayor `updated_at` de documento ya aplicado
+
+    @property
+    def rows(self) -> int:
+        return self.vectors.shape[0]
+
+    def search(self, queries: np.ndarray, top_k: int, category: Optional[str] = None,
+               probes: int = SEMANTIC_IVF_PROBES) -> List[List[Tuple[int, float]]]:
+        """
+        Top-k de cada consulta (vectores normalizados).
+
+        Returns:
+            List[List[Tuple[int, float]]]: por consulta, (fila, puntaje) de mayor a menor
+        """
+        bias = self.bias
+        if category is not None:
+            code = self.categories.get(category)
+            if code is None:
+                return [[] for _ in range(queries.shape[0])]
+            bias = np.where(self.category_codes == code, bias, np.float32(-np.inf))
+
+        if self.rows == 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        if self.centroids is None:
+            scores = queries @ self.vectors.T
+            scores += bias
+            return [[(int(row), float(query_scores[row])) for row in _top_k(query_scores, top_k)]
+                    for query_scores in scores]
+
+        probes = min(probes, self.centroids.shape[0])
+        nearest_lists = np.argpartition(-(queries @ self.centroids.T), probes - 1, axis=1)[:, :probes]
+        tail = np.arange(self.ivf_rows, self.rows)
+        results = []
+        for query, lists in zip(queries, nearest_lists):
+            candidates = np.concatenate(
+                [np.arange(self.list_offsets[lst], self.list_offsets[lst + 1]) for lst in lists] + [tail]
+            )
+            scores = self.vectors[candidates] @ query
+            scores += bias[candidates]
+            results.append([(int(candidates[position]), float(scores[position]))
+                            for position in _top_k(scores, top_k)])
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "embedder": embedder_name(),
+            "dimensions": self.dimensions,
+            "rows": self.rows,
+            "live_rows": self.live_rows,
+            "index": "ivf" if self.centroids is not None else "flat",
+            "ivf_lists": 0 if self.centroids is None else self.centroids.shape[0],
+            "ivf_unclustered_rows": self.rows - self.ivf_rows if self.centroids is not None else 0,
+            "memory_mb": round(self.vectors.nbytes / (1024 * 1024), 1),
+        }
+
+
+def _empty_snapshot(dimensions: int = 0) -> IndexSnapshot:
+    return IndexSnapshot(
+        version=None,
+        dimensions=dimensions,
+        vectors=np.empty((0, dimensions), dtype=np.float32),
+        chunk_ids=np.empty(0, dtype=np.int64),
+        document_ids=np.empty(0, dtype=np.int64),
+        chunk_indexes=np.empty(0, dtype=np.int32),
+        bias=np.empty(0, dtype=np.float32),
+        category_codes=np.empty(0, dtype=np.int32),
+        categories={},
+        ready_document_ids=np.empty(0, dtype=np.int64),
+        ready_category_codes=np.empty(0, dtype=np.int32),
+        last_chunk_id=0,
+        live_rows=0,
+    )
+
+
+def _fetch_chunks(db: Session, *conditions) -> list:
+    """(id, document_id, chunk_index, embedding) de los fragmentos del embedder actual, por lotes"""
+    rows, last_id = [], 0
+    while True:
+        batch = db.execute(
+            select(
+                models.DocumentChunk.id, models.DocumentChunk.document_id,
+                models.DocumentChunk.chunk_index, models.DocumentChunk.embedding,
+            )
+            .where(models.DocumentChunk.embedder == embedder_name(), models.DocumentChunk.id > last_id, *conditions)
+            .order_by(models.DocumentChunk.id)
+            .limit(_LOAD_BATCH_SIZE)
+        ).all()
+        if not batch:
+            return rows
+        rows.extend(tuple(row) for row in batch)
+        last_id = batch[-1][0]
+
+
+def _generation_start(document_ids: np.ndarray, chunk_ids: np.ndarray, chunk_indexes: np.ndarray) -> np.ndarray:
+    """
+    Por fila, el id del fragmento 0 más reciente de su documento. Al
+    reprocesar un documento sus fragmentos se reemplazan: las filas con un id
+    menor son de la versión anterior.
+    """
+    first = chunk_indexes == 0
+    if not first.any():
+        return np.zeros(chunk_ids.shape[0], dtype=np.int64)
+    first_documents, first_ids = document_ids[first], chunk_ids[first]
+    order = np.lexsort((first_ids, first_documents))
+    first_documents, first_ids = first_documents[order], first_ids[order]
+    latest = np.append(first_documents[1:] != first_documents[:-1], True)
+    first_documents, first_ids = first_documents[latest], first_ids[latest]
+
+    positions = np.minimum(np.searchsorted(first_documents, document_ids), first_documents.shape[0] - 1)
+    return np.where(first_documents[positions] == document_ids, first_ids[positions], 0)
+
+
+def _liveness(ready_ids: np.ndarray, ready_codes: np.ndarray, document_ids: np.ndarray,
+              chunk_ids: np.ndarray, chunk_indexes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Por fila, si está vigente (documento READY y última generación de sus
+    fragmentos) y el código de categoría (-1 si no está vigente). Deben
+    incluirse todas las filas de cada documento: la generación se calcula
+    por documento.
+    """
+    live = np.zeros(chunk_ids.shape[0], dtype=bool)
+    category_codes = np.full(chunk_ids.shape[0], -1, dtype=np.int32)
+    if ready_ids.shape[0] and chunk_ids.shape[0]:
+        positions = np.minimum(np.searchsorted(ready_ids, document_ids), ready_ids.shape[0] - 1)
+        live = ready_ids[positions] == document_ids
+        live &= chunk_ids >= _generation_start(document_ids, chunk_ids, chunk_indexes)
+        category_codes = np.where(live, ready_codes[positions], -1).astype(np.int32)
+    return live, category_codes
+
+
+class SemanticIndex:
+    """
+    Índice de vectores de los fragmentos, actualizado por versión del
+    catálogo (como `catalog.FacetCache`).
+
+    Las filas se agregan al final de un buffer con capacidad de sobra (sin
+    copiar la matriz en cada actualización); la matriz se compacta cuando
+    acumula muchas filas no vigentes.
+    """
+
+    def __init__(self):
+        self._snapshot = _empty_snapshot()
+        self._refresh_lock = threading.Lock()
+        self._buffer: Optional[np.ndarray] = None
+        self.last_refresh_seconds = 0.0
+        # Hilo de actualización en segundo plano y si se pidió otra pasada
+        self._state_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._requested = False
+
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        return self._snapshot
+
+    def refresh(self, db: Session) -> IndexSnapshot:
+        """
+        Snapshot para una búsqueda. Solo la primera carga del proceso se hace
+        aquí; después, si la versión cambió, se pide la actualización al hilo
+        de fondo y se responde con el snapshot vigente sin esperarla.
+        """
+        version = documents_version(db)
+        snapshot = self._snapshot
+        if snapshot.version == version:
+            return snapshot
+        if snapshot.version is not None:
+            self.request_refresh(db.get_bind())
+            return snapshot
+        with self._refresh_lock:
+            if self._snapshot.version is None:
+                self._update(db, version)
+            return self._snapshot
+
+    def request_refresh(self, engine) -> None:
+        """Despierta (o inicia) el hilo que pone el índice al día con la BD"""
+        with self._state_lock:
+            self._requested = True
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._refresh_loop, args=(engine,), name="semantic-refresh", daemon=True
+                )
+                self._thread.start()
+
+    def _refresh_loop(self, engine) -> None:
+        # Repite mientras lleguen pedidos: un cambio durante una pasada larga
+        # (p. ej. re-entrenar el IVF) se aplica en la siguiente
+        while True:
+            with self._state_lock:
+                if not self._requested:
+                    self._thread = None
+                    return
+                self._requested = False
+            try:
+                with Session(engine) as db, self._refresh_lock:
+                    version = documents_version(db)
+                    if self._snapshot.version != version:
+                        self._update(db, version)
+            except Exception as e:
+                print(f"Error al actualizar el índice semántico: {e}")
+
+    def _update(self, db: Session, version: int) -> None:
+        """Arma y publica el snapshot de `version` (con `_refresh_lock` tomado)"""
+        started = time.perf_counter()
+        self._snapshot = self._load(db, version, self._snapshot)
+        self.last_refresh_seconds = time.perf_counter() - started
+
+    def _append(self, snapshot: IndexSnapshot, vectors: np.ndarray) -> np.ndarray:
+        """Matriz con las filas nuevas al final (reutiliza el buffer mientras tenga capacidad)"""
+        rows = snapshot.rows
+        total = rows + vectors.shape[0]
+        buffer = self._buffer
+        if buffer is None or buffer.shape[1] != vectors.shape[1] or buffer.shape[0] < total \
+                or (snapshot.rows and snapshot.vectors.base is not buffer):
+            buffer = np.empty((max(total, int(total * 1.5), 1024), vectors.shape[1]), dtype=np.float32)
+            if rows:
+                buffer[:rows] = snapshot.vectors
+            self._buffer = buffer
+        # Las filas después de `rows` no las ve ningún snapshot anterior
+        buffer[rows:total] = vectors
+        return buffer[:total]
+
+    def _ready_documents(self, db: Session, snapshot: IndexSnapshot):
+        """
+        Documentos READY y el código de categoría de cada uno. Con un snapshot
+        previo solo se leen los documentos con `updated_at` reciente; si el
+        resultado no cuadra con el contador de documentos READY (se eliminaron
+        documentos) se leen todos.
+
+        Returns:
+            Tuple: (ids READY, códigos, categorías, ids que cambiaron o None si
+            se leyeron todos, mayor `updated_at` aplicado)
+        """
+        if snapshot.version is not None and snapshot.changed_until is not None:
+            # El contador se lee antes que los cambios: un documento que pasa a
+            # READY entre ambas consultas sobra y fuerza la lectura completa
+            ready_count = db.execute(
+                select(func.coalesce(func.sum(models.DocumentCounter.document_count), 0))
+                .where(models.DocumentCounter.status == models.DocumentStatus.READY.value)
+            ).scalar()
+            since = snapshot.changed_until - timedelta(seconds=_CHANGE_MARGIN_SECONDS)
+            changed = db.execute(
+                select(models.Document.id, models.Document.status, models.Document.category,
+                       models.Document.updated_at)
+                .where(models.Document.updated_at >= since)
+            ).all()
+            changed_ids = np.unique(np.asarray([row[0] for row in changed], dtype=np.int64))
+            categories = dict(snapshot.categories)
+            ready = [(row[0], row[2]) for row in changed if row[1] == models.DocumentStatus.READY]
+            keep = ~np.isin(snapshot.ready_document_ids, changed_ids)
+            ready_ids = np.concatenate([
+                snapshot.ready_document_ids[keep], np.asarray([row[0] for row in ready], dtype=np.int64)
+            ])
+            if ready_ids.shape[0] == int(ready_count):
+                ready_codes = np.concatenate([
+                    snapshot.ready_category_codes[keep],
+                    np.asarray([categories.setdefault(category, len(categories)) for _, category in ready],
+                               dtype=np.int32),
+                ])
+                order = np.argsort(ready_ids, kind="stable")
+                changed_until = max([snapshot.changed_until] + [row[3] for row in changed])
+                return ready_ids[order], ready_codes[order], categories, changed_ids, changed_until
+
+        changed_until = db.execute(select(func.max(models.Document.updated_at))).scalar()
+        documents = db.execute(
+            select(models.Document.id, models.Document.category)
+            .where(models.Document.status == models.DocumentStatus.READY)
+            .order_by(models.Document.id)
+        ).all()
+        categories: Dict[Optional[str], int] = {}
+        ready_ids = np.asarray([document_id for document_id, _ in documents], dtype=np.int64)
+        ready_codes = np.asarray(
+            [categories.setdefault(category, len(categories)) for _, category in documents], dtype=np.int32
+        )
+        return ready_ids, ready_codes, categories, None, changed_until
+
+    def _load(self, db: Session, version: int, snapshot: IndexSnapshot) -> IndexSnapshot:
+        ready_ids, ready_codes, categories, changed_ids, changed_until = self._ready_documents(db, snapshot)
+
+        rows = _fetch_chunks(db, models.DocumentChunk.id > snapshot.last_chunk_id)
+        last_chunk_id = max([snapshot.last_chunk_id] + [row[0] for row in rows])
+        if snapshot.version is not None:
+            # Los ids no se confirman en orden: un worker pudo confirmar fragmentos con ids
+            # menores a los ya cargados. Se buscan por documento en los que pasaron a READY.
+            newly_ready = np.setdiff1d(ready_ids, snapshot.ready_document_ids, assume_unique=True).tolist()
+            missed = []
+            for start in range(0, len(newly_ready), _LOAD_BATCH_SIZE):
+                missed += _fetch_chunks(
+                    db,
+                    models.DocumentChunk.document_id.in_(newly_ready[start:start + _LOAD_BATCH_SIZE]),
+                    models.DocumentChunk.id <= snapshot.last_chunk_id,
+                )
+            if missed:
+                loaded = np.isin(np.asarray([row[0] for row in missed], dtype=np.int64), snapshot.chunk_ids)
+                rows += [row for row, duplicate in zip(missed, loaded) if not duplicate]
+
+        if rows:
+            dimensions = len(rows[0][3]) // 4
+            if snapshot.rows and dimensions != snapshot.dimensions:
+                # Cambió el modelo con el mismo nombre: se reconstruye el índice completo
+                self._buffer = None
+                return self._load(db, version, _empty_snapshot())
+            vectors = np.frombuffer(b"".join(row[3] for row in rows), dtype="<f4").reshape(-1, dimensions)
+            matrix = self._append(snapshot, vectors)
+            chunk_ids = np.concatenate([snapshot.chunk_ids, np.asarray([row[0] for row in rows], dtype=np.int64)])
+            document_ids = np.concatenate([snapshot.document_ids, np.asarray([row[1] for row in rows], dtype=np.int64)])
+            chunk_indexes = np.concatenate([snapshot.chunk_indexes, np.asarray([row[2] for row in rows], dtype=np.int32)])
+        else:
+            dimensions = snapshot.dimensions
+            matrix, chunk_ids = snapshot.vectors, snapshot.chunk_ids
+            document_ids, chunk_indexes = snapshot.document_ids, snapshot.chunk_indexes
+
+        # Filas vigentes: documento READY y última generación de sus fragmentos
+        if changed_ids is None:
+            live, category_codes = _liveness(ready_ids, ready_codes, document_ids, chunk_ids, chunk_indexes)
+            bias = np.where(live, 0, -np.inf).astype(np.float32)
+            live_rows = int(live.sum())
+        else:
+            # Solo se recalculan las filas de los documentos que cambiaron o recibieron fragmentos
+            added = chunk_ids.shape[0] - snapshot.rows
+            bias = np.concatenate([snapshot.bias, np.full(added, -np.inf, dtype=np.float32)])
+            category_codes = np.concatenate([snapshot.category_codes, np.full(added, -1, dtype=np.int32)])
+            affected = np.union1d(changed_ids, document_ids[snapshot.rows:])
+            targets = np.flatnonzero(np.isin(document_ids, affected))
+            live, codes = _liveness(
+                ready_ids, ready_codes, document_ids[targets], chunk_ids[targets], chunk_indexes[targets]
+            )
+            live_rows = snapshot.live_rows - int(np.isfinite(bias[targets]).sum()) + int(live.sum())
+            bias[targets] = np.where(live, 0, -np.inf)
+            category_codes[targets] = codes
+
+        updated = IndexSnapshot(
+            version=version,
+            dimensions=dimensions,
+            vectors=matrix,
+            chunk_ids=chunk_ids,
+            document_ids=document_ids,
+            chunk_indexes=chunk_indexes,
+            bias=bias,
+            category_codes=category_codes,
+            categories=categories,
+            ready_document_ids=ready_ids,
+            ready_category_codes=ready_codes,
+            last_chunk_id=last_chunk_id,
+            live_rows=live_rows,
+            centroids=snapshot.centroids,
+            list_offsets=snapshot.list_offsets,
+            ivf_rows=snapshot.ivf_rows,
+            changed_until=changed_until,
+        )
+        return self._maintain(updated)
+
+    def _maintain(self, snapshot: IndexSnapshot) -> IndexSnapshot:
+        """Compacta la matriz y (re)entrena el IVF cuando hace falta"""
+        dead_rows = snapshot.rows - snapshot.live_rows
+        use_ivf = SEMANTIC_INDEX == "ivf" or (
+            SEMANTIC_INDEX == "auto" and snapshot.live_rows >= SEMANTIC_IVF_MIN_CHUNKS
+        )
+        use_ivf = use_ivf and snapshot.live_rows >= 2
+
+        compact = dead_rows > 0 and dead_rows >= _COMPACT_FRACTION * snapshot.rows
+        retrain = use_ivf and (
+            snapshot.centroids is None
+            or snapshot.rows - snapshot.ivf_rows > _IVF_TAIL_FRACTION * max(snapshot.ivf_rows, 1)
+        )
+        if not compact and not retrain and (use_ivf or snapshot.centroids is None):
+            return snapshot
+
+        keep = np.flatnonzero(np.isfinite(snapshot.bias))
+        order = keep
+        centroids, list_offsets, ivf_rows = None, None, 0
+        if use_ivf:
+            vectors = snapshot.vectors[keep]
+            lists = SEMANTIC_IVF_LISTS or int(math.sqrt(keep.shape[0]))
+            lists = max(1, min(lists, keep.shape[0]))
+            centroids = _train_centroids(vectors, lists)
+            assignment = _assign_lists(vectors, centroids)
+            by_list = np.argsort(assignment, kind="stable")
+            order = keep[by_list]
+            list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=lists))])
+            ivf_rows = keep.shape[0]
+
+        # Matriz nueva (contigua) solo con las filas vigentes
+        self._buffer = None
+        return IndexSnapshot(
+            version=snapshot.version,
+            dimensions=snapshot.dimensions,
+            vectors=np.ascontiguousarray(snapshot.vectors[order]),
+            chunk_ids=snapshot.chunk_ids[order],
+            document_ids=snapshot.document_ids[order],
+            chunk_indexes=snapshot.chunk_indexes[order],
+            bias=snapshot.bias[order],
+            category_codes=snapshot.category_codes[order],
+            categories=snapshot.categories,
+            ready_document_ids=snapshot.ready_document_ids,
+            ready_category_codes=snapshot.ready_category_codes,
+            last_chunk_id=snapshot.last_chunk_id,
+            live_rows=snapshot.live_rows,
+            centroids=centroids,
+            list_offsets=list_offsets,
+            ivf_rows=ivf_rows,
+            changed_until=snapshot.changed_until,
+        )
+
+    def stats(self) -> dict:
+        return {
+            **self._snapshot.stats(),
+            "last_refresh_ms": round(1000 * self.last_refresh_seconds, 3),
+            "refreshing": self._thread is not None,
+        }
+
+
+# Instancia global del índice (una por proceso de la API)
+semantic_index = SemanticIndex()
+
+
+# ============================================================================
+# BÚSQUEDA
+# ============================================================================
+
+def search(queries: List[str], top_k: int = 5, category: Optional[str] = None, engine=None) -> dict:
+    """
+    Fragmentos más parecidos a cada consulta, con el documento al que
+    pertenecen. Abre su propia sesión síncrona: se ejecuta fuera del event
+    loop (el cálculo con NumPy no debe bloquearlo).
+    """
+    if engine is None:
+        from database import engine
+
+    started = time.perf_counter()
+    with Session(engine) as db:
+        snapshot = semantic_index.refresh(db)
+        vectors = get_embedder().embed(queries)
+        if snapshot.rows and vectors.shape[1] != snapshot.dimensions:
+            raise RuntimeError(
+                f"El índice tiene vectores de {snapshot.dimensions} dimensiones y el embedder genera "
+                f"{vectors.shape[1]}: ejecuta python semantic.py --reindex --all"
+            )
+        matches = snapshot.search(vectors, top_k, category)
+
+        chunk_ids = sorted({int(snapshot.chunk_ids[row]) for query_matches in matches for row, _ in query_matches})
+        chunks = {}
+        if chunk_ids:
+            chunks = {
+                row.chunk_id: row for row in db.execute(
+                    select(
+                        models.DocumentChunk.id.label("chunk_id"), models.DocumentChunk.chunk_index,
+                        models.DocumentChunk.content, models.Document.id.label("document_id"),
+                        models.Document.name, models.Document.category,
+                    )
+                    .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+                    .where(models.DocumentChunk.id.in_(chunk_ids))
+                )
+            }
+
+    results = []
+    for query, query_matches in zip(queries, matches):
+        hits = []
+        for row, score in query_matches:
+            chunk = chunks.get(int(snapshot.chunk_ids[row]))
+            if chunk is None:
+                # Se eliminó después de la última actualización del índice
+                continue
+            hits.append({
+                "document_id": chunk.document_id,
+                "document_name": chunk.name,
+                "category": chunk.category,
+                "chunk_index": chunk.chunk_index,
+                "score": round(score, 4),
+                "content": chunk.content,
+            })
+        results.append({"query": query, "hits": hits})
+
+    return {
+        "results": results,
+        "indexed_chunks": snapshot.live_rows,
+        "took_ms": round(1000 * (time.perf_counter() - started), 3),
+    }
+
+
+def warm_up(engine=None) -> None:
+    """Carga el índice (y el embedder) antes de la primera búsqueda"""
+    if engine is None:
+        from database import engine
+    try:
+        with Session(engine) as db:
+            semantic_index.refresh(db)
+        get_embedder()
+    except Exception as e:
+        print(f"Error al cargar el índice semántico: {e}")
+
+
+def start_warmup() -> None:
+    """Carga el índice en un hilo aparte al arrancar la API (si SEMANTIC_WARMUP=true)"""
+    if SEMANTIC_WARMUP:
+        threading.Thread(target=warm_up, name="semantic-warmup", daemon=True).start()
+
+
+# ============================================================================
+# MANTENIMIENTO (CLI)
+# ============================================================================
+
+@dataclass
+class ReindexReport:
+    documents: int = 0
+    chunks: int = 0
+    elapsed_seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "documents": self.documents,
+            "chunks": self.chunks,
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+        }
+
+
+def reindex(engine=None, reindex_all: bool = False) -> ReindexReport:
+    """
+    Recalcula los fragmentos de los documentos READY con texto extraído: los
+    que no tienen fragmentos del embedder actual o, con `reindex_all`, todos.
+    """
+    if engine is None:
+        from database import engine
+
+    started = time.perf_counter()
+    report = ReindexReport()
+    name = embedder_name()
+    last_id = 0
+    while True:
+        with Session(engine) as db:
+            stmt = (
+                select(models.DocumentText.document_id, models.DocumentText.content)
+                .join(models.Document, models.Document.id == models.DocumentText.document_id)
+                .where(
+                    models.DocumentText.document_id > last_id,
+                    models.Document.status == models.DocumentStatus.READY,
+                )
+                .order_by(models.DocumentText.document_id)
+                .limit(_REINDEX_BATCH_SIZE)
+            )
+            if not reindex_all:
+                stmt = stmt.where(~exists().where(
+                    models.DocumentChunk.document_id == models.DocumentText.document_id,
+                    models.DocumentChunk.embedder == name,
+                ))
+            batch = db.execute(stmt).all()
+            if not batch:
+                break
+
+            for document_id, content in batch:
+                chunks = embed_chunks(content)
+                replace_chunks(db, document_id, chunks)
+                report.documents += 1
+                report.chunks += len(chunks)
+            # Los índices en memoria de la API detectan los fragmentos nuevos por la versión
+            bump_documents_version(db.connection())
+            db.commit()
+            last_id = batch[-1][0]
+
+    report.elapsed_seconds = time.perf_counter() - started
+    return report
+
+
+def requeue_missing_text(engine=None) -> int:
+    """
+    Vuelve a poner en la cola de procesamiento los documentos READY sin texto
+    extraído (subidos antes de processing.py). Retorna cuántos se encolaron.
+    """
+    if engine is None:
+        from database import engine
+
+    requeued = 0
+    while True:
+        with Session(engine) as db:
+            documents = db.execute(
+                select(models.Document)
+                .where(
+                    models.Document.status == models.DocumentStatus.READY,
+                    models.Document.file_type != "DOC",
+                    ~exists().where(models.DocumentText.document_id == models.Document.id),
+                )
+                .order_by(models.Document.id)
+                .limit(_REINDEX_BATCH_SIZE)
+            ).scalars().all()
+            if not documents:
+                return requeued
+            # Por el ORM: mantiene los contadores del catálogo
+            for document in documents:
+                document.status = models.DocumentStatus.PROCESSING
+                document.processing_attempts = 0
+                document.processing_lease_until = None
+            db.commit()
+            requeued += len(documents)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Índice semántico de los documentos")
+    parser.add_argument("--reindex", action="store_true", help="Recalcula fragmentos sin embedding del embedder actual")
+    parser.add_argument("--all", action="store_true", help="Con --reindex, recalcula todos los documentos")
+    parser.add_argument("--requeue", action="store_true", help="Encola los documentos READY sin texto extraído")
+    parser.add_argument("--query", action="append", default=[], help="Consulta de prueba (se puede repetir)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--category", default=None)
+    args = parser.parse_args(argv)
+
+    if not (args.reindex or args.requeue or args.query):
+        parser.error("Indica --reindex, --requeue o --query")
+
+    if args.requeue:
+        print(f"Documentos encolados para extraer su texto: {requeue_missing_text()}")
+
+    if args.reindex:
+        print(f"Reindexando con el embedder {embedder_name()}...")
+        report = reindex(reindex_all=args.all)
+        print(f"{report.documents} documentos, {report.chunks} fragmentos en {report.elapsed_seconds:.1f} s")
+
+    if args.query:
+        result = search(args.query, args.top_k, args.category)
+        for item in result["results"]:
+            print(f"\n{item['query']}")
+            for hit in item["hits"]:
+                snippet = " ".join(hit["content"].split())[:120]
+                print(f"  {hit['score']:.3f}  {hit['document_name']} #{hit['chunk_index']}: {snippet}")
+        print(f"\n{result['indexed_chunks']} fragmentos indexados, {result['took_ms']} ms")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
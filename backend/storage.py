@@ -1,19 +1,38 @@
 """
 Servicio de almacenamiento en la nube para documentos.
-Soporta AWS S3 y Cloudflare R2.
+Soporta AWS S3, Cloudflare R2 y disco local (ver local_storage.py).
+
+El cliente se crea en el primer uso y no al importar el módulo: importar
+boto3 y crear el cliente toma cientos de milisegundos que antes se sumaban
+al arranque en frío de cada función de Vercel, aunque la petición no tocara
+el storage (p. ej. `/health` o el login). El cliente de boto3 es seguro
+entre threads, así que una sola instancia atiende todas las peticiones.
+
+Configuración del cliente S3/R2 (variables de entorno):
+- STORAGE_MAX_POOL_CONNECTIONS: conexiones HTTP reutilizables (por defecto
+  50; boto3 usa 10). Las peticiones que excedan el pool esperan un turno en
+  lugar de abrir conexiones que se descartan al terminar
+- STORAGE_POOL_TIMEOUT: segundos máximos de espera por un turno del pool;
+  después la petición sigue con una conexión extra (por defecto 30)
+- STORAGE_TCP_KEEPALIVE: keep-alive TCP en las conexiones (por defecto true)
+- STORAGE_CONNECT_TIMEOUT / STORAGE_READ_TIMEOUT: segundos (por defecto 5 / 60)
+- STORAGE_MAX_ATTEMPTS: intentos por petición, incluido el primero (por defecto 3)
+- STORAGE_RETRY_MODE: "standard" (por defecto), "adaptive" o "legacy"
 """
 
 import os
+import threading
+import time
 import uuid
-from typing import Tuple, Optional
-import boto3
-from botocore.exceptions import ClientError
-from botocore.config import Config
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple, Optional
+from botocore.exceptions import BotoCoreError, ClientError
 from fastapi import UploadFile, HTTPException
 import mimetypes
 
+from local_storage import LocalObjectStore
+
 # Variables de entorno para configuración
-STORAGE_PROVIDER = os.getenv("STORAGE_PROVIDER", "r2")  # "s3" o "r2"
+STORAGE_PROVIDER = os.getenv("STORAGE_PROVIDER", "r2")  # "s3", "r2" o "local"
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
@@ -25,9 +44,99 @@ R2_ACCESS_KEY_ID = os.getenv("R2_ACCESS_KEY_ID")
 R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
 R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME")
 
+# Cliente HTTP de S3/R2
+STORAGE_MAX_POOL_CONNECTIONS = max(1, int(os.getenv("STORAGE_MAX_POOL_CONNECTIONS", "50")))
+STORAGE_POOL_TIMEOUT = float(os.getenv("STORAGE_POOL_TIMEOUT", "30"))
+STORAGE_TCP_KEEPALIVE = os.getenv("STORAGE_TCP_KEEPALIVE", "true").lower() == "true"
+STORAGE_CONNECT_TIMEOUT = float(os.getenv("STORAGE_CONNECT_TIMEOUT", "5"))
+STORAGE_READ_TIMEOUT = float(os.getenv("STORAGE_READ_TIMEOUT", "60"))
+STORAGE_MAX_ATTEMPTS = max(1, int(os.getenv("STORAGE_MAX_ATTEMPTS", "3")))
+STORAGE_RETRY_MODE = os.getenv("STORAGE_RETRY_MODE", "standard")
+
 # Configuración de tipos de archivo permitidos
 ALLOWED_EXTENSIONS = {'.pdf', '.doc', '.docx', '.txt'}
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB en bytes
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE_MB", "10")) * 1024 * 1024  # en bytes
+
+# Subidas multipart: tamaño de cada parte (S3/R2 exigen al menos 5 MB salvo en
+# la última) y partes que se suben en paralelo por archivo
+UPLOAD_PART_SIZE = max(5, int(os.getenv("UPLOAD_PART_SIZE_MB", "8"))) * 1024 * 1024
+UPLOAD_PART_CONCURRENCY = max(1, int(os.getenv("UPLOAD_PART_CONCURRENCY", "4")))
+
+# Límite de partes de una subida multipart en S3/R2
+MAX_UPLOAD_PARTS = 10000
+
+# Máximo de keys por llamada a delete_objects (límite de la API de S3/R2)
+DELETE_BATCH_SIZE = 1000
+
+
+class ConnectionPoolGate:
+    """
+    Limita las peticiones simultáneas al storage al tamaño del pool de
+    conexiones del cliente y mide cuánto espera cada una por un turno.
+
+    Con el pool lleno urllib3 no espera: abre una conexión extra y la
+    descarta al terminar (un handshake TLS más por petición). Se engancha a
+    los eventos `before-send` / `response-received` de botocore, que ocurren
+    en el mismo thread que hace la petición (una vez por intento).
+    """
+
+    def __init__(self, size: int = STORAGE_MAX_POOL_CONNECTIONS, timeout: float = STORAGE_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_use = 0
+        self.waited = 0
+        self.timeouts = 0
+        self.wait_total_seconds = 0.0
+        self.wait_max_seconds = 0.0
+
+    def register(self, client) -> None:
+        client.meta.events.register("before-send.s3", self._acquire)
+        client.meta.events.register("response-received.s3", self._release)
+
+    def _acquire(self, **kwargs) -> None:
+        # Si el intento anterior de este thread terminó sin `response-received`, liberar su turno
+        self._release()
+        started = time.perf_counter()
+        acquired = self._semaphore.acquire(blocking=False)
+        waited = not acquired
+        if waited:
+            acquired = self._semaphore.acquire(timeout=self.timeout)
+        wait_seconds = time.perf_counter() - started
+        with self._lock:
+            self.requests += 1
+            self.wait_total_seconds += wait_seconds
+            self.wait_max_seconds = max(self.wait_max_seconds, wait_seconds)
+            if waited:
+                self.waited += 1
+            if acquired:
+                self.in_use += 1
+            else:
+                self.timeouts += 1
+        self._local.held = acquired
+        # Retorna None: botocore envía la petición normalmente
+
+    def _release(self, **kwargs) -> None:
+        if getattr(self._local, "held", False):
+            self._local.held = False
+            with self._lock:
+                self.in_use -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "max_pool_connections": self.size,
+                "in_use": self.in_use,
+                "requests": self.requests,
+                "waited": self.waited,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(1000 * self.wait_total_seconds / self.requests, 3) if self.requests else 0.0,
+                "wait_max_ms": round(1000 * self.wait_max_seconds, 3),
+            }
 
 
 class StorageService:
@@ -35,24 +144,76 @@ class StorageService:
     
     def __init__(self):
         self.provider = STORAGE_PROVIDER
-        self.client = self._init_client()
-        self.bucket_name = self._get_bucket_name()
+        self.pool_gate = ConnectionPoolGate()
+        self.client_init_seconds: Optional[float] = None
+        self._client = None
+        self._bucket_name: Optional[str] = None
+        self._transfer_config = None
+        self._client_lock = threading.Lock()
+    
+    @property
+    def client(self):
+        """Cliente del storage: se crea en el primer uso y lo comparten todos los threads"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    client = self._init_client()
+                    self.client_init_seconds = time.perf_counter() - started
+                    self._client = client
+        return self._client
+    
+    @client.setter
+    def client(self, client):
+        with self._client_lock:
+            self._client = client
+    
+    @property
+    def bucket_name(self) -> str:
+        if self._bucket_name is None:
+            self._bucket_name = self._get_bucket_name()
+        return self._bucket_name
+    
+    @property
+    def transfer_config(self):
+        """Configuración de `upload_fileobj`: multipart a partir de una parte"""
+        if self._transfer_config is None:
+            from boto3.s3.transfer import TransferConfig
+            self._transfer_config = TransferConfig(
+                multipart_threshold=UPLOAD_PART_SIZE,
+                multipart_chunksize=UPLOAD_PART_SIZE,
+                max_concurrency=UPLOAD_PART_CONCURRENCY
+            )
+        return self._transfer_config
+    
+    def _client_config(self):
+        """Pool de conexiones, keep-alive, timeouts y reintentos del cliente S3/R2"""
+        from botocore.config import Config
+        return Config(
+            signature_version='s3v4',
+            max_pool_connections=STORAGE_MAX_POOL_CONNECTIONS,
+            tcp_keepalive=STORAGE_TCP_KEEPALIVE,
+            connect_timeout=STORAGE_CONNECT_TIMEOUT,
+            read_timeout=STORAGE_READ_TIMEOUT,
+            retries={'total_max_attempts': STORAGE_MAX_ATTEMPTS, 'mode': STORAGE_RETRY_MODE}
+        )
     
     def _init_client(self):
-        """Inicializa el cliente de S3 o R2"""
-        if self.provider == "r2":
+        """Inicializa el cliente de S3 o R2 (o el storage en disco)"""
+        if self.provider == "local":
+            # Misma interfaz que el cliente de boto3, sin credenciales
+            return LocalObjectStore()
+        elif self.provider == "r2":
             # Cloudflare R2 es compatible con S3, pero usa un endpoint diferente
             if not all([R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY]):
                 raise ValueError("Faltan credenciales de Cloudflare R2 en variables de entorno")
             
             endpoint_url = f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com"
             
-            return boto3.client(
-                's3',
+            client_kwargs = dict(
                 endpoint_url=endpoint_url,
                 aws_access_key_id=R2_ACCESS_KEY_ID,
                 aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-                config=Config(signature_version='s3v4'),
                 region_name='auto'
             )
         else:
@@ -60,17 +221,24 @@ class StorageService:
             if not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY]):
                 raise ValueError("Faltan credenciales de AWS S3 en variables de entorno")
             
-            return boto3.client(
-                's3',
+            client_kwargs = dict(
                 aws_access_key_id=AWS_ACCESS_KEY_ID,
                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                region_name=AWS_REGION,
-                config=Config(signature_version='s3v4')
+                region_name=AWS_REGION
             )
+        
+        # boto3 tarda en importarse: solo se carga cuando se usa S3/R2. Una
+        # Session propia porque la sesión por defecto no es segura entre threads
+        import boto3
+        client = boto3.session.Session().client('s3', config=self._client_config(), **client_kwargs)
+        self.pool_gate.register(client)
+        return client
     
     def _get_bucket_name(self) -> str:
         """Obtiene el nombre del bucket según el proveedor"""
-        if self.provider == "r2":
+        if self.provider == "local":
+            return str(self.client.root)
+        elif self.provider == "r2":
             if not R2_BUCKET_NAME:
                 raise ValueError("R2_BUCKET_NAME no configurado")
             return R2_BUCKET_NAME
@@ -79,27 +247,42 @@ class StorageService:
                 raise ValueError("S3_BUCKET_NAME no configurado")
             return S3_BUCKET_NAME
     
-    def _validate_file(self, file: UploadFile) -> None:
-        """Valida el archivo antes de subirlo"""
+    def stats(self) -> dict:
+        """Arranque del cliente y uso del pool de conexiones (útil para monitoreo)"""
+        data = {
+            "provider": self.provider,
+            "client_initialized": self._client is not None,
+            "client_init_ms": round(1000 * self.client_init_seconds, 3) if self.client_init_seconds is not None else None,
+        }
+        if self.provider != "local":
+            data["pool"] = self.pool_gate.snapshot()
+        return data
+    
+    def validate_upload(self, filename: str, file_size: int) -> None:
+        """Valida la extensión y el tamaño de un archivo a subir"""
         # Verificar extensión
-        file_ext = os.path.splitext(file.filename)[1].lower()
+        file_ext = os.path.splitext(filename)[1].lower()
         if file_ext not in ALLOWED_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
                 detail=f"Tipo de archivo no permitido. Extensiones permitidas: {', '.join(ALLOWED_EXTENSIONS)}"
             )
         
-        # Verificar tamaño (FastAPI ya valida esto con File, pero doble verificación)
-        file.file.seek(0, 2)  # Ir al final del archivo
-        file_size = file.file.tell()
-        file.file.seek(0)  # Volver al inicio
-        
         if file_size > MAX_FILE_SIZE:
             raise HTTPException(
                 status_code=400,
                 detail=f"El archivo es demasiado grande. Tamaño máximo: {MAX_FILE_SIZE / 1024 / 1024} MB"
             )
     
+    def _validate_file(self, file: UploadFile) -> None:
+        """Valida el archivo antes de subirlo"""
+        # Verificar tamaño (FastAPI ya valida esto con File, pero doble verificación)
+        file.file.seek(0, 2)  # Ir al final del archivo
+        file_size = file.file.tell()
+        file.file.seek(0)  # Volver al inicio
+        
+        self.validate_upload(file.filename, file_size)
+    
     def _generate_storage_key(self, filename: str) -> str:
         """Genera una key única para el storage"""
         file_ext = os.path.splitext(filename)[1].lower()
@@ -139,7 +322,8 @@ class StorageService:
                     'Metadata': {
                         'original-filename': file.filename
                     }
-                }
+                },
+                Config=self.transfer_config
             )
             
             # Generar URL pública
@@ -160,7 +344,10 @@ class StorageService:
     
     def _generate_public_url(self, storage_key: str) -> str:
         """Genera la URL pública del archivo"""
-        if self.provider == "r2":
+        if self.provider == "local":
+            # Ruta de la API que sirve el archivo (la descarga exige una URL firmada)
+            return self.client.object_url(storage_key)
+        elif self.provider == "r2":
             # Para R2, necesitas configurar un dominio público o usar URL firmadas
             # Por ahora, retornamos la URL del endpoint
             return f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com/{self.bucket_name}/{storage_key}"
@@ -182,6 +369,311 @@ class StorageService:
                 detail=f"Error al eliminar archivo: {str(e)}"
             )
     
+    def delete_files(self, storage_keys: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Elimina muchos archivos con `delete_objects`, en lotes de hasta
+        DELETE_BATCH_SIZE keys (una petición por lote en lugar de una por archivo).
+        
+        Returns:
+            Dict[str, Optional[str]]: key -> None si se eliminó, o el mensaje de error
+        """
+        keys = list(dict.fromkeys(storage_keys))
+        results: Dict[str, Optional[str]] = {}
+        
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[start:start + DELETE_BATCH_SIZE]
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        'Objects': [{'Key': key} for key in batch],
+                        'Quiet': True
+                    }
+                )
+            except (ClientError, BotoCoreError) as e:
+                # Falló el lote completo (p. ej. sin conexión con el storage)
+                for key in batch:
+                    results[key] = str(e)
+                continue
+            
+            for key in batch:
+                results[key] = None
+            # En modo Quiet la respuesta solo lista los errores
+            for error in response.get('Errors', []):
+                results[error['Key']] = f"{error.get('Code')}: {error.get('Message')}"
+        
+        return results
+    
+    def iter_object_pages(self, prefix: str = "", page_size: int = 1000) -> Iterator[List[dict]]:
+        """
+        Lista los objetos bajo `prefix` página a página con `list_objects_v2`
+        (a lo sumo `page_size` objetos en memoria a la vez).
+        
+        Yields:
+            List[dict]: objetos de la página ({Key, Size, LastModified})
+        """
+        kwargs = {'Bucket': self.bucket_name, 'Prefix': prefix, 'MaxKeys': page_size}
+        while True:
+            try:
+                response = self.client.list_objects_v2(**kwargs)
+            except (ClientError, BotoCoreError) as e:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error al listar archivos: {str(e)}"
+                )
+            page = [
+                {'Key': item['Key'], 'Size': item['Size'], 'LastModified': item['LastModified']}
+                for item in response.get('Contents', [])
+            ]
+            if page:
+                yield page
+            if not response.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+    
+    def download_file(self, storage_key: str, fileobj: BinaryIO) -> None:
+        """Descarga un archivo del storage a `fileobj` y deja el cursor al inicio"""
+        try:
+            self.client.download_fileobj(self.bucket_name, storage_key, fileobj, Config=self.transfer_config)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise HTTPException(
+                    status_code=404,
+                    detail="Archivo no encontrado en el storage"
+                )
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al descargar archivo: {str(e)}"
+            )
+        fileobj.seek(0)
+    
+    def object_exists(self, storage_key: str) -> Optional[bool]:
+        """True/False según HEAD, o None si no se pudo verificar (error del storage)"""
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=storage_key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            return None
+        except BotoCoreError:
+            return None
+    
+    def prepare_direct_upload(self, filename: str, content_type: Optional[str], expiration: int = 900) -> Tuple[str, dict]:
+        """
+        Genera la key y una URL firmada (PUT) para que el cliente suba el
+        archivo directamente al bucket, sin pasar por la API. R2 no soporta
+        POST firmado, así que se usa PUT en ambos proveedores.
+        
+        Returns:
+            Tuple[str, dict]: (storage_key, {"url", "method", "headers"})
+        """
+        storage_key = self._generate_storage_key(filename)
+        content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        try:
+            url = self.client.generate_presigned_url(
+                'put_object',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': storage_key,
+                    'ContentType': content_type
+                },
+                ExpiresIn=expiration
+            )
+        except ClientError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al generar URL de subida: {str(e)}"
+            )
+        # El cliente debe enviar el mismo Content-Type que se firmó
+        return storage_key, {"url": url, "method": "PUT", "headers": {"Content-Type": content_type}}
+    
+    def generate_storage_key(self, filename: str) -> str:
+        """Key única para un archivo nuevo (ver `_generate_storage_key`)"""
+        return self._generate_storage_key(filename)
+    
+    def public_url(self, storage_key: str) -> str:
+        """URL pública de un archivo (ver `_generate_public_url`)"""
+        return self._generate_public_url(storage_key)
+    
+    def put_file(self, storage_key: str, data: bytes, filename: str, content_type: Optional[str]) -> None:
+        """Sube un archivo pequeño (menos de una parte) en una sola petición"""
+        content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        try:
+            self.client.put_object(
+                Bucket=self.bucket_name,
+                Key=storage_key,
+                Body=data,
+                ContentType=content_type,
+                Metadata={'original-filename': filename}
+            )
+        except ClientError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al subir archivo: {str(e)}"
+            )
+    
+    def start_multipart_upload(self, storage_key: str, filename: str, content_type: Optional[str]) -> str:
+        """
+        Inicia una subida multipart.
+        
+        Returns:
+            str: UploadId (permite retomar la subida subiendo solo las partes que falten)
+        """
+        content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        try:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=storage_key,
+                ContentType=content_type,
+                Metadata={'original-filename': filename}
+            )
+            return response['UploadId']
+        except ClientError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al iniciar la subida: {str(e)}"
+            )
+    
+    def upload_part(self, storage_key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+        """Sube una parte y retorna la referencia que exige `complete_multipart_upload`"""
+        try:
+            response = self.client.upload_part(
+                Bucket=self.bucket_name,
+                Key=storage_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except ClientError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al subir la parte {part_number}: {str(e)}"
+            )
+    
+    def list_uploaded_parts(self, storage_key: str, upload_id: str) -> List[dict]:
+        """Partes ya subidas de una subida multipart ({PartNumber, ETag, Size}), en orden"""
+        parts = []
+        kwargs = {'Bucket': self.bucket_name, 'Key': storage_key, 'UploadId': upload_id}
+        try:
+            while True:
+                response = self.client.list_parts(**kwargs)
+                parts.extend(
+                    {'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']}
+                    for part in response.get('Parts', [])
+                )
+                if not response.get('IsTruncated'):
+                    return parts
+                kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+                raise HTTPException(
+                    status_code=404,
+                    detail="La subida no existe, ya se completó o fue cancelada"
+                )
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al consultar la subida: {str(e)}"
+            )
+    
+    def generate_presigned_part_url(self, storage_key: str, upload_id: str, part_number: int,
+                                    expiration: int = 900) -> str:
+        """URL firmada para que el cliente suba una parte directamente al bucket"""
+        try:
+            return self.client.generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': storage_key,
+                    'UploadId': upload_id,
+                    'PartNumber': part_number
+                },
+                ExpiresIn=expiration
+            )
+        except ClientError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al generar URL de subida: {str(e)}"
+            )
+    
+    def complete_multipart_upload(self, storage_key: str, upload_id: str,
+                                  parts: Optional[List[dict]] = None) -> None:
+        """
+        Une las partes en el objeto final. Sin `parts` se usan las que ya
+        están en el bucket (subidas directas desde el cliente).
+        """
+        if parts is None:
+            parts = self.list_uploaded_parts(storage_key, upload_id)
+        if not parts:
+            raise HTTPException(
+                status_code=400,
+                detail="El archivo todavía no se ha subido al storage"
+            )
+        try:
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=storage_key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    'Parts': [
+                        {'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+                        for part in sorted(parts, key=lambda part: part['PartNumber'])
+                    ]
+                }
+            )
+        except ClientError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al completar la subida: {str(e)}"
+            )
+    
+    def abort_multipart_upload(self, storage_key: str, upload_id: str) -> None:
+        """Cancela una subida multipart y libera las partes ya subidas"""
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=storage_key,
+                UploadId=upload_id
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error al cancelar la subida: {str(e)}"
+                )
+    
+    def confirm_direct_upload(self, storage_key: str) -> Tuple[str, int]:
+        """
+        Confirma con HEAD que el cliente subió el archivo y valida su tamaño
+        real. Si excede MAX_FILE_SIZE el objeto se elimina.
+        
+        Returns:
+            Tuple[str, int]: (storage_url, file_size)
+        """
+        try:
+            head = self.client.head_object(Bucket=self.bucket_name, Key=storage_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise HTTPException(
+                    status_code=400,
+                    detail="El archivo todavía no se ha subido al storage"
+                )
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al verificar archivo: {str(e)}"
+            )
+        
+        file_size = head['ContentLength']
+        if file_size > MAX_FILE_SIZE:
+            self.delete_file(storage_key)
+            raise HTTPException(
+                status_code=400,
+                detail=f"El archivo es demasiado grande. Tamaño máximo: {MAX_FILE_SIZE / 1024 / 1024} MB"
+            )
+        
+        return self._generate_public_url(storage_key), file_size
+    
     def generate_presigned_url(self, storage_key: str, expiration: int = 3600) -> str:
         """
         Genera una URL firmada temporalmente para descargar el archivo.
@@ -0,0 +1,218 @@
+"""
+Tags normalizados de los documentos.
+
+`Document.tags` es texto separado por comas: filtrar por tag solo podía ser
+un recorrido con LIKE y contar documentos por tag obligaba a leer todas las
+filas. Aquí se mantiene un índice normalizado:
+
+- `tags`: un registro por tag (nombre en minúsculas) con `document_count`
+- `document_tags`: relación documento <-> tag, indexada en ambos sentidos
+
+La tabla se sincroniza desde listeners de la Session en la misma transacción
+que crea, edita o elimina el documento, así que `PUT /api/documents/{id}`
+con `tags` mantiene el índice al día sin código adicional. `Document.tags`
+conserva el texto original que ve el usuario.
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, delete, event, func, insert, inspect, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Longitud máxima de un tag normalizado
+MAX_TAG_LENGTH = 50
+
+# Documentos por lote al reconstruir el índice
+_REBUILD_BATCH_SIZE = 500
+
+_tags = models.Tag.__table__
+_document_tags = models.DocumentTag.__table__
+
+
+def normalize_tag(raw: str) -> str:
+    """Minúsculas, sin espacios repetidos ni en los extremos"""
+    return re.sub(r"\s+", " ", raw).strip().lower()[:MAX_TAG_LENGTH]
+
+
+def parse_tags(raw: Optional[str]) -> List[str]:
+    """Tags normalizados y sin duplicados de un texto separado por comas"""
+    if not raw:
+        return []
+    names = []
+    for part in raw.split(","):
+        name = normalize_tag(part)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+# ============================================================================
+# SINCRONIZACIÓN DEL ÍNDICE
+# ============================================================================
+
+def _tag_ids(connection, names: Iterable[str]) -> Dict[str, int]:
+    """Crea los tags que falten y retorna {nombre: id}"""
+    names = sorted(set(names))
+    if not names:
+        return {}
+
+    dialect_name = connection.dialect.name
+    if dialect_name in ("postgresql", "sqlite"):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        connection.execute(
+            dialect_insert(_tags).on_conflict_do_nothing(index_elements=[_tags.c.name]),
+            [{"name": name, "document_count": 0} for name in names]
+        )
+        rows = connection.execute(select(_tags.c.name, _tags.c.id).where(_tags.c.name.in_(names))).all()
+        return {name: tag_id for name, tag_id in rows}
+
+    # Dialecto sin ON CONFLICT: insertar solo los que no existan
+    rows = connection.execute(select(_tags.c.name, _tags.c.id).where(_tags.c.name.in_(names))).all()
+    ids = {name: tag_id for name, tag_id in rows}
+    missing = [name for name in names if name not in ids]
+    if missing:
+        connection.execute(insert(_tags), [{"name": name, "document_count": 0} for name in missing])
+        rows = connection.execute(select(_tags.c.name, _tags.c.id).where(_tags.c.name.in_(missing))).all()
+        ids.update({name: tag_id for name, tag_id in rows})
+    return ids
+
+
+def sync_document_tags(connection, tags_by_document: Dict[int, List[str]]) -> None:
+    """
+    Deja en `document_tags` exactamente los tags indicados para cada documento
+    (lista vacía = sin tags) y ajusta `tags.document_count` con la diferencia.
+    """
+    if not tags_by_document:
+        return
+
+    current = {document_id: set() for document_id in tags_by_document}
+    for document_id, tag_id in connection.execute(
+        select(_document_tags.c.document_id, _document_tags.c.tag_id)
+        .where(_document_tags.c.document_id.in_(list(tags_by_document)))
+    ):
+        current[document_id].add(tag_id)
+
+    ids = _tag_ids(connection, (name for names in tags_by_document.values() for name in names))
+
+    to_insert, to_delete = [], []
+    deltas = Counter()
+    for document_id, names in tags_by_document.items():
+        wanted = {ids[name] for name in names}
+        for tag_id in wanted - current[document_id]:
+            to_insert.append({"document_id": document_id, "tag_id": tag_id})
+            deltas[tag_id] += 1
+        for tag_id in current[document_id] - wanted:
+            to_delete.append({"d": document_id, "t": tag_id})
+            deltas[tag_id] -= 1
+
+    if to_delete:
+        connection.execute(
+            delete(_document_tags).where(
+                _document_tags.c.document_id == bindparam("d"),
+                _document_tags.c.tag_id == bindparam("t")
+            ),
+            to_delete
+        )
+    if to_insert:
+        connection.execute(insert(_document_tags), to_insert)
+
+    changed = [{"t": tag_id, "delta": delta} for tag_id, delta in sorted(deltas.items()) if delta]
+    if changed:
+        connection.execute(
+            update(_tags)
+            .where(_tags.c.id == bindparam("t"))
+            .values(document_count=_tags.c.document_count + bindparam("delta")),
+            changed
+        )
+
+
+@event.listens_for(Session, "before_flush")
+def _untag_deleted_documents(session: Session, flush_context, instances) -> None:
+    """Quita los tags de los documentos eliminados antes de borrar la fila"""
+    removed = {
+        obj.id: [] for obj in session.deleted
+        if isinstance(obj, models.Document) and obj.id is not None
+    }
+    if removed:
+        sync_document_tags(session.connection(), removed)
+
+
+@event.listens_for(Session, "after_flush")
+def _tag_written_documents(session: Session, flush_context) -> None:
+    """Indexa los tags de los documentos nuevos o con `tags` modificado (ya tienen id)"""
+    changed = {}
+    for obj in session.new:
+        if isinstance(obj, models.Document) and obj.tags:
+            changed[obj.id] = parse_tags(obj.tags)
+    for obj in session.dirty:
+        if isinstance(obj, models.Document) and obj not in session.deleted \
+                and inspect(obj).attrs.tags.history.has_changes():
+            changed[obj.id] = parse_tags(obj.tags)
+    if changed:
+        sync_document_tags(session.connection(), changed)
+
+
+def rebuild_document_tags(connection) -> None:
+    """Reconstruye `document_tags` y los conteos a partir de `Document.tags`"""
+    connection.execute(delete(_document_tags))
+    connection.execute(update(_tags).values(document_count=0))
+
+    batch = {}
+    rows = connection.execute(
+        select(models.Document.id, models.Document.tags).where(models.Document.tags.isnot(None))
+    ).all()
+    for document_id, raw in rows:
+        batch[document_id] = parse_tags(raw)
+        if len(batch) >= _REBUILD_BATCH_SIZE:
+            sync_document_tags(connection, batch)
+            batch = {}
+    sync_document_tags(connection, batch)
+
+
+def ensure_document_tags(bind) -> None:
+    """
+    Llena el índice de tags en bases de datos que ya tenían documentos con
+    tags antes de existir `document_tags` (se llama al arrancar).
+    """
+    with bind.begin() as conn:
+        has_links = conn.execute(select(_document_tags.c.document_id).limit(1)).first() is not None
+        has_tagged = conn.execute(
+            select(models.Document.id).where(models.Document.tags.isnot(None), models.Document.tags != "").limit(1)
+        ).first() is not None
+        if has_tagged and not has_links:
+            rebuild_document_tags(conn)
+
+
+# ============================================================================
+# CONSULTAS
+# ============================================================================
+
+def tag_filter(names: List[str], match_all: bool = False):
+    """
+    Condición WHERE para documentos con alguno (OR) o todos (AND) de los tags.
+    Se resuelve con el índice (tag_id, document_id), sin leer `Document.tags`.
+    """
+    matching = (
+        select(_document_tags.c.document_id)
+        .join(_tags, _tags.c.id == _document_tags.c.tag_id)
+        .where(_tags.c.name.in_(names))
+    )
+    if match_all and len(names) > 1:
+        matching = matching.group_by(_document_tags.c.document_id).having(func.count() == len(names))
+    return models.Document.id.in_(matching)
+
+
+def tag_counts(db: Session, prefix: Optional[str] = None, limit: int = 100) -> List[dict]:
+    """Tags con al menos un documento, ordenados por número de documentos"""
+    stmt = select(_tags.c.name, _tags.c.document_count).where(_tags.c.document_count > 0)
+    if prefix:
+        stmt = stmt.where(_tags.c.name.startswith(normalize_tag(prefix), autoescape=True))
+    stmt = stmt.order_by(_tags.c.document_count.desc(), _tags.c.name).limit(limit)
+    return [{"name": name, "count": count} for name, count in db.execute(stmt)]
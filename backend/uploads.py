@@ -0,0 +1,351 @@
+"""
+Pool dedicado para subir documentos al storage sin bloquear el event loop.
+
+`storage_service.upload_file` es bloqueante de principio a fin: el `seek` /
+`tell` de la validación sobre el archivo temporal y el `upload_fileobj` de
+boto3 hacia R2/S3. Ejecutado dentro de un endpoint `async def`, una sola
+subida lenta detiene todas las demás peticiones del worker.
+
+Aquí las subidas se ejecutan en un pool de threads acotado (independiente
+del threadpool de FastAPI, que siguen usando las lecturas):
+- UPLOAD_WORKERS: subidas simultáneas hacia el storage (por defecto 4)
+- UPLOAD_MAX_PENDING: subidas en cola + en ejecución antes de responder 503
+- UPLOAD_RETRY_AFTER_SECONDS: valor del header Retry-After del 503
+
+Igual que el pool de hashing (ver hashing.py), cuando la cola está llena la
+subida se rechaza de inmediato en lugar de acumular archivos en memoria y
+en disco mientras esperan turno.
+
+Subida directa al bucket (sin pasar los bytes por la API):
+1. `initiate`: valida nombre y tamaño y entrega una URL PUT firmada junto con
+   un ticket (JWT firmado con la SECRET_KEY) que identifica la subida
+2. El cliente sube el archivo directamente a R2/S3
+3. `finalize`: con el ticket se confirma el objeto con HEAD y se crea el documento
+
+El ticket evita guardar estado de las subidas pendientes en el servidor.
+- UPLOAD_URL_EXPIRE_SECONDS: validez de la URL firmada y del ticket (por defecto 900)
+
+Archivos grandes (hasta MAX_FILE_SIZE_MB, ver storage.py):
+- Streaming a través de la API (`stream_upload`): el cuerpo de la petición se
+  lee por fragmentos, se cuenta y se hashea (SHA-256) mientras llega y se
+  sube en partes de UPLOAD_PART_SIZE_MB, con hasta UPLOAD_PART_CONCURRENCY
+  partes en vuelo. La memoria por petición queda acotada a unas pocas partes
+  y el archivo nunca se escribe completo en disco.
+- Multipart directo al bucket: el ticket lleva el UploadId y sirve durante
+  UPLOAD_RESUME_HOURS para pedir URLs de las partes que falten y retomar
+  una subida interrumpida.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import AsyncIterator, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile, status
+
+import dedup
+from auth import Principal, create_access_token, decode_access_token
+from storage import MAX_FILE_SIZE, UPLOAD_PART_CONCURRENCY, UPLOAD_PART_SIZE, storage_service
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+# Subidas simultáneas hacia el storage
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+
+# Máximo de subidas pendientes (en cola + en ejecución)
+UPLOAD_MAX_PENDING = int(os.getenv("UPLOAD_MAX_PENDING", str(UPLOAD_WORKERS * 4)))
+
+# Segundos sugeridos al cliente en el header Retry-After cuando el pool está lleno
+UPLOAD_RETRY_AFTER_SECONDS = int(os.getenv("UPLOAD_RETRY_AFTER_SECONDS", "5"))
+
+# Validez de la URL firmada de subida directa y de su ticket
+UPLOAD_URL_EXPIRE_SECONDS = int(os.getenv("UPLOAD_URL_EXPIRE_SECONDS", "900"))
+
+# Validez del ticket de una subida multipart directa (para retomarla)
+UPLOAD_RESUME_HOURS = int(os.getenv("UPLOAD_RESUME_HOURS", "24"))
+
+# Valor del claim `typ` de los tickets de subida
+_UPLOAD_TICKET_TYPE = "upload"
+
+
+class UploadExecutor:
+    """
+    Pool de threads acotado para las subidas al storage.
+
+    El pool se crea en el primer uso y limita las subidas pendientes: al
+    alcanzar `max_pending` la subida se rechaza con un 503.
+    """
+
+    def __init__(self, workers: int = UPLOAD_WORKERS, max_pending: int = UPLOAD_MAX_PENDING):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Crea el pool de forma perezosa"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="upload"
+                )
+            return self._executor
+
+    def _reserve_slot(self) -> None:
+        """Reserva un cupo en la cola o rechaza con 503 si está llena"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="El servidor está procesando demasiadas subidas. Intenta de nuevo en unos segundos.",
+                    headers={"Retry-After": str(UPLOAD_RETRY_AFTER_SECONDS)}
+                )
+            self._pending += 1
+
+    def _release_slot(self, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    def _tracked(self, fn, *args):
+        """Ejecuta `fn` contando las subidas en curso (ya en un worker del pool)"""
+        with self._lock:
+            self._active += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    @contextmanager
+    def reserve(self):
+        """
+        Ocupa un cupo durante toda una subida por streaming (que luego envía
+        sus partes con `run_part`). Rechaza con 503 si la cola está llena.
+        """
+        self._reserve_slot()
+        with self._lock:
+            self._active += 1
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._pending -= 1
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+
+    async def run_part(self, fn, *args):
+        """
+        Ejecuta una parte de una subida ya admitida con `reserve` (no cuenta
+        contra el límite de cola; comparte los workers con las demás subidas).
+        """
+        return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+
+    async def run(self, fn, *args):
+        """
+        Ejecuta `fn` en el pool sin bloquear el event loop.
+
+        Raises:
+            HTTPException: 503 si la cola de subidas está llena
+        """
+        self._reserve_slot()
+        try:
+            future = self._get_executor().submit(self._tracked, fn, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._release_slot)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        """Estado actual del pool (útil para monitoreo)"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "active": self._active,
+                "queued": self._pending - self._active,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self) -> None:
+        """Espera las subidas en curso y libera los threads"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# Instancia global del ejecutor
+upload_executor = UploadExecutor()
+
+
+async def upload_file(file: UploadFile) -> Tuple[str, str, int]:
+    """Versión asíncrona de `storage_service.upload_file` ejecutada en el pool de subidas"""
+    return await upload_executor.run(storage_service.upload_file, file)
+
+
+def _validated_hash(file: UploadFile) -> Tuple[str, int]:
+    content_hash, file_size = dedup.hash_file(file.file)
+    storage_service.validate_upload(file.filename, file_size)
+    return content_hash, file_size
+
+
+async def hash_upload(file: UploadFile) -> Tuple[str, int]:
+    """Valida y calcula el SHA-256 de un archivo recibido, en el pool de subidas"""
+    return await upload_executor.run(_validated_hash, file)
+
+
+async def stream_upload(
+    chunks: AsyncIterator[bytes],
+    filename: str,
+    content_type: Optional[str],
+    expected_sha256: Optional[str] = None
+) -> Tuple[str, str, int, str]:
+    """
+    Sube al storage un archivo que llega por fragmentos, validando tamaño y
+    calculando el SHA-256 mientras llega. Hasta una parte se sube con un solo
+    PUT; por encima, en multipart con UPLOAD_PART_CONCURRENCY partes en vuelo.
+    Si algo falla, la subida multipart se cancela.
+    
+    Returns:
+        Tuple[str, str, int, str]: (storage_url, storage_key, file_size, sha256)
+    """
+    storage_service.validate_upload(filename, 0)
+    storage_key = storage_service.generate_storage_key(filename)
+    hasher = hashlib.sha256()
+    file_size = 0
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+    in_flight = asyncio.Semaphore(UPLOAD_PART_CONCURRENCY)
+    tasks = []
+
+    async def send_part(part_number: int, data: bytes) -> None:
+        try:
+            parts.append(await upload_executor.run_part(
+                storage_service.upload_part, storage_key, upload_id, part_number, data
+            ))
+        finally:
+            in_flight.release()
+
+    async def flush(data: bytes) -> None:
+        nonlocal upload_id
+        if upload_id is None:
+            upload_id = await upload_executor.run_part(
+                storage_service.start_multipart_upload, storage_key, filename, content_type
+            )
+        # Esperar cupo antes de leer más del cliente: acota la memoria por petición
+        await in_flight.acquire()
+        tasks.append(asyncio.create_task(send_part(len(tasks) + 1, data)))
+
+    with upload_executor.reserve():
+        try:
+            async for chunk in chunks:
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    storage_service.validate_upload(filename, file_size)
+                hasher.update(chunk)
+                buffer.extend(chunk)
+                if len(buffer) >= UPLOAD_PART_SIZE:
+                    await flush(bytes(buffer[:UPLOAD_PART_SIZE]))
+                    del buffer[:UPLOAD_PART_SIZE]
+                # Propagar cuanto antes el error de una parte ya enviada
+                for task in tasks:
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+
+            sha256 = hasher.hexdigest()
+            if expected_sha256 and expected_sha256.lower() != sha256:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="El SHA-256 del archivo recibido no coincide con el declarado"
+                )
+
+            if upload_id is None:
+                await upload_executor.run_part(
+                    storage_service.put_file, storage_key, bytes(buffer), filename, content_type
+                )
+            else:
+                if buffer:
+                    await flush(bytes(buffer))
+                await asyncio.gather(*tasks)
+                await upload_executor.run_part(
+                    storage_service.complete_multipart_upload, storage_key, upload_id, parts
+                )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if upload_id is not None:
+                await upload_executor.run_part(storage_service.abort_multipart_upload, storage_key, upload_id)
+            raise
+
+    return storage_service.public_url(storage_key), storage_key, file_size, sha256
+
+
+def create_upload_ticket(
+    storage_key: str,
+    filename: str,
+    principal: Optional[Principal],
+    upload_id: Optional[str] = None,
+    part_count: Optional[int] = None
+) -> str:
+    """
+    Ticket firmado de una subida directa. No lleva `sub` ni `role`, así que
+    no sirve como token de acceso. Con `upload_id` (multipart) dura
+    UPLOAD_RESUME_HOURS para poder retomar la subida.
+    """
+    data = {
+        "typ": _UPLOAD_TICKET_TYPE,
+        "key": storage_key,
+        "name": filename,
+        "uploaded_by": principal.user_id if principal else None,
+        "uploaded_by_type": principal.role if principal else None,
+    }
+    expires = timedelta(seconds=UPLOAD_URL_EXPIRE_SECONDS)
+    if upload_id:
+        data.update({"upload_id": upload_id, "parts": part_count})
+        expires = timedelta(hours=UPLOAD_RESUME_HOURS)
+    return create_access_token(data=data, expires_delta=expires)
+
+
+def read_upload_ticket(token: str) -> dict:
+    """
+    Valida un ticket de `create_upload_ticket`.
+
+    Raises:
+        HTTPException: 400 si el ticket es inválido o expiró
+    """
+    payload = decode_access_token(token)
+    if not payload or payload.get("typ") != _UPLOAD_TICKET_TYPE or not payload.get("key"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Ticket de subida inválido o expirado"
+        )
+    return payload
@@ -3,6 +3,7 @@ import { Button } from './ui/button';
 import { Input } from './ui/input';
 import { ScrollArea } from './ui/scroll-area';
 import { Send, Bot, User } from 'lucide-react';
+import { api, authUtils, SemanticHit } from '@/lib/api';
 
 interface Message {
   id: string;
@@ -46,17 +47,33 @@ export function ChatInterface() {
     setInputValue('');
     setIsTyping(true);
 
-    // Simular respuesta del bot
-    setTimeout(() => {
-      const botResponse: Message = {
-        id: (Date.now() + 1).toString(),
-        content: generateBotResponse(messageContent),
-        sender: 'bot',
-        timestamp: new Date()
-      };
-      setMessages(prev => [...prev, botResponse]);
-      setIsTyping(false);
-    }, 1500);
+    // Responder con los fragmentos de la base de conocimiento más parecidos a la consulta
+    let content: string;
+    try {
+      const result = await api.semanticSearch([messageContent], { topK: 3 }, authUtils.getToken() || undefined);
+      const hits = result.results[0]?.hits.filter(hit => hit.score > 0) ?? [];
+      content = hits.length > 0 ? formatRetrievedAnswer(hits) : generateBotResponse(messageContent);
+    } catch {
+      content = generateBotResponse(messageContent);
+    }
+
+    const botResponse: Message = {
+      id: (Date.now() + 1).toString(),
+      content,
+      sender: 'bot',
+      timestamp: new Date()
+    };
+    setMessages(prev => [...prev, botResponse]);
+    setIsTyping(false);
+  };
+
+  const formatRetrievedAnswer = (hits: SemanticHit[]): string => {
+    const excerpts = hits.map(hit => {
+      const excerpt = hit.content.replace(/\s+/g, ' ').trim();
+      const shortened = excerpt.length > 400 ? `${excerpt.slice(0, 400)}…` : excerpt;
+      return `📄 ${hit.document_name}:\n"${shortened}"`;
+    });
+    return `Esto es lo que encontré en la base de conocimiento:\n\n${excerpts.join('\n\n')}`;
   };
 
   const generateBotResponse = (userInput: string): string => {
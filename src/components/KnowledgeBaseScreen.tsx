@@ -33,7 +33,10 @@ export function KnowledgeBaseScreen() {
   const loadDocuments = async () => {
     try {
       setIsLoading(true);
-      const response = await api.listDocuments();
+      const response = await api.listDocuments({
+        includeTotal: false,
+        fields: ['id', 'name', 'file_type', 'file_size', 'created_at', 'category', 'status'],
+      });
       
       // Convertir DocumentResponse a Document
       const convertedDocs: Document[] = response.documents.map((doc: DocumentResponse) => ({
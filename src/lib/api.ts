@@ -44,9 +44,53 @@ export interface DocumentResponse {
   processed_at?: string;
 }
 
+export interface CategoryFacet {
+  name: string | null;
+  document_count: number;
+  total_bytes: number;
+  statuses: Record<string, number>;
+}
+
+export interface DocumentFacetsResponse {
+  version: number;
+  total_documents: number;
+  total_bytes: number;
+  statuses: Record<string, number>;
+  categories: CategoryFacet[];
+}
+
+export interface DocumentDownloadUrl {
+  download_url: string;
+  document_id: number;
+  filename: string;
+  expires_in: number;
+}
+
+export interface DownloadUrlBatchResponse {
+  urls: DocumentDownloadUrl[];
+  missing: number[];
+}
+
+export interface SemanticHit {
+  document_id: number;
+  document_name: string;
+  category: string | null;
+  chunk_index: number;
+  score: number;
+  content: string;
+}
+
+export interface SemanticSearchResponse {
+  results: { query: string; hits: SemanticHit[] }[];
+  indexed_chunks: number;
+  took_ms: number;
+}
+
 export interface DocumentListResponse {
-  total: number;
+  total: number | null;
+  total_is_estimate?: boolean;
   documents: DocumentResponse[];
+  next_cursor?: string | null;
 }
 
 /**
@@ -232,6 +276,10 @@ export const api = {
     category?: string;
     status?: string;
     search?: string;
+    tags?: string[];
+    tagsMatch?: 'any' | 'all';
+    fields?: (keyof DocumentResponse)[];
+    includeTotal?: boolean;
     token?: string;
   }): Promise<DocumentListResponse> {
     try {
@@ -241,6 +289,10 @@ export const api = {
       if (params?.category) queryParams.append('category', params.category);
       if (params?.status) queryParams.append('status', params.status);
       if (params?.search) queryParams.append('search', params.search);
+      if (params?.tags?.length) queryParams.append('tags', params.tags.join(','));
+      if (params?.tagsMatch) queryParams.append('tags_match', params.tagsMatch);
+      if (params?.fields?.length) queryParams.append('fields', params.fields.join(','));
+      if (params?.includeTotal === false) queryParams.append('include_total', 'false');
 
       const headers: HeadersInit = {};
       if (params?.token) {
@@ -366,7 +418,7 @@ export const api = {
   async getDownloadUrl(
     documentId: number,
     token?: string
-  ): Promise<{ download_url: string; document_id: number; filename: string }> {
+  ): Promise<DocumentDownloadUrl> {
     try {
       const headers: HeadersInit = {};
       if (token) {
@@ -389,6 +441,81 @@ export const api = {
     }
   },
 
+  /**
+   * Obtener URLs de descarga de varios documentos en una sola petición
+   */
+  async getDownloadUrls(
+    documentIds: number[],
+    token?: string
+  ): Promise<DownloadUrlBatchResponse> {
+    try {
+      const headers: HeadersInit = {
+        'Content-Type': 'application/json',
+      };
+      if (token) {
+        headers['Authorization'] = `Bearer ${token}`;
+      }
+
+      const response = await fetch(`${API_BASE_URL}/api/documents/download-urls`, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify({ ids: documentIds }),
+      });
+
+      if (!response.ok) {
+        const error: ApiError = await response.json();
+        throw new ApiErrorHandler(response.status, error.detail || 'Error al obtener URLs de descarga');
+      }
+
+      return await response.json();
+    } catch (error) {
+      if (error instanceof ApiErrorHandler) {
+        throw error;
+      }
+      throw new ApiErrorHandler(0, 'No se pudo conectar con el servidor.');
+    }
+  },
+
+  /**
+   * Búsqueda semántica: fragmentos de documentos más parecidos a cada consulta
+   */
+  async semanticSearch(
+    queries: string[],
+    options: { topK?: number; category?: string } = {},
+    token?: string
+  ): Promise<SemanticSearchResponse> {
+    try {
+      const headers: HeadersInit = {
+        'Content-Type': 'application/json',
+      };
+      if (token) {
+        headers['Authorization'] = `Bearer ${token}`;
+      }
+
+      const response = await fetch(`${API_BASE_URL}/api/search/semantic`, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify({
+          queries,
+          top_k: options.topK ?? 5,
+          category: options.category ?? null,
+        }),
+      });
+
+      if (!response.ok) {
+        const error: ApiError = await response.json();
+        throw new ApiErrorHandler(response.status, error.detail || 'Error en la búsqueda');
+      }
+
+      return await response.json();
+    } catch (error) {
+      if (error instanceof ApiErrorHandler) {
+        throw error;
+      }
+      throw new ApiErrorHandler(0, 'No se pudo conectar con el servidor.');
+    }
+  },
+
   /**
    * Obtener lista de categorías
    */
@@ -414,6 +541,62 @@ export const api = {
       throw new ApiErrorHandler(0, 'No se pudo conectar con el servidor.');
     }
   },
+
+  /**
+   * Resumen del catálogo por categoría y estado (documentos y bytes)
+   */
+  async getFacets(token?: string): Promise<DocumentFacetsResponse> {
+    try {
+      const headers: HeadersInit = {};
+      if (token) {
+        headers['Authorization'] = `Bearer ${token}`;
+      }
+
+      const response = await fetch(`${API_BASE_URL}/api/documents/facets`, { headers });
+
+      if (!response.ok) {
+        const error: ApiError = await response.json();
+        throw new ApiErrorHandler(response.status, error.detail || 'Error al obtener el resumen de documentos');
+      }
+
+      return await response.json();
+    } catch (error) {
+      if (error instanceof ApiErrorHandler) {
+        throw error;
+      }
+      throw new ApiErrorHandler(0, 'No se pudo conectar con el servidor.');
+    }
+  },
+
+  /**
+   * Listar tags con su número de documentos
+   */
+  async listTags(params?: { prefix?: string; limit?: number; token?: string }): Promise<{ tags: { name: string; count: number }[] }> {
+    try {
+      const queryParams = new URLSearchParams();
+      if (params?.prefix) queryParams.append('prefix', params.prefix);
+      if (params?.limit !== undefined) queryParams.append('limit', params.limit.toString());
+
+      const headers: HeadersInit = {};
+      if (params?.token) {
+        headers['Authorization'] = `Bearer ${params.token}`;
+      }
+
+      const response = await fetch(`${API_BASE_URL}/api/documents/tags?${queryParams.toString()}`, { headers });
+
+      if (!response.ok) {
+        const error: ApiError = await response.json();
+        throw new ApiErrorHandler(response.status, error.detail || 'Error al listar tags');
+      }
+
+      return await response.json();
+    } catch (error) {
+      if (error instanceof ApiErrorHandler) {
+        throw error;
+      }
+      throw new ApiErrorHandler(0, 'No se pudo conectar con el servidor.');
+    }
+  },
 };
 
 /**